@@ -1,8 +1,14 @@
 from django.contrib import admin
-from .models import Game, Track, Car, LeaderboardEntry, Person
+from django.contrib.admin.views.main import ALL_VAR, IS_POPUP_VAR, ORDER_VAR, PAGE_VAR, TO_FIELD_VAR
+from django.core.paginator import Paginator
+from django.db.models import Sum
+from django.utils.functional import cached_property
+from .forms import GameForm
+from .models import Game, Track, Car, LeaderboardEntry, LapRecord, Person, TrackRecord
 
 
 class GameAdmin(admin.ModelAdmin):
+    form = GameForm
     list_display = ('name', 'display_settings')
 
     def display_settings(self, obj):
@@ -22,25 +28,117 @@ class PersonAdmin(admin.ModelAdmin):
     list_display = ('name',)
 
 
+class EstimatedCountPaginator(Paginator):
+    """Takes the number of rows from an estimate, when given, instead of a COUNT(*)."""
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, estimate=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.estimate = estimate
+
+    @cached_property
+    def count(self):
+        return super().count if self.estimate is None else self.estimate
+
+
 class LeaderboardEntryAdmin(admin.ModelAdmin):
-    list_display = ('track', 'car', 'user', 'formatted_time', 'display_next_closest_time', 'display_difference')
+    list_display = ('user', 'game', 'track', 'car', 'formatted_time', 'display_rank', 'display_next_closest_time', 'display_difference', 'logged_at')
+    list_select_related = ('user', 'game', 'track', 'car')
+    list_filter = ('game', 'track', 'car')
+    paginator = EstimatedCountPaginator
+    # The unfiltered total would be one more COUNT(*) over every entry
+    show_full_result_count = False
+
+    # Changelist parameters that don't narrow the rows
+    PAGING_PARAMS = {ALL_VAR, IS_POPUP_VAR, ORDER_VAR, PAGE_VAR, TO_FIELD_VAR}
+    BOARD_FILTERS = {'game__id__exact': 'game_id', 'track__id__exact': 'track_id', 'car__id__exact': 'car_id'}
+
+    def get_queryset(self, request):
+        # Rank, next closest time and difference are looked up per row from the board summaries
+        return super().get_queryset(request).with_board_stats()
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, estimate=self.estimate_count(request))
+
+    def estimate_count(self, request):
+        """
+        Counts entries from the TrackRecord of every matching board when only
+        board filters apply; returns None, for a real count, otherwise.
+        """
+        params = {key: value for key, value in request.GET.items() if key not in self.PAGING_PARAMS}
+        if not set(params) <= set(self.BOARD_FILTERS):
+            return None
+        try:
+            filters = {self.BOARD_FILTERS[key]: int(value) for key, value in params.items()}
+        except ValueError:
+            return None
+        return TrackRecord.objects.filter(**filters).aggregate(total=Sum('entry_count'))['total'] or 0
 
     def formatted_time(self, obj):
         return obj.formatted_time
     formatted_time.short_description = 'Time'
+    formatted_time.admin_order_field = 'time'
+
+    def display_rank(self, obj):
+        return obj.board_rank
+    display_rank.short_description = 'Rank'
+    display_rank.admin_order_field = 'board_rank'
 
     def display_next_closest_time(self, obj):
-        next_time = obj.next_closest_time
+        next_time = obj.board_next_time
         return obj.format_duration(next_time) if next_time else 'N/A'
     display_next_closest_time.short_description = 'Next Closest Time'
+    display_next_closest_time.admin_order_field = 'board_next_time'
 
     def display_difference(self, obj):
-        difference = obj.difference
-        return obj.format_duration(difference) if difference else 'N/A'
+        difference = obj.board_gap
+        return obj.format_duration(difference) if difference is not None else 'N/A'
     display_difference.short_description = 'Difference'
+    display_difference.admin_order_field = 'board_gap'
+
+    # Entries are each driver's best lap and follow from the lap history;
+    # laps go in through the board pages, the API or import_laps
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class TrackRecordAdmin(admin.ModelAdmin):
+    list_display = ('game', 'track', 'car', 'holder', 'formatted_time', 'formatted_gap', 'entry_count', 'updated_at')
+    list_select_related = ('game', 'track', 'car', 'holder')
+
+    # Records are derived from leaderboard entries, edit those instead
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class LapRecordAdmin(admin.ModelAdmin):
+    list_display = ('user', 'game', 'track', 'car', 'formatted_time', 'logged_at')
+    list_select_related = ('user', 'game', 'track', 'car')
+    date_hierarchy = 'logged_at'
+
+    # The lap history is append-only and written by submit_lap() alone, which
+    # keeps it in step with the entries, records and driver stats
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 admin.site.register(Game, GameAdmin)
 admin.site.register(Track, TrackAdmin)
 admin.site.register(Car, CarAdmin)
 admin.site.register(Person, PersonAdmin)
 admin.site.register(LeaderboardEntry, LeaderboardEntryAdmin)
+admin.site.register(TrackRecord, TrackRecordAdmin)
+admin.site.register(LapRecord, LapRecordAdmin)
@@ -0,0 +1,323 @@
+# api.py
+#
+# JSON API for overlays and bots. Lists are paged with an opaque, signed
+# cursor holding the sort key of the last row (keyset pagination), so any page
+# costs the same as the first one. Board pages also carry the rank reached so
+# far in the cursor rather than counting the rows ahead. Rows are built from
+# values(). The only write is the batch lap ingest, see ingest.py.
+
+import hmac
+from datetime import datetime, timedelta
+from functools import wraps
+
+from django.core import signing
+from django.db.models import Q
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from . import ingest, search
+from .instrumentation import query_budget
+from .leaderboards import get_backend, to_ms
+from .models import Car, Game, LapRecord, LeaderboardEntry, Person
+from .views import get_cached_board_or_404
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+MAX_QUERY_LENGTH = 100
+CURSOR_SALT = 'TimeBoards.api.cursor'
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _cursor_value(value):
+    if isinstance(value, timedelta):
+        return {'ms': to_ms(value)}
+    if isinstance(value, datetime):
+        return {'at': value.isoformat()}
+    return value
+
+
+def _from_cursor_value(value):
+    if isinstance(value, dict) and 'ms' in value:
+        return timedelta(milliseconds=value['ms'])
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['at'])
+    return value
+
+
+def encode_cursor(values):
+    return signing.dumps([_cursor_value(value) for value in values], salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor):
+    try:
+        return [_from_cursor_value(value) for value in signing.loads(cursor, salt=CURSOR_SALT)]
+    except (signing.BadSignature, ValueError, TypeError, KeyError, OverflowError):
+        raise BadRequest('Invalid cursor')
+
+
+def cursor_type(model, path):
+    """The Python type a cursor holds for an ordering field such as 'track__name'."""
+    for name in path.split('__'):
+        field = model._meta.get_field(name)
+        model = field.related_model
+    internal_type = field.get_internal_type()
+    if internal_type == 'DurationField':
+        return timedelta
+    if internal_type == 'DateTimeField':
+        return datetime
+    if internal_type.endswith(('AutoField', 'IntegerField')) or field.is_relation:
+        return int
+    return str
+
+
+def after(ordering, values):
+    """Matches the rows sorting after values on the given ordering."""
+    fields = [field.lstrip('-') for field in ordering]
+    condition = Q()
+    for i, field in enumerate(ordering):
+        lookup = f'{fields[i]}__lt' if field.startswith('-') else f'{fields[i]}__gt'
+        condition |= Q(**dict(zip(fields[:i], values[:i])), **{lookup: values[i]})
+    return condition
+
+
+def read_page(request, rows, ordering, carry=0):
+    """
+    Returns one page of a values() queryset sorted by ordering, which must
+    end with a unique field, whether more rows follow, and the values of the
+    cursor it starts after: the sort key, then carry integers put there by
+    the previous page. Fields prefixed with '-' sort descending.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        raise BadRequest('Invalid limit')
+    cursor = request.GET.get('cursor')
+    values = None
+    if cursor:
+        values = decode_cursor(cursor)
+        types = [cursor_type(rows.model, field.lstrip('-')) for field in ordering] + [int] * carry
+        # Cursors of an older format must not reach the database with the wrong types
+        if len(values) != len(types) or not all(
+            isinstance(value, value_type) and not isinstance(value, bool) for value, value_type in zip(values, types)
+        ):
+            raise BadRequest('Invalid cursor')
+        rows = rows.filter(after(ordering, values[:len(ordering)]))
+    page = list(rows.order_by(*ordering)[:limit + 1])
+    return page[:limit], len(page) > limit, values
+
+
+def cursor_after(page, ordering, *carried):
+    """The cursor of the page after the given one, carrying the given integers."""
+    return encode_cursor([page[-1][field.lstrip('-')] for field in ordering] + list(carried))
+
+
+def keyset_page(request, rows, ordering):
+    """Returns one page of rows as read_page() does, plus the cursor of the next page or None."""
+    page, more, _ = read_page(request, rows, ordering)
+    return page, cursor_after(page, ordering) if more else None
+
+
+def lap_time(time):
+    return {'time': LeaderboardEntry.format_duration(time), 'time_ms': to_ms(time)}
+
+
+def api_view(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return JsonResponse(view(request, *args, **kwargs))
+        except BadRequest as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return wrapper
+
+
+@query_budget(1)
+@api_view
+def games(request):
+    rows, next_cursor = keyset_page(request, Game.objects.values('id', 'name'), ['name', 'id'])
+    return {'results': rows, 'next': next_cursor}
+
+
+@query_budget(2)
+@api_view
+def tracks(request, game_id):
+    game = get_object_or_404(Game, id=game_id)
+    combos = Car.objects.filter(game=game).values('id', 'name', 'track_id', 'track__name')
+    rows, next_cursor = keyset_page(request, combos, ['track__name', 'name', 'id'])
+    return {
+        'results': [
+            {'track': {'id': row['track_id'], 'name': row['track__name']}, 'car': {'id': row['id'], 'name': row['name']}}
+            for row in rows
+        ],
+        'next': next_cursor,
+    }
+
+
+@query_budget(4)
+@api_view
+def board(request, game_id, track_id, car_id):
+    game, track, car = get_cached_board_or_404(game_id, track_id, car_id)
+    entries = LeaderboardEntry.objects.filter(game=game, track=track, car=car).values('user_id', 'user__name', 'time', 'logged_at')
+    # Ties break on the driver as in the board backends; the cursor carries
+    # how many rows came before the page and the rank of the last of them
+    ordering = ['time', 'user_id']
+    rows, more, cursor = read_page(request, entries, ordering, carry=2)
+    previous_time, _, position, rank = cursor or (None, None, 0, 0)
+    results = []
+    for row in rows:
+        if row['time'] != previous_time:
+            rank = position + 1
+        position, previous_time = position + 1, row['time']
+        results.append({
+            'rank': rank,
+            'driver': {'id': row['user_id'], 'name': row['user__name']},
+            **lap_time(row['time']),
+            'logged_at': row['logged_at'],
+        })
+    return {
+        'game': {'id': game.id, 'name': game.name},
+        'track': {'id': track.id, 'name': track.name},
+        'car': {'id': car.id, 'name': car.name},
+        'results': results,
+        'next': cursor_after(rows, ordering, position, rank) if more else None,
+    }
+
+
+@query_budget(8)
+@api_view
+def board_driver(request, game_id, track_id, car_id, person_id):
+    game, track, car = get_cached_board_or_404(game_id, track_id, car_id)
+    board = (game.id, track.id, car.id)
+    backend = get_backend()
+    rank = backend.rank(board, person_id)
+    if rank is None:
+        return {'rank': None, 'gap_to_next': None, 'around': []}
+    gap = backend.gap_to_next(board, person_id)
+    return {
+        'rank': rank,
+        'gap_to_next': lap_time(gap) if gap is not None else None,
+        'around': [
+            {'rank': row.rank, 'driver': {'id': row.user_id, 'name': row.name}, **lap_time(row.time)}
+            for row in backend.around(board, person_id)
+        ],
+    }
+
+
+@query_budget(1)
+@api_view
+def drivers(request):
+    rows, next_cursor = keyset_page(request, Person.objects.values('id', 'name'), ['name', 'id'])
+    return {'results': rows, 'next': next_cursor}
+
+
+@query_budget(2)
+@api_view
+def driver_times(request, person_id):
+    person = get_object_or_404(Person, id=person_id)
+    entries = LeaderboardEntry.objects.filter(user=person).values(
+        'id', 'time', 'logged_at', 'game_id', 'game__name', 'track_id', 'track__name', 'car_id', 'car__name',
+    )
+    rows, next_cursor = keyset_page(request, entries, ['time', 'id'])
+    return {
+        'driver': {'id': person.id, 'name': person.name},
+        'results': [
+            {
+                'game': {'id': row['game_id'], 'name': row['game__name']},
+                'track': {'id': row['track_id'], 'name': row['track__name']},
+                'car': {'id': row['car_id'], 'name': row['car__name']},
+                **lap_time(row['time']),
+                'logged_at': row['logged_at'],
+            }
+            for row in rows
+        ],
+        'next': next_cursor,
+    }
+
+
+@query_budget(5)
+@api_view
+def driver_progression(request, person_id, game_id, track_id, car_id):
+    person = get_object_or_404(Person, id=person_id)
+    game, track, car = get_cached_board_or_404(game_id, track_id, car_id)
+    laps = LapRecord.objects.progression(person, game.id, track.id, car.id).values('time', 'logged_at')
+    results, previous_best = [], None
+    for lap in laps:
+        results.append({
+            **lap_time(lap['time']),
+            'improvement_ms': to_ms(previous_best - lap['time']) if previous_best else None,
+            'logged_at': lap['logged_at'],
+        })
+        previous_best = lap['time']
+    return {'driver': {'id': person.id, 'name': person.name}, 'results': results}
+
+
+@query_budget(1)
+@api_view
+def recent_laps(request):
+    try:
+        days = max(int(request.GET.get('days', 7)), 0)
+    except ValueError:
+        raise BadRequest('Invalid days')
+    laps = LapRecord.objects.recent(days).values(
+        'id', 'time', 'logged_at', 'user_id', 'user__name', 'game_id', 'track_id', 'car_id',
+    )
+    rows, next_cursor = keyset_page(request, laps, ['-logged_at', '-id'])
+    return {
+        'results': [
+            {
+                'driver': {'id': row['user_id'], 'name': row['user__name']},
+                'board': {'game': row['game_id'], 'track': row['track_id'], 'car': row['car_id']},
+                **lap_time(row['time']),
+                'logged_at': row['logged_at'],
+            }
+            for row in rows
+        ],
+        'next': next_cursor,
+    }
+
+
+# Only queries to load a kind's index, or twice per kind too large to index
+@query_budget(2 * len(search.KINDS))
+@api_view
+def search_names(request):
+    """
+    Names matching ?q= for typeaheads, best first. ?kind= narrows it to
+    comma-separated kinds of driver, game, track and car.
+    """
+    text = request.GET.get('q', '')[:MAX_QUERY_LENGTH]
+    kinds = request.GET.get('kind')
+    kinds = kinds.split(',') if kinds else list(search.KINDS)
+    if not set(kinds) <= set(search.KINDS):
+        raise BadRequest('Invalid kind')
+    try:
+        limit = min(max(int(request.GET.get('limit', SEARCH_LIMIT)), 1), MAX_SEARCH_LIMIT)
+    except ValueError:
+        raise BadRequest('Invalid limit')
+    return {'results': search.get_index().search(text, kinds, limit)}
+
+
+@csrf_exempt
+@require_POST
+def ingest_laps(request):
+    token = ingest.get_config()['TOKEN']
+    if not token:
+        # The view is csrf_exempt, so without a token nobody may post
+        return JsonResponse({'error': 'Lap ingest is not configured'}, status=403)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return JsonResponse({'error': 'Invalid token'}, status=401)
+    try:
+        body, queued = ingest.ingest(ingest.read_payload(request))
+    except ingest.InvalidBatch as e:
+        return JsonResponse({'error': str(e), 'laps': e.errors}, status=400)
+    except ingest.BufferFull:
+        response = JsonResponse({'error': 'Too many laps queued, retry shortly'}, status=503)
+        response['Retry-After'] = '1'
+        return response
+    return JsonResponse(body, status=202 if queued else 200)
@@ -0,0 +1,16 @@
+from django.urls import path
+from . import api
+
+
+urlpatterns = [
+    path('games/', api.games, name='api_games'),
+    path('games/<int:game_id>/tracks/', api.tracks, name='api_tracks'),
+    path('boards/<int:game_id>/<int:track_id>/<int:car_id>/', api.board, name='api_board'),
+    path('boards/<int:game_id>/<int:track_id>/<int:car_id>/drivers/<int:person_id>/', api.board_driver, name='api_board_driver'),
+    path('drivers/', api.drivers, name='api_drivers'),
+    path('drivers/<int:person_id>/times/', api.driver_times, name='api_driver_times'),
+    path('drivers/<int:person_id>/progression/<int:game_id>/<int:track_id>/<int:car_id>/', api.driver_progression, name='api_driver_progression'),
+    path('search/', api.search_names, name='api_search'),
+    path('laps/recent/', api.recent_laps, name='api_recent_laps'),
+    path('laps/', api.ingest_laps, name='api_ingest_laps'),
+]
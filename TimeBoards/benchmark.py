@@ -0,0 +1,306 @@
+# benchmark.py
+#
+# Synthetic datasets and view timings for the seed_benchmark, benchmark_views
+# and benchmark_concurrency commands. Datasets are generated from a seeded
+# Random, so the same size and seed always give the same rows, and popularity
+# of games, boards and drivers follows a Zipf curve like real communities do:
+# a few boards and regulars hold most of the laps.
+
+import asyncio
+import gc
+import itertools
+import random
+import re
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from statistics import median, quantiles
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.db import connection, connections, transaction
+from django.db.models import Count
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, resolve, reverse
+
+from . import cache
+from .leaderboards import get_backend
+from .models import Car, DriverBoardStat, Game, LapRecord, LeaderboardEntry, Person, Track, TrackRecord
+
+SIZES = {
+    'small': {'games': 2, 'tracks': 5, 'cars': 3, 'drivers': 200, 'laps': 20_000},
+    'medium': {'games': 5, 'tracks': 10, 'cars': 4, 'drivers': 2_000, 'laps': 200_000},
+    'large': {'games': 10, 'tracks': 20, 'cars': 5, 'drivers': 10_000, 'laps': 1_000_000},
+}
+
+# Laps are spread over the year before this date, so reruns match exactly
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+BATCH_SIZE = 5000
+
+FIRST_NAMES = ['Alex', 'Sam', 'Jo', 'Kim', 'Max', 'Ari', 'Lou', 'Rin', 'Noa', 'Eli', 'Sky', 'Ash', 'Kai', 'Mel', 'Tam', 'Val']
+LAST_NAMES = ['Rossi', 'Senna', 'Hill', 'Clark', 'Prost', 'Lauda', 'Hunt', 'Moss', 'Stewart', 'Brabham', 'Villeneuve', 'Hakkinen']
+GAME_NAMES = ['Apex', 'Grip', 'Slipstream', 'Redline', 'Downforce', 'Chicane', 'Pitlane', 'Paddock', 'Kerb', 'Gravel']
+TRACK_NAMES = ['Ring', 'Park', 'Circuit', 'Raceway', 'Speedway', 'Hill', 'Valley', 'Harbour', 'Forest', 'Canyon']
+CAR_CLASSES = ['GT3', 'GT4', 'LMP2', 'Formula', 'Touring', 'Rally', 'Kart']
+
+
+def zipf_weights(n, exponent=1.1):
+    """Cumulative weights giving the k-th of n items a share of 1/k**exponent."""
+    return list(itertools.accumulate(1 / (k ** exponent) for k in range(1, n + 1)))
+
+
+def seed(games, tracks, cars, drivers, laps, seed=0, batch_size=BATCH_SIZE, progress=None):
+    """
+    Creates games with tracks and cars, drivers, and laps picked by skewed
+    popularity. Every lap is appended to the history and the fastest one per
+    driver and board becomes their entry. Returns the number of rows created.
+    """
+    rng = random.Random(seed)
+    created = {}
+    with transaction.atomic():
+        game_rows = Game.objects.bulk_create(
+            Game(name=f'{GAME_NAMES[i % len(GAME_NAMES)]} Racing {i + 1}', settings={'gameSettings': {'laps': 3 + i % 5}})
+            for i in range(games)
+        )
+        track_rows = Track.objects.bulk_create(
+            Track(name=f'{TRACK_NAMES[i % len(TRACK_NAMES)]} {i + 1}', game=game)
+            for game in game_rows for i in range(tracks)
+        )
+        car_rows = Car.objects.bulk_create(
+            Car(name=f'{CAR_CLASSES[i % len(CAR_CLASSES)]} #{i + 1}', game=track.game, track=track)
+            for track in track_rows for i in range(cars)
+        )
+        people = Person.objects.bulk_create(
+            Person(name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i + 1}')
+            for i in range(drivers)
+        )
+    created.update(games=len(game_rows), tracks=len(track_rows), cars=len(car_rows), people=len(people))
+
+    # A board's base time is between one and three minutes; a driver's skill
+    # adds up to 15% on every board, plus noise per lap
+    boards = [(car.game_id, car.track_id, car.id) for car in car_rows]
+    rng.shuffle(boards)
+    rng.shuffle(people)
+    base_ms = [rng.randint(60_000, 180_000) for _ in boards]
+    skill = [rng.random() * 0.15 for _ in people]
+    board_weights = zipf_weights(len(boards))
+    driver_weights = zipf_weights(len(people))
+    span_ms = int(timedelta(days=365) / timedelta(milliseconds=1))
+
+    best = {}
+    remaining = laps
+    while remaining > 0:
+        count = min(batch_size, remaining)
+        remaining -= count
+        picked_boards = rng.choices(range(len(boards)), cum_weights=board_weights, k=count)
+        picked_drivers = rng.choices(range(len(people)), cum_weights=driver_weights, k=count)
+        batch = []
+        for b, d in zip(picked_boards, picked_drivers):
+            lap_ms = int(base_ms[b] * (1 + skill[d] + abs(rng.gauss(0, 0.01))))
+            logged_at = EPOCH - timedelta(milliseconds=rng.randrange(span_ms))
+            game_id, track_id, car_id = boards[b]
+            lap = LapRecord(game_id=game_id, track_id=track_id, car_id=car_id, user_id=people[d].pk,
+                            time=timedelta(milliseconds=lap_ms), logged_at=logged_at)
+            batch.append(lap)
+            key = (b, d)
+            if key not in best or lap.time < best[key].time:
+                best[key] = lap
+        LapRecord.objects.bulk_create(batch)
+        if progress:
+            progress(laps - remaining, laps)
+    created['laps'] = laps
+
+    laps_by_entry = iter(best.values())
+    while batch := list(itertools.islice(laps_by_entry, batch_size)):
+        entries = LeaderboardEntry.objects.bulk_create(
+            LeaderboardEntry(game_id=lap.game_id, track_id=lap.track_id, car_id=lap.car_id, user_id=lap.user_id, time=lap.time)
+            for lap in batch
+        )
+        # auto_now stamped them with the current time; bulk_update() keeps the lap's
+        for entry, lap in zip(entries, batch):
+            entry.logged_at = lap.logged_at
+        LeaderboardEntry.objects.bulk_update(entries, ['logged_at'])
+    created['entries'] = len(best)
+
+    created['records'] = len(TrackRecord.objects.rebuild())
+    created['driver_board_stats'] = len(DriverBoardStat.objects.rebuild())
+    get_backend().resync()
+    cache.bump(cache.CATALOG, cache.PEOPLE, cache.RECORDS)
+    return created
+
+
+
+# Live streams never end, so they can't be timed like a page, and lap ingest only takes POSTs
+SKIPPED_VIEWS = {'board_stream', 'live_feed', 'api_ingest_laps'}
+
+ADMIN_CHANGELISTS = ['leaderboardentry', 'laprecord', 'trackrecord']
+
+
+def sample_kwargs():
+    """URL arguments pointing at the busiest board and the busiest driver."""
+    record = TrackRecord.objects.order_by('-entry_count', 'id').first()
+    driver = LeaderboardEntry.objects.values('user_id').annotate(boards=Count('id')).order_by('-boards', 'user_id').first()
+    return {
+        'game_id': record.game_id,
+        'track_id': record.track_id,
+        'car_id': record.car_id,
+        'person_id': driver['user_id'],
+    }
+
+
+def view_routes(patterns, prefix='/'):
+    """Yields (route, name) for every view under the given URL patterns."""
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from view_routes(pattern.url_patterns, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern) and pattern.name not in SKIPPED_VIEWS:
+            yield prefix + str(pattern.pattern), pattern.name
+
+
+def benchmark_urls(kwargs):
+    """Maps a report key to the URL to time, for every page and admin changelist."""
+    from . import urls
+    fill = lambda route: re.sub(r'<(?:\w+:)?(\w+)>', lambda m: str(kwargs[m.group(1)]), route)
+    found = {route: fill(route) for route, name in view_routes(urls.urlpatterns)}
+    for model in ADMIN_CHANGELISTS:
+        found[f'admin:{model}'] = reverse(f'admin:TimeBoards_{model}_changelist')
+    return found
+
+
+def timed_get(client, url):
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = client.get(url)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        elapsed = time.perf_counter() - started
+    return response.status_code, elapsed * 1000, len(queries)
+
+
+def peak_memory(client, url):
+    """Peak KiB allocated by Python while serving the URL."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        timed_get(client, url)
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def measure(client, url, repeat=5):
+    """
+    Times one request with empty caches and the median of repeat more with
+    warm ones, counting queries, then measures peak memory on its own pass
+    since tracing slows everything down.
+    """
+    cache.get_cache().clear()
+    status, cold_ms, cold_queries = timed_get(client, url)
+    warm = [timed_get(client, url) for _ in range(repeat)]
+    return {
+        'status': status,
+        'cold_ms': round(cold_ms, 2),
+        'cold_queries': cold_queries,
+        'warm_ms': round(median(ms for _, ms, _ in warm), 2) if warm else None,
+        'warm_queries': warm[-1][2] if warm else None,
+        'peak_kib': peak_memory(client, url),
+    }
+
+
+def async_urls(urls):
+    """The URLs, of those given, served by async views."""
+    return {key: url for key, url in urls.items() if not key.startswith('admin:') and iscoroutinefunction(resolve(url).func)}
+
+
+def summarize(latencies, statuses, seconds):
+    latencies = sorted(latencies)
+    # Only pages served whole count towards throughput
+    ok = sum(status == 200 for status in statuses)
+    return {
+        'requests': len(latencies),
+        'errors': len(statuses) - ok,
+        'req_per_s': round(ok / seconds, 1),
+        'p50_ms': round(median(latencies), 2),
+        'p95_ms': round(quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0], 2),
+    }
+
+
+def run_wsgi(urls, viewers, requests):
+    """
+    Serves requests pages to each of viewers concurrent viewers through the
+    WSGI handler, one thread per viewer like a threaded gunicorn worker.
+    """
+    urls = list(urls)
+    latencies, statuses = [], []
+
+    def viewer(offset):
+        client = Client(raise_request_exception=False)
+        try:
+            for i in range(requests):
+                started = time.perf_counter()
+                response = client.get(urls[(offset + i) % len(urls)])
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses.append(response.status_code)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=viewers) as pool:
+        list(pool.map(viewer, range(viewers)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+async def run_asgi(urls, viewers, requests):
+    """The same load through the ASGI handler, every viewer a task on one event loop."""
+    urls = list(urls)
+    latencies, statuses = [], []
+
+    async def viewer(offset):
+        client = AsyncClient(raise_request_exception=False)
+        for i in range(requests):
+            started = time.perf_counter()
+            response = await client.get(urls[(offset + i) % len(urls)])
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses.append(response.status_code)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(viewer(offset) for offset in range(viewers)))
+    finally:
+        await sync_to_async(connections.close_all)()
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+class BrokenPage(Exception):
+    pass
+
+
+def check_status(url, status):
+    if status != 200:
+        raise BrokenPage(f'{url} answered {status}, not 200')
+
+
+def warm_up(urls):
+    """Loads every URL once with empty caches; raises BrokenPage unless all answer 200."""
+    client = Client()
+    cache.get_cache().clear()
+    for url in urls.values():
+        check_status(url, client.get(url).status_code)
+
+
+def compare_deployments(urls, viewers, requests=20):
+    """
+    Throughput and latency of the given pages for each number of concurrent
+    viewers, served the WSGI way and the ASGI way. Warm caches first with
+    warm_up(), the numbers are meant for the steady state of a busy board.
+    Responses other than 200 are counted as errors, not throughput.
+    """
+    return {
+        count: {
+            'wsgi': run_wsgi(urls, count, requests),
+            'asgi': asyncio.run(run_asgi(urls, count, requests)),
+        }
+        for count in viewers
+    }
@@ -0,0 +1,154 @@
+# cache.py
+#
+# Versioned caching for boards, drivers and the game catalog. Every scope has
+# a version counter in the cache that signals.py bumps whenever a row feeding
+# that scope changes, so stale entries are never read again and simply expire.
+#
+# Versions only reach the processes that share the cache. A per-process
+# LocMemCache is fine for one worker; with WEB_CONCURRENCY above one the
+# system check below requires a shared backend.
+
+import hashlib
+import os
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+CATALOG = 'catalog'
+PEOPLE = 'people'
+RECORDS = 'records'
+STANDINGS = 'standings'
+
+TIMEOUT = getattr(settings, 'TIMEBOARDS_CACHE_TIMEOUT', 300)
+
+stats = Counter()
+
+_missing = object()
+
+
+def get_cache():
+    return caches[getattr(settings, 'TIMEBOARDS_CACHE', 'default')]
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    try:
+        workers = int(os.environ.get('WEB_CONCURRENCY') or 1)
+    except ValueError:
+        workers = 1
+    if workers > 1 and isinstance(get_cache(), LocMemCache):
+        return [checks.Error(
+            f'WEB_CONCURRENCY is {workers} but the TimeBoards cache is a per-process LocMemCache.',
+            hint='Use a cache every worker shares, such as Redis or FileBasedCache, so version bumps reach them all.',
+            id='TimeBoards.E001',
+        )]
+    return []
+
+
+def board_scope(game_id, track_id, car_id):
+    return f'board:{game_id}:{track_id}:{car_id}'
+
+
+def game_scope(game_id):
+    return f'game:{game_id}'
+
+
+def person_scope(person_id):
+    return f'person:{person_id}'
+
+
+def _version_key(scope):
+    return f'timeboards:version:{scope}'
+
+
+def _new_version():
+    # Seeded from the clock so a counter that was evicted never reuses
+    # a version that may still have entries cached against it.
+    return time.time_ns() // 1000
+
+
+def version_tag(*scopes):
+    """Returns one string combining the current version of every scope."""
+    cache = get_cache()
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_version(), timeout=None)
+            found[key] = cache.get(key)
+    return '.'.join(str(found[key]) for key in keys)
+
+
+async def aversion_tag(*scopes):
+    """Async version_tag(), for async views."""
+    cache = get_cache()
+    keys = [_version_key(scope) for scope in scopes]
+    found = await cache.aget_many(keys)
+    for key in keys:
+        if key not in found:
+            await cache.aadd(key, _new_version(), timeout=None)
+            found[key] = await cache.aget(key)
+    return '.'.join(str(found[key]) for key in keys)
+
+
+def bump(*scopes):
+    """Invalidates everything cached against the given scopes."""
+    cache = get_cache()
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            cache.add(_version_key(scope), _new_version(), timeout=None)
+
+
+def _fetch_key(name, tag):
+    if len(tag) > 64:
+        # Drivers on many boards have long tags; memcached caps keys at 250 bytes
+        tag = hashlib.md5(tag.encode()).hexdigest()
+    return f'timeboards:{name}:{tag}'
+
+
+def fetch(name, tag, producer, timeout=TIMEOUT):
+    """
+    Returns the value cached under name and version tag, calling producer to
+    build and store it on a miss. Hits and misses are counted per name.
+    """
+    cache = get_cache()
+    key = _fetch_key(name, tag)
+    value = cache.get(key, _missing)
+    kind = name.split(':', 1)[0]
+    if value is _missing:
+        stats[f'{kind}.misses'] += 1
+        value = producer()
+        cache.set(key, value, timeout)
+    else:
+        stats[f'{kind}.hits'] += 1
+    return value
+
+
+async def afetch(name, tag, producer, timeout=TIMEOUT):
+    """Async fetch(); producer is a coroutine function."""
+    cache = get_cache()
+    key = _fetch_key(name, tag)
+    value = await cache.aget(key, _missing)
+    kind = name.split(':', 1)[0]
+    if value is _missing:
+        stats[f'{kind}.misses'] += 1
+        value = await producer()
+        await cache.aset(key, value, timeout)
+    else:
+        stats[f'{kind}.hits'] += 1
+    return value
+
+
+def cache_stats():
+    """Hit and miss counters of this process, per kind of cached value."""
+    return {
+        'hits': sum(count for key, count in stats.items() if key.endswith('.hits')),
+        'misses': sum(count for key, count in stats.items() if key.endswith('.misses')),
+        'by_name': dict(stats),
+    }
@@ -0,0 +1,87 @@
+# exports.py
+#
+# Flat-memory CSV/NDJSON dumps of leaderboard entries. Rows are read with
+# values_list() through iterator(), so nothing is held beyond one chunk, and
+# the columns match what the import_laps command reads back in.
+#
+# Under ASGI Django would collect a sync iterator into a list before sending
+# it, so aexport_lines() pulls one chunk at a time in the sync thread instead.
+
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from .leaderboards import to_ms
+from .models import LeaderboardEntry
+
+COLUMNS = ['game', 'track', 'car', 'driver', 'time', 'time_ms', 'logged_at']
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+CHUNK_SIZE = 2000
+
+
+def board_entries(game_id, track_id, car_id):
+    return LeaderboardEntry.objects.filter(game_id=game_id, track_id=track_id, car_id=car_id).order_by('time', 'user_id')
+
+
+def car_entries(car_id):
+    return LeaderboardEntry.objects.filter(car_id=car_id).order_by('time', 'user_id')
+
+
+def person_entries(person_id):
+    return LeaderboardEntry.objects.filter(user_id=person_id).order_by('time', 'id')
+
+
+def all_entries():
+    return LeaderboardEntry.objects.order_by('game', 'track', 'car', 'time', 'user_id')
+
+
+def export_rows(entries):
+    rows = entries.values_list('game__name', 'track__name', 'car__name', 'user__name', 'time', 'logged_at')
+    for game, track, car, driver, time, logged_at in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield (
+            game, track, car, driver,
+            LeaderboardEntry.format_duration(time),
+            to_ms(time),
+            logged_at.isoformat(),
+        )
+
+
+class _Echo:
+    """File-like object that hands each written line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, row))) + '\n'
+
+
+def export_lines(entries, fmt):
+    lines = csv_lines if fmt == 'csv' else ndjson_lines
+    return lines(export_rows(entries))
+
+
+async def aexport_lines(entries, fmt):
+    """export_lines() as an async iterator, joining each chunk of lines into one."""
+    lines = export_lines(entries, fmt)
+    # The cursor behind iterator() belongs to the thread that opened it
+    next_chunk = sync_to_async(lambda: ''.join(islice(lines, CHUNK_SIZE)), thread_sensitive=True)
+    try:
+        while chunk := await next_chunk():
+            yield chunk
+    finally:
+        await sync_to_async(lines.close, thread_sensitive=True)()
@@ -1,8 +1,36 @@
 # forms.py
 
 from django import forms
+from django.urls import reverse
+from . import search
 from .models import LeaderboardEntry, Person, Game
+from .services import submit_lap
 from datetime import timedelta
+import json
+
+class TypeaheadSelect(forms.Widget):
+    """
+    Picks a row by typing its name. Suggestions come from api/search/, so
+    unlike a <select> the page doesn't carry every row of the table.
+    """
+    template_name = 'TimeBoards/widgets/typeahead.html'
+
+    class Media:
+        js = ['TimeBoards/js/typeahead.js']
+
+    def __init__(self, kind, attrs=None):
+        super().__init__(attrs)
+        self.kind = kind
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        # Shows the name of a chosen row again when the form comes back with errors
+        try:
+            label = search.KINDS[self.kind].model.objects.filter(pk=value).values_list('name', flat=True).first() if value else None
+        except (TypeError, ValueError):
+            label = None
+        context['widget'].update(label=label or '', url=f"{reverse('api_search')}?kind={self.kind}")
+        return context
 
 class LeaderboardEntryForm(forms.ModelForm):
     minutes = forms.IntegerField(min_value=0, label="Minutes")
@@ -13,7 +41,7 @@ class LeaderboardEntryForm(forms.ModelForm):
         model = LeaderboardEntry
         fields = ['user', 'minutes', 'seconds', 'milliseconds']
         widgets = {
-            'user': forms.Select(attrs={'class': 'form-select'}),
+            'user': TypeaheadSelect('driver', attrs={'class': 'form-control'}),
         }
 
     def clean(self):
@@ -22,15 +50,47 @@ class LeaderboardEntryForm(forms.ModelForm):
         seconds = cleaned_data.get('seconds') or 0
         milliseconds = cleaned_data.get('milliseconds') or 0
         cleaned_data['time'] = timedelta(minutes=minutes, seconds=seconds, milliseconds=milliseconds)
+        if {'minutes', 'seconds', 'milliseconds'} <= cleaned_data.keys() and not cleaned_data['time']:
+            raise forms.ValidationError("Enter a lap time above zero.")
         return cleaned_data
 
     def save(self, commit=True):
+        """
+        Submits the lap with submit_lap(), so it is added to the lap history
+        and only replaces the entry when faster. Returns the driver's entry
+        on the board; without commit, the unsaved lap.
+        """
         instance = super().save(commit=False)
         instance.time = self.cleaned_data['time']
         if commit:
-            instance.save()
+            result = submit_lap(instance.user, instance.game, instance.track, instance.car, instance.time)
+            instance = result.entry or LeaderboardEntry.objects.get(track=instance.track, car=instance.car, user=instance.user)
         return instance
 
+class AddLeaderboardEntryForm(LeaderboardEntryForm):
+    class Meta(LeaderboardEntryForm.Meta):
+        fields = ['track', 'car', 'user', 'game', 'minutes', 'seconds', 'milliseconds']
+        widgets = {
+            **LeaderboardEntryForm.Meta.widgets,
+            'track': TypeaheadSelect('track', attrs={'class': 'form-control'}),
+            'car': TypeaheadSelect('car', attrs={'class': 'form-control'}),
+            'game': TypeaheadSelect('game', attrs={'class': 'form-control'}),
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        game, track, car = (cleaned_data.get(name) for name in ('game', 'track', 'car'))
+        # Only a car on that game and track makes a board
+        if game and track and track.game_id != game.id:
+            self.add_error('track', "This track is not part of the selected game.")
+        elif game and track and car and (car.game_id, car.track_id) != (game.id, track.id):
+            self.add_error('car', "This car is not on the selected track.")
+        return cleaned_data
+
+    def validate_unique(self):
+        # An existing entry is improved by submit_lap() rather than rejected
+        pass
+
 class GameForm(forms.ModelForm):
     class Meta:
         model = Game
@@ -40,6 +100,23 @@ class GameForm(forms.ModelForm):
             'settings': forms.Textarea(attrs={'class': 'form-control', 'rows': 3})
         }
 
+    def clean_settings(self):
+        # Stored as an object holding a 'gameSettings' object, so pages can read it as is
+        settings = self.cleaned_data.get('settings')
+        if isinstance(settings, str):
+            # JSON that was posted as a quoted string
+            try:
+                settings = json.loads(settings)
+            except ValueError:
+                raise forms.ValidationError("Settings must be a JSON object.")
+        if settings is None:
+            settings = {}
+        if not isinstance(settings, dict):
+            raise forms.ValidationError("Settings must be a JSON object.")
+        if not isinstance(settings.setdefault('gameSettings', {}), dict):
+            raise forms.ValidationError('"gameSettings" must be a JSON object.')
+        return settings
+
 class AddTrackForm(forms.Form):
     track_name = forms.CharField(label='Track Name', max_length=100)
     car_name = forms.CharField(label='Car Name', max_length=100)
@@ -0,0 +1,220 @@
+# ingest.py
+#
+# Batch lap submissions for telemetry plugins and race control stations. One
+# POST carries up to MAX_LAPS laps as JSON, optionally gzip-compressed. They
+# are validated together against cached id lookups, then applied by
+# services.submit_laps() in one transaction.
+#
+# With write-behind on, validated laps are queued in memory instead. A
+# background thread flushes everything queued every FLUSH_INTERVAL seconds as
+# one batch, so a response no longer waits for a commit. Queued laps are lost
+# if the process dies before the next flush; stations that need every lap
+# acknowledged as stored should stay on the default synchronous mode.
+#
+# Configure with the LEADERBOARD_INGEST setting:
+#     WRITE_BEHIND: queue laps and flush them periodically, default False.
+#     FLUSH_INTERVAL: seconds between flushes, default 1.
+#     MAX_PENDING: laps a process may hold before refusing more, default 10000.
+#     TOKEN: requests need an "Authorization: Bearer <TOKEN>" header. Unset,
+#         the default, every request is refused with 403.
+
+import atexit
+import json
+import logging
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import OperationalError, close_old_connections
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache
+from .models import Car, LeaderboardEntry, Person
+from .services import Lap, submit_laps
+
+logger = logging.getLogger(__name__)
+
+MAX_LAPS = 1000
+# Decompressed size; a gzip body may not inflate past this
+MAX_BODY_BYTES = 4 * 1024 * 1024
+
+
+class InvalidBatch(Exception):
+    """Raised with a message and, for bad laps, one error per lap."""
+
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = list(errors)
+
+
+class BufferFull(Exception):
+    pass
+
+
+def read_payload(request):
+    """Decodes the request body, inflating it first when sent gzip-encoded."""
+    body = request.body
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = inflater.decompress(body, MAX_BODY_BYTES)
+        except zlib.error:
+            raise InvalidBatch('Invalid gzip body')
+        if inflater.unconsumed_tail:
+            raise InvalidBatch(f'Body inflates past {MAX_BODY_BYTES} bytes')
+    try:
+        return json.loads(body)
+    except (UnicodeDecodeError, ValueError):
+        raise InvalidBatch('Invalid JSON')
+
+
+def car_boards():
+    """Maps every car id to its (game_id, track_id), cached until the catalog changes."""
+    return cache.fetch(
+        'ingest:cars', cache.version_tag(cache.CATALOG),
+        lambda: {car_id: (game_id, track_id) for car_id, game_id, track_id in Car.objects.values_list('id', 'game_id', 'track_id')},
+        timeout=None,
+    )
+
+
+def person_ids():
+    """The ids of every driver, cached until a driver is added or removed."""
+    return cache.fetch('ingest:people', cache.version_tag(cache.PEOPLE),
+                       lambda: set(Person.objects.values_list('id', flat=True)), timeout=None)
+
+
+def _lap_time(lap):
+    if 'time_ms' in lap:
+        time_ms = lap['time_ms']
+        if not isinstance(time_ms, int) or isinstance(time_ms, bool):
+            raise ValueError('time_ms must be an integer')
+        return LeaderboardEntry.parse_duration(time_ms)
+    return LeaderboardEntry.parse_duration(lap['time'])
+
+
+def parse_laps(payload, received_at):
+    """
+    Returns the laps of a payload as Lap tuples, or raises InvalidBatch
+    listing every bad lap. The payload is {"laps": [...]}; each lap has a
+    driver and car id and a time as "01:23:456" or time_ms. game and track
+    are optional but must match the car. Keys given next to "laps" are
+    defaults for every lap, for stations posting a single board.
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('laps'), list):
+        raise InvalidBatch('Expected an object with a list of laps')
+    if not payload['laps']:
+        raise InvalidBatch('No laps')
+    if len(payload['laps']) > MAX_LAPS:
+        raise InvalidBatch(f'At most {MAX_LAPS} laps per request')
+    defaults = {key: payload[key] for key in ('game', 'track', 'car', 'driver') if key in payload}
+    boards, people = car_boards(), person_ids()
+
+    laps, errors = [], []
+    for index, lap in enumerate(payload['laps']):
+        try:
+            if not isinstance(lap, dict):
+                raise ValueError('lap must be an object')
+            lap = {**defaults, **lap}
+            car_id, user_id = lap['car'], lap['driver']
+            if car_id not in boards:
+                raise ValueError(f'unknown car {car_id!r}')
+            if user_id not in people:
+                raise ValueError(f'unknown driver {user_id!r}')
+            game_id, track_id = boards[car_id]
+            if lap.get('game', game_id) != game_id or lap.get('track', track_id) != track_id:
+                raise ValueError(f'car {car_id} is not on that game and track')
+            lap_time = _lap_time(lap)
+            if not lap_time:
+                raise ValueError('time must be positive')
+        except KeyError as e:
+            errors.append({'index': index, 'error': f'missing {e.args[0]}'})
+        except (TypeError, ValueError) as e:
+            errors.append({'index': index, 'error': str(e)})
+        else:
+            laps.append(Lap(user_id, game_id, track_id, car_id, lap_time, received_at))
+    if errors:
+        raise InvalidBatch(f'{len(errors)} invalid laps', errors)
+    return laps
+
+
+class WriteBehindBuffer:
+    """Collects validated laps from many requests and flushes them as one batch."""
+
+    def __init__(self, interval=1.0, max_pending=10000):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+
+    def add(self, laps):
+        """Queues laps; returns False without queueing any when the buffer is full."""
+        with self.lock:
+            if len(self.pending) + len(laps) > self.max_pending:
+                return False
+            self.pending.extend(laps)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='timeboards-ingest', daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+        return True
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            self.flush()
+            close_old_connections()
+
+    def flush(self):
+        """Writes everything queued so far; returns the BatchResult, or None."""
+        with self.flush_lock:
+            with self.lock:
+                laps, self.pending = self.pending, []
+            if not laps:
+                return None
+            try:
+                return submit_laps(laps)
+            except OperationalError:
+                # Most likely a busy database; keep the laps for the next flush
+                logger.exception('Could not flush %d queued laps, retrying', len(laps))
+                with self.lock:
+                    self.pending[:0] = laps
+            except Exception:
+                logger.exception('Dropped %d queued laps', len(laps))
+
+
+def get_config():
+    return {'WRITE_BEHIND': False, 'FLUSH_INTERVAL': 1.0, 'MAX_PENDING': 10000, 'TOKEN': None,
+            **getattr(settings, 'LEADERBOARD_INGEST', {})}
+
+
+@lru_cache(maxsize=None)
+def get_buffer():
+    """Returns this process's write-behind buffer."""
+    config = get_config()
+    return WriteBehindBuffer(config['FLUSH_INTERVAL'], config['MAX_PENDING'])
+
+
+@receiver(setting_changed)
+def reset_buffer(setting, **kwargs):
+    if setting == 'LEADERBOARD_INGEST':
+        get_buffer.cache_clear()
+
+
+def ingest(payload):
+    """
+    Validates and applies, or queues, the laps of a payload. Returns the
+    response body and whether the laps were only queued.
+    """
+    laps = parse_laps(payload, timezone.now())
+    if get_config()['WRITE_BEHIND']:
+        if not get_buffer().add(laps):
+            raise BufferFull()
+        return {'queued': len(laps)}, True
+    return submit_laps(laps)._asdict(), False
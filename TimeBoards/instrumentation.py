@@ -0,0 +1,240 @@
+# instrumentation.py
+#
+# Per-request SQL and template timings. QueryTimingMiddleware counts and times
+# every query of a request through a database execute wrapper, fingerprints
+# them to spot N+1 patterns, and collects the template rendering time that
+# the TimedDjangoTemplates backend reports (see TEMPLATES). Results go to a
+# Server-Timing header, one log line per request and rolling per-view
+# aggregates shown on the stats/queries/ page. Views declare how many queries
+# they may run with @query_budget.
+#
+# Rows read while a StreamingHttpResponse is being sent are not counted; the
+# middleware only sees the request up to the response object. Under ASGI the
+# async ORM runs queries on worker threads with their own connections, so the
+# recorder lives in a context variable read by a wrapper installed on every
+# connection rather than being attached to this thread's connections.
+
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger(__name__)
+
+WINDOW = getattr(settings, 'TIMEBOARDS_QUERY_STATS_WINDOW', 200)
+
+_recorder = ContextVar('timeboards_query_recorder', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries):
+    """Declares the most queries a view may run on one GET or HEAD request."""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_placeholder_lists = re.compile(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)')
+
+
+def fingerprint(sql):
+    """The statement with literals and IN lists collapsed, so repeats match."""
+    sql = _literals.sub('?', sql)
+    sql = _placeholder_lists.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+class RequestRecorder:
+    """Execute wrapper collecting the queries of one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_depth = 0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def _install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedTemplate(django_backend.Template):
+    """A template of TimedDjangoTemplates; adds its render time to the request's recorder."""
+
+    def render(self, context=None, request=None):
+        recorder = _recorder.get()
+        # Only the outermost render is timed; templates rendered inside it are included
+        if recorder is None or recorder.render_depth:
+            return super().render(context, request)
+        recorder.render_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            recorder.render_seconds += time.perf_counter() - started
+            recorder.render_depth -= 1
+
+
+class TimedDjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, timing the templates rendered during a request."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+class ViewStats:
+    """The last WINDOW requests of every view, for the stats page."""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.samples = defaultdict(lambda: deque(maxlen=self.window))
+        self.requests = Counter()
+        self.over_budget = Counter()
+        self.duplicates = defaultdict(Counter)
+
+    def add(self, view, recorder, total_seconds, over_budget):
+        with self.lock:
+            self.samples[view].append((recorder.queries, recorder.sql_seconds, recorder.render_seconds, total_seconds))
+            self.requests[view] += 1
+            self.over_budget[view] += over_budget
+            self.duplicates[view].update(recorder.duplicates.keys())
+
+    def summary(self):
+        def p95(values):
+            return sorted(values)[int(0.95 * (len(values) - 1))]
+
+        with self.lock:
+            views = {}
+            for view, samples in self.samples.items():
+                queries, sql, render, total = zip(*samples)
+                views[view] = {
+                    'requests': self.requests[view],
+                    'over_budget': self.over_budget[view],
+                    'window': len(samples),
+                    'queries_mean': round(sum(queries) / len(samples), 1),
+                    'queries_max': max(queries),
+                    'sql_ms_mean': round(1000 * sum(sql) / len(samples), 2),
+                    'render_ms_mean': round(1000 * sum(render) / len(samples), 2),
+                    'total_ms_mean': round(1000 * sum(total) / len(samples), 2),
+                    'total_ms_p95': round(1000 * p95(total), 2),
+                    # Statements that ran more than once per request, by how many requests did that
+                    'duplicated': dict(self.duplicates[view].most_common(5)),
+                }
+            return views
+
+
+stats = ViewStats()
+
+
+class QueryTimingMiddleware:
+    """
+    Records queries and render time of every request. Put it first in
+    MIDDLEWARE so queries of the other middleware count too. Exceeding a
+    view's budget logs a warning, or raises QueryBudgetExceeded when the
+    TIMEBOARDS_QUERY_BUDGETS_STRICT setting is on, as in the tests.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(_install_query_recorder)
+        for connection in connections.all(initialized_only=True):
+            _install_query_recorder(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = RequestRecorder()
+        token = _recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        return self.finish(request, response, recorder, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        recorder = RequestRecorder()
+        token = _recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        return self.finish(request, response, recorder, time.perf_counter() - started)
+
+    def finish(self, request, response, recorder, total_seconds):
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        budget = getattr(match.func, 'query_budget', None) if match and request.method in ('GET', 'HEAD') else None
+        over_budget = budget is not None and recorder.queries > budget
+        stats.add(view, recorder, total_seconds, over_budget)
+
+        duplicated = sum(count - 1 for count in recorder.duplicates.values())
+        response['Server-Timing'] = (
+            f'sql;dur={1000 * recorder.sql_seconds:.1f};desc="{recorder.queries} queries, {duplicated} duplicated", '
+            f'render;dur={1000 * recorder.render_seconds:.1f}, '
+            f'total;dur={1000 * total_seconds:.1f}'
+        )
+        logger.info(
+            'view=%s status=%s queries=%d duplicated=%d sql_ms=%.1f render_ms=%.1f total_ms=%.1f',
+            view, response.status_code, recorder.queries, duplicated,
+            1000 * recorder.sql_seconds, 1000 * recorder.render_seconds, 1000 * total_seconds,
+            extra={'view': view, 'queries': recorder.queries, 'duplicates': recorder.duplicates},
+        )
+        if over_budget:
+            message = f'{view} ran {recorder.queries} queries, its budget is {budget}'
+            if getattr(settings, 'TIMEBOARDS_QUERY_BUDGETS_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={'view': view, 'duplicates': recorder.duplicates})
+        return response
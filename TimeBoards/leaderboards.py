@@ -0,0 +1,441 @@
+# leaderboards.py
+#
+# Pluggable storage for board reads. The ORM is always the source of truth;
+# backends other than DatabaseBackend mirror it and are written through from
+# signals.py. Pick one with the LEADERBOARD_BACKEND setting.
+#
+# Every backend orders drivers with the same time by driver id, so rank,
+# around and gap_to_next agree whichever one is configured.
+
+import bisect
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models import F, Window
+from django.db.models.functions import Rank, RowNumber
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import LeaderboardEntry, Person
+
+BoardRow = namedtuple('BoardRow', ['rank', 'user_id', 'name', 'time', 'logged_at'])
+
+# Commands sent to Redis per round trip while resyncing
+RESYNC_CHUNK = 5000
+
+
+def to_ms(duration):
+    return duration // timedelta(milliseconds=1)
+
+
+def from_ms(ms):
+    return timedelta(milliseconds=int(ms))
+
+
+class BaseLeaderboardBackend:
+    """
+    Read interface shared by all backends. A board is a (game_id, track_id,
+    car_id) tuple and times are returned as timedeltas.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def update(self, entry):
+        """Mirrors a saved entry. Nothing to do when reading from the ORM."""
+
+    def remove(self, entry):
+        """Drops a deleted entry from the mirror."""
+
+    def rename(self, person):
+        """Refreshes a driver's display name in the mirror."""
+
+    def resync(self, board=None):
+        """Rebuilds the mirror of one board, or of every board, from the ORM."""
+        return 0
+
+    def top(self, board, n=10):
+        """The first n rows of a board, or all of them when n is None."""
+        raise NotImplementedError
+
+    def rank(self, board, user_id):
+        raise NotImplementedError
+
+    def around(self, board, user_id, radius=2):
+        raise NotImplementedError
+
+    def gap_to_next(self, board, user_id):
+        """Time between a driver and the driver directly ahead of them."""
+        raise NotImplementedError
+
+    def entries(self, board):
+        """
+        Every entry of a board for the board page, fastest first, as unsaved
+        LeaderboardEntry objects with the next closest time and gap that
+        with_gaps() annotates. Nothing is read until the page iterates them.
+        """
+        rows = self.top(board, None)
+        game_id, track_id, car_id = board
+        for position, row in enumerate(rows):
+            entry = LeaderboardEntry(game_id=game_id, track_id=track_id, car_id=car_id, time=row.time, logged_at=row.logged_at,
+                                     user=Person(id=row.user_id, name=row.name))
+            if position == 0:
+                entry.board_next_time = rows[1].time if len(rows) > 1 else None
+                entry.board_gap = entry.board_next_time and entry.board_next_time - row.time
+            else:
+                entry.board_next_time = rows[0].time
+                entry.board_gap = row.time - rows[0].time
+            yield entry
+
+
+class DatabaseBackend(BaseLeaderboardBackend):
+    """Answers board reads straight from LeaderboardEntry."""
+
+    def _entries(self, board):
+        game_id, track_id, car_id = board
+        return LeaderboardEntry.objects.filter(game_id=game_id, track_id=track_id, car_id=car_id)
+
+    def _ranked(self, board):
+        return self._entries(board).annotate(
+            board_rank=Window(Rank(), order_by=F('time').asc()),
+            board_position=Window(RowNumber(), order_by=[F('time').asc(), F('user_id').asc()]),
+        )
+
+    def _rows(self, board, start, stop):
+        rows = self._ranked(board).order_by('time', 'user_id')
+        return [BoardRow(*row) for row in rows.values_list('board_rank', 'user_id', 'user__name', 'time', 'logged_at')[start:stop]]
+
+    def _position(self, board, user_id):
+        """Zero-based position of a driver on the board."""
+        position = self._ranked(board).for_driver(user_id).values_list('board_position', flat=True).first()
+        return None if position is None else position - 1
+
+    def top(self, board, n=10):
+        return self._rows(board, 0, n)
+
+    def rank(self, board, user_id):
+        return self._ranked(board).for_driver(user_id).values_list('board_rank', flat=True).first()
+
+    def around(self, board, user_id, radius=2):
+        position = self._position(board, user_id)
+        if position is None:
+            return []
+        return self._rows(board, max(position - radius, 0), position + radius + 1)
+
+    def gap_to_next(self, board, user_id):
+        position = self._position(board, user_id)
+        if not position:
+            return None
+        ahead, mine = self._rows(board, position - 1, position + 1)
+        return mine.time - ahead.time
+
+    def entries(self, board):
+        # The board page's own query, read lazily inside its cached fragment
+        return self._entries(board).with_gaps().select_related('user').order_by('time', 'user_id')
+
+
+class RedisBackend(BaseLeaderboardBackend):
+    """
+    Mirrors every board into a Redis sorted set scored by lap time in
+    milliseconds, so rank, top-N and neighbour reads are O(log N). Members
+    are zero-padded driver ids, so Redis orders equal times by driver id as
+    the database does. When each driver logged their time is kept in a hash
+    next to the set, and names in one hash shared by every board.
+
+    OPTIONS:
+        URL: redis URL to connect to.
+        CACHE_ALIAS: reuse the connection of a django-redis cache instead.
+        FAKE: use the in-process InMemoryRedis, for tests and local runs.
+        KEY_PREFIX: namespace for the keys, defaults to 'timeboards'.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.prefix = options.get('KEY_PREFIX', 'timeboards')
+        if options.get('FAKE'):
+            self.client = InMemoryRedis()
+        elif options.get('CACHE_ALIAS'):
+            from django_redis import get_redis_connection
+            self.client = get_redis_connection(options['CACHE_ALIAS'])
+        else:
+            import redis
+            self.client = redis.Redis.from_url(options.get('URL', 'redis://localhost:6379/0'))
+
+    def board_key(self, board):
+        return '{}:board:{}:{}:{}'.format(self.prefix, *board)
+
+    @staticmethod
+    def logged_key(key):
+        return f'{key}:logged'
+
+    @staticmethod
+    def member(user_id):
+        return f'{int(user_id):012d}'
+
+    @property
+    def boards_key(self):
+        return f'{self.prefix}:boards'
+
+    @property
+    def names_key(self):
+        return f'{self.prefix}:names'
+
+    def update(self, entry):
+        key = self.board_key(entry.board)
+        pipe = self.client.pipeline()
+        pipe.zadd(key, {self.member(entry.user_id): to_ms(entry.time)})
+        pipe.hset(self.logged_key(key), entry.user_id, entry.logged_at.isoformat())
+        pipe.sadd(self.boards_key, key)
+        pipe.hset(self.names_key, entry.user_id, entry.user.name)
+        pipe.execute()
+
+    def remove(self, entry):
+        key = self.board_key(entry.board)
+        pipe = self.client.pipeline()
+        pipe.zrem(key, self.member(entry.user_id))
+        pipe.hdel(self.logged_key(key), entry.user_id)
+        pipe.execute()
+
+    def rename(self, person):
+        self.client.hset(self.names_key, person.pk, person.name)
+
+    def resync(self, board=None):
+        """
+        Builds the boards under temporary keys, RESYNC_CHUNK commands per
+        round trip, then swaps them all in with one MULTI. Readers see the
+        old boards until the swap, and no single request buffers every board.
+        """
+        entries = LeaderboardEntry.objects.order_by()
+        if board is not None:
+            game_id, track_id, car_id = board
+            entries = entries.filter(game_id=game_id, track_id=track_id, car_id=car_id)
+            previous = {self.board_key(board)}
+        else:
+            previous = set(map(_decode, self.client.smembers(self.boards_key)))
+
+        pipe = self.client.pipeline(transaction=False)
+        built = set()
+        count = 0
+        rows = entries.values_list('game_id', 'track_id', 'car_id', 'user_id', 'time', 'logged_at')
+        for game_id, track_id, car_id, user_id, time, logged_at in rows.iterator(chunk_size=2000):
+            key = self.board_key((game_id, track_id, car_id))
+            if key not in built:
+                # Left over if an earlier resync died halfway
+                pipe.delete(f'{key}:resync', f'{self.logged_key(key)}:resync')
+                built.add(key)
+            pipe.zadd(f'{key}:resync', {self.member(user_id): to_ms(time)})
+            pipe.hset(f'{self.logged_key(key)}:resync', user_id, logged_at.isoformat())
+            count += 1
+            if len(pipe) >= RESYNC_CHUNK:
+                pipe.execute()
+        people = Person.objects.values_list('id', 'name')
+        if board is not None:
+            people = people.filter(leaderboardentry__in=entries)
+        for person_id, name in people.iterator(chunk_size=2000):
+            pipe.hset(self.names_key, person_id, name)
+            if len(pipe) >= RESYNC_CHUNK:
+                pipe.execute()
+        pipe.execute()
+
+        swap = self.client.pipeline()
+        stale = previous - built
+        if stale:
+            swap.delete(*stale, *map(self.logged_key, stale))
+            swap.srem(self.boards_key, *stale)
+        for key in built:
+            swap.rename(f'{key}:resync', key)
+            swap.rename(f'{self.logged_key(key)}:resync', self.logged_key(key))
+        if built:
+            swap.sadd(self.boards_key, *built)
+        swap.execute()
+        return count
+
+    def _rows(self, board, start, stop):
+        key = self.board_key(board)
+        members = self.client.zrange(key, start, -1 if stop is None else stop - 1, withscores=True)
+        if not members:
+            return []
+        user_ids = [int(member) for member, _ in members]
+        # Names, logged times and the rank of the first row in one round trip
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hmget(self.names_key, user_ids)
+        pipe.hmget(self.logged_key(key), user_ids)
+        pipe.zcount(key, '-inf', f'({members[0][1]}')
+        names, logged, ahead = pipe.execute()
+        result = []
+        for position, ((_, score), user_id, name, logged_at) in enumerate(zip(members, user_ids, names, logged)):
+            if result and result[-1].time == from_ms(score):
+                rank = result[-1].rank
+            else:
+                # Every row above in the range is faster
+                rank = ahead + 1 if position == 0 else start + position + 1
+            logged_at = _decode(logged_at)
+            result.append(BoardRow(rank, user_id, _decode(name), from_ms(score), logged_at and datetime.fromisoformat(logged_at)))
+        return result
+
+    def top(self, board, n=10):
+        return self._rows(board, 0, n)
+
+    def rank(self, board, user_id):
+        score = self.client.zscore(self.board_key(board), self.member(user_id))
+        if score is None:
+            return None
+        return self.client.zcount(self.board_key(board), '-inf', f'({score}') + 1
+
+    def around(self, board, user_id, radius=2):
+        position = self.client.zrank(self.board_key(board), self.member(user_id))
+        if position is None:
+            return []
+        return self._rows(board, max(position - radius, 0), position + radius + 1)
+
+    def gap_to_next(self, board, user_id):
+        position = self.client.zrank(self.board_key(board), self.member(user_id))
+        if not position:
+            return None
+        (_, ahead), (_, mine) = self.client.zrange(self.board_key(board), position - 1, position, withscores=True)
+        return from_ms(mine) - from_ms(ahead)
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class InMemoryRedis:
+    """
+    Minimal in-process stand-in for the redis-py calls RedisBackend makes.
+    Sorted sets are kept as score-ordered lists, so reads stay logarithmic.
+    Members and keys are stored as strings, like redis-py returns them
+    with decode_responses=True.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        # Calls run one at a time anyway, so every pipeline is atomic
+        return _InMemoryPipeline(self)
+
+    def delete(self, *keys):
+        return sum(self.data.pop(str(key), None) is not None for key in keys)
+
+    def rename(self, src, dst):
+        if str(src) not in self.data:
+            raise KeyError('no such key')
+        self.data[str(dst)] = self.data.pop(str(src))
+
+    def _zset(self, key):
+        return self.data.setdefault(str(key), ({}, []))
+
+    def zadd(self, key, mapping):
+        scores, ordered = self._zset(key)
+        added = 0
+        for member, score in mapping.items():
+            member, score = str(member), float(score)
+            if member in scores:
+                ordered.remove((scores[member], member))
+            else:
+                added += 1
+            scores[member] = score
+            bisect.insort(ordered, (score, member))
+        return added
+
+    def zrem(self, key, *members):
+        scores, ordered = self._zset(key)
+        removed = 0
+        for member in map(str, members):
+            if member in scores:
+                ordered.remove((scores.pop(member), member))
+                removed += 1
+        return removed
+
+    def zscore(self, key, member):
+        return self._zset(key)[0].get(str(member))
+
+    def zrank(self, key, member):
+        scores, ordered = self._zset(key)
+        member = str(member)
+        if member not in scores:
+            return None
+        return bisect.bisect_left(ordered, (scores[member], member))
+
+    def zcount(self, key, low, high):
+        ordered = self._zset(key)[1]
+        low = float('-inf') if low == '-inf' else float(low)
+        exclusive = isinstance(high, str) and high.startswith('(')
+        high = float(high.lstrip('(')) if isinstance(high, str) else float(high)
+        end = bisect.bisect_left(ordered, (high, '')) if exclusive else bisect.bisect_right(ordered, (high, '\U0010ffff'))
+        return end - bisect.bisect_left(ordered, (low, ''))
+
+    def zrange(self, key, start, end, withscores=False):
+        ordered = self._zset(key)[1]
+        end = len(ordered) if end == -1 else end + 1
+        items = ordered[start:end]
+        if withscores:
+            return [(member, score) for score, member in items]
+        return [member for _, member in items]
+
+    def zcard(self, key):
+        return len(self._zset(key)[0])
+
+    def sadd(self, key, *members):
+        members = set(map(str, members))
+        current = self.data.setdefault(str(key), set())
+        added = len(members - current)
+        current |= members
+        return added
+
+    def srem(self, key, *members):
+        current = self.data.get(str(key), set())
+        removed = len(current & set(map(str, members)))
+        current -= set(map(str, members))
+        return removed
+
+    def smembers(self, key):
+        return set(self.data.get(str(key), set()))
+
+    def hset(self, key, field, value):
+        self.data.setdefault(str(key), {})[str(field)] = value
+
+    def hdel(self, key, *fields):
+        values = self.data.get(str(key), {})
+        return sum(values.pop(str(field), None) is not None for field in fields)
+
+    def hmget(self, key, fields):
+        values = self.data.get(str(key), {})
+        return [values.get(str(field)) for field in fields]
+
+
+class _InMemoryPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in calls]
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    """Returns the backend configured by the LEADERBOARD_BACKEND setting."""
+    config = getattr(settings, 'LEADERBOARD_BACKEND', {})
+    backend = import_string(config.get('BACKEND', 'TimeBoards.leaderboards.DatabaseBackend'))
+    return backend(**config.get('OPTIONS', {}))
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    if setting == 'LEADERBOARD_BACKEND':
+        get_backend.cache_clear()
@@ -0,0 +1,225 @@
+# live.py
+#
+# Pub/sub bus behind the server-sent event streams in views.py. Writes publish
+# one small message per changed row after commit; every open stream is a
+# coroutine waiting on its own queue, so idle viewers cost no requests and no
+# queries. LocalBus only reaches streams of the same process; RedisBus relays
+# through a Redis channel so every worker sees every write. Pick one with the
+# LEADERBOARD_LIVE setting.
+
+import asyncio
+import json
+import logging
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .leaderboards import get_backend, to_ms
+from .models import LeaderboardEntry
+
+logger = logging.getLogger(__name__)
+
+FEED = 'feed'
+
+
+def board_channel(game_id, track_id, car_id):
+    return f'board:{game_id}:{track_id}:{car_id}'
+
+
+class Subscription:
+    """
+    The queue of one stream. Messages are handed over on the stream's event
+    loop, so publishing is safe from any thread. A viewer that falls more than
+    MAX_PENDING messages behind gets a single resync message instead.
+    """
+
+    MAX_PENDING = 100
+
+    def __init__(self, bus, channel):
+        self.bus = bus
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def push(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The stream's loop is gone without the stream closing
+            self.close()
+
+    def _put(self, message):
+        if self.queue.qsize() >= self.MAX_PENDING:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = {'type': 'resync'}
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout=None):
+        """Returns the next message, or None once timeout seconds pass."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class LocalBus:
+    """Delivers messages to the streams of this process only."""
+
+    def __init__(self, **options):
+        self.options = options
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """Opens a subscription; call it from the stream's event loop."""
+        subscription = Subscription(self, channel)
+        with self.lock:
+            self.subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscriptions.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.subscriptions.pop(subscription.channel, None)
+
+    def deliver(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.push(message)
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscriptions.values())
+
+
+class RedisBus(LocalBus):
+    """
+    Publishes to a Redis channel and fans messages out to local streams from
+    one listener thread per process, started with the first subscription.
+    When Redis goes away the listener logs it, waits, subscribes again and
+    tells every local stream to resync, since it may have missed messages.
+
+    OPTIONS:
+        URL: Redis connection URL (required).
+        KEY_PREFIX: prefix of the Redis channel names, default 'timeboards:live'.
+        RETRY_DELAY: seconds before the first resubscribe, default 1, doubled
+            after every failed attempt up to MAX_RETRY_DELAY, default 30.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        import redis
+        self.client = redis.Redis.from_url(options['URL'])
+        self.prefix = options.get('KEY_PREFIX', 'timeboards:live')
+        self.retry_delay = options.get('RETRY_DELAY', 1)
+        self.max_retry_delay = options.get('MAX_RETRY_DELAY', 30)
+        self.listener = None
+        self.stopped = threading.Event()
+
+    def subscribe(self, channel):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen, name='timeboards-live', daemon=True)
+                self.listener.start()
+        return super().subscribe(channel)
+
+    def listen(self):
+        delay = self.retry_delay
+        reconnecting = False
+        while not self.stopped.is_set():
+            try:
+                with self.client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    pubsub.psubscribe(f'{self.prefix}:*')
+                    if reconnecting:
+                        self.resync()
+                    delay = self.retry_delay
+                    for item in pubsub.listen():
+                        channel = item['channel'].decode()[len(self.prefix) + 1:]
+                        self.deliver(channel, json.loads(item['data']))
+            except Exception:
+                logger.exception('Live listener lost its Redis subscription, retrying in %s seconds', delay)
+                self.stopped.wait(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+            reconnecting = True
+
+    def resync(self):
+        """Tells every local stream to reload what it shows."""
+        with self.lock:
+            channels = list(self.subscriptions)
+        for channel in channels:
+            self.deliver(channel, {'type': 'resync'})
+
+    def stop(self):
+        """Ends the listener thread after its current attempt."""
+        self.stopped.set()
+
+    def publish(self, channel, message):
+        self.client.publish(f'{self.prefix}:{channel}', json.dumps(message))
+
+
+@lru_cache(maxsize=None)
+def get_bus():
+    """Returns the bus configured by the LEADERBOARD_LIVE setting."""
+    config = getattr(settings, 'LEADERBOARD_LIVE', {})
+    bus = import_string(config.get('BACKEND', 'TimeBoards.live.LocalBus'))
+    return bus(**config.get('OPTIONS', {}))
+
+
+@receiver(setting_changed)
+def reset_bus(setting, **kwargs):
+    if setting == 'LEADERBOARD_LIVE':
+        get_bus.cache_clear()
+
+
+def board_payload(board):
+    game_id, track_id, car_id = board
+    return {'game': game_id, 'track': track_id, 'car': car_id}
+
+
+def publish(board, message):
+    """Sends a message to the board's streams and to the global feed."""
+    bus = get_bus()
+    try:
+        bus.publish(board_channel(*board), message)
+        bus.publish(FEED, message)
+    except Exception:
+        # Viewers miss one update at worst; the write itself already committed
+        logger.exception('Could not publish a live update for board %s', board)
+
+
+def publish_entry(entry):
+    """Pushes a saved entry with its current rank on the board."""
+    rank = get_backend().rank(entry.board, entry.user_id)
+    message = {
+        'type': 'entry',
+        'board': board_payload(entry.board),
+        'rank': rank,
+        'driver': {'id': entry.user_id, 'name': entry.user.name},
+        'time': LeaderboardEntry.format_duration(entry.time),
+        'time_ms': to_ms(entry.time),
+        'record': rank == 1,
+    }
+    publish(entry.board, message)
+
+
+def publish_removal(entry):
+    publish(entry.board, {'type': 'remove', 'board': board_payload(entry.board), 'driver': {'id': entry.user_id}})
+
+
+def publish_resync(board):
+    """Tells viewers to reload a board that changed in bulk."""
+    publish(board, {'type': 'resync', 'board': board_payload(board)})
@@ -0,0 +1,64 @@
+import json
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from TimeBoards import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a throwaway test database and reports requests per second and p50/p95 latency of the async '
+        'TimeBoards pages for growing numbers of concurrent viewers, served through the WSGI and the ASGI '
+        'handler, as JSON. Your own database is never touched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(benchmark.SIZES), default='small')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--viewers', nargs='+', type=int, default=[1, 10, 50])
+        parser.add_argument('--requests', type=int, default=20, help='Pages each viewer loads, one after another.')
+        parser.add_argument('-o', '--output', help='Write the report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or min(options['viewers']) < 1:
+            raise CommandError('--viewers and --requests must be positive.')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stderr.write(f"Seeding {options['size']} dataset...")
+            started = time.monotonic()
+            dataset = benchmark.seed(**benchmark.SIZES[options['size']], seed=options['seed'])
+            seed_seconds = round(time.monotonic() - started, 2)
+            urls = benchmark.async_urls(benchmark.benchmark_urls(benchmark.sample_kwargs()))
+            # Broken pages would only measure error handling
+            try:
+                benchmark.warm_up(urls)
+            except benchmark.BrokenPage as e:
+                raise CommandError(e)
+            self.stderr.write(f"Loading {len(urls)} pages with {', '.join(map(str, options['viewers']))} viewers...")
+            report = {
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'size': options['size'],
+                'seed': options['seed'],
+                'dataset': dataset,
+                'seed_seconds': seed_seconds,
+                'requests_per_viewer': options['requests'],
+                'urls': urls,
+                'viewers': benchmark.compare_deployments(list(urls.values()), options['viewers'], options['requests']),
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}."))
+        else:
+            self.stdout.write(output)
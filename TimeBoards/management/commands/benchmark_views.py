@@ -0,0 +1,72 @@
+import json
+import time
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from TimeBoards import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a throwaway test database at each size and reports wall time, query count and peak memory '
+        'of every TimeBoards URL and admin changelist as JSON. Your own database is never touched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', choices=sorted(benchmark.SIZES), default=['small'])
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=5, help='Warm requests per URL, reported as the median.')
+        parser.add_argument('-o', '--output', help='Write the report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 0:
+            raise CommandError('--repeat cannot be negative.')
+        report = {
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'seed': options['seed'],
+            'repeat': options['repeat'],
+            'sizes': {},
+        }
+        setup_test_environment()
+        try:
+            for size in options['sizes']:
+                report['sizes'][size] = self.run_size(size, options)
+        finally:
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2, sort_keys=True, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}."))
+        else:
+            self.stdout.write(output)
+
+    def run_size(self, size, options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stderr.write(f'Seeding {size} dataset...')
+            started = time.monotonic()
+            dataset = benchmark.seed(**benchmark.SIZES[size], seed=options['seed'])
+            seed_seconds = round(time.monotonic() - started, 2)
+
+            client = Client()
+            client.force_login(get_user_model().objects.create_superuser('benchmark', password=None))
+            results = {}
+            for key, url in benchmark.benchmark_urls(benchmark.sample_kwargs()).items():
+                self.stderr.write(f'  {url}')
+                results[key] = dict(benchmark.measure(client, url, options['repeat']), url=url)
+                # Timing an error page would only measure error handling
+                try:
+                    benchmark.check_status(url, results[key]['status'])
+                except benchmark.BrokenPage as e:
+                    raise CommandError(e)
+            return {'dataset': dataset, 'seed_seconds': seed_seconds, 'urls': results}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from TimeBoards import standings
+
+
+class Command(BaseCommand):
+    help = (
+        'Scores every driver on every board by position points and percentage of the record, and writes the '
+        'overall standings. Uses NumPy when it is installed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only rescore boards that changed since the last run.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        boards, drivers = standings.compute(incremental=options['incremental'])
+        engine = 'NumPy' if standings.np is not None else 'plain Python'
+        self.stdout.write(self.style.SUCCESS(
+            f'Scored {boards} boards and ranked {drivers} drivers in {time.monotonic() - started:.1f}s with {engine}.'
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from TimeBoards.sqlite.base import enable_wal
+
+
+class Command(BaseCommand):
+    help = (
+        'Switches a SQLite database to WAL journaling, so readers are not blocked while laps are written. '
+        'The mode is stored in the database file: run it once per database, e.g. after copying db.sqlite3 to a server.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"{options['database']} is not a SQLite database.")
+        # No other connection of this process may hold the file meanwhile
+        connection.close()
+        mode = enable_wal(connection.settings_dict['NAME'])
+        if mode != 'wal':
+            raise CommandError(f'SQLite kept the {mode} journal mode.')
+        self.stdout.write(self.style.SUCCESS(f"{connection.settings_dict['NAME']} uses WAL journaling."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from TimeBoards import exports
+
+
+class Command(BaseCommand):
+    help = 'Streams leaderboard entries as CSV or NDJSON, for one board, car or driver or the whole database.'
+
+    def add_arguments(self, parser):
+        scope = parser.add_mutually_exclusive_group()
+        scope.add_argument('--board', nargs=3, type=int, metavar=('GAME_ID', 'TRACK_ID', 'CAR_ID'))
+        scope.add_argument('--car', type=int, metavar='CAR_ID')
+        scope.add_argument('--person', type=int, metavar='PERSON_ID')
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='File to write to, defaults to stdout.')
+
+    def handle(self, *args, **options):
+        if options['board']:
+            entries = exports.board_entries(*options['board'])
+        elif options['car']:
+            entries = exports.car_entries(options['car'])
+        elif options['person']:
+            entries = exports.person_entries(options['person'])
+        else:
+            entries = exports.all_entries()
+
+        lines = exports.export_lines(entries, options['format'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        try:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as stream:
+                stream.writelines(lines)
+        except OSError as e:
+            raise CommandError(e)
@@ -0,0 +1,132 @@
+import csv
+import json
+import sys
+import time
+from contextlib import nullcontext
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from TimeBoards.models import Car, Game, LeaderboardEntry, Person, Track
+from TimeBoards.services import Lap, refresh_after_bulk_write, write_laps
+
+
+class NameCache:
+    """Resolves catalog and driver names to ids, creating missing rows once."""
+
+    def __init__(self):
+        self.games = {name: pk for pk, name in Game.objects.values_list('id', 'name')}
+        self.tracks = {(game_id, name): pk for pk, game_id, name in Track.objects.values_list('id', 'game_id', 'name')}
+        self.cars = {(track_id, name): pk for pk, track_id, name in Car.objects.values_list('id', 'track_id', 'name')}
+        self.people = {name: pk for pk, name in Person.objects.values_list('id', 'name')}
+
+    def _get(self, lookup, key, create):
+        if key not in lookup:
+            lookup[key] = create().pk
+        return lookup[key]
+
+    def board(self, game, track, car):
+        game_id = self._get(self.games, game, lambda: Game.objects.create(name=game))
+        track_id = self._get(self.tracks, (game_id, track), lambda: Track.objects.create(name=track, game_id=game_id))
+        car_id = self._get(self.cars, (track_id, car), lambda: Car.objects.create(name=car, game_id=game_id, track_id=track_id))
+        return game_id, track_id, car_id
+
+    def person(self, name):
+        return self._get(self.people, name, lambda: Person.objects.create(name=name))
+
+
+def read_rows(stream, fmt):
+    """Yields each row as a dict, or the ValueError of a line that isn't JSON."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield e
+
+
+def read_name(row, column):
+    # A JSON null or a short CSV row gives None, which must not become "None"
+    value = row[column]
+    name = '' if value is None else str(value).strip()
+    if not name:
+        raise ValueError(f'empty {column}')
+    return name
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports lap times from a CSV or JSONL file with game, track, car, driver and time columns, '
+        'appending every lap to the history and keeping personal bests on the boards. Use - to read from stdin.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change and roll everything back.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        self.totals = {'read': 0, 'created': 0, 'improved': 0, 'unchanged': 0, 'invalid': 0}
+        started = time.monotonic()
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(e)
+
+        # Each batch commits on its own; a dry run nests them in one transaction to roll back
+        with stream, (transaction.atomic() if options['dry_run'] else nullcontext()):
+            names = NameCache()
+            rows = read_rows(stream, fmt)
+            while batch := list(islice(rows, options['batch_size'])):
+                with transaction.atomic():
+                    boards, person_ids = self.import_batch(names, batch)
+                    if not options['dry_run']:
+                        refresh_after_bulk_write(boards, person_ids)
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        elapsed = time.monotonic() - started
+        totals = self.totals
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Dry run: ' if options['dry_run'] else ''}"
+            f"{totals['read']} rows in {elapsed:.1f}s ({totals['read'] / max(elapsed, 1e-9):.0f} rows/s), "
+            f"{totals['created']} new entries, {totals['improved']} personal bests improved, "
+            f"{totals['unchanged']} laps slower than the driver's best, {totals['invalid']} invalid rows skipped."
+        ))
+
+    def import_batch(self, names, batch):
+        # Every valid row goes to the history; write_laps() keeps the best per board and driver
+        now = timezone.now()
+        laps = []
+        for row in batch:
+            self.totals['read'] += 1
+            try:
+                if isinstance(row, ValueError):
+                    raise row
+                game, track, car, driver = (read_name(row, column) for column in ('game', 'track', 'car', 'driver'))
+                lap_time = LeaderboardEntry.parse_duration(row['time'])
+                if not lap_time:
+                    raise ValueError('time must be positive')
+            except (KeyError, TypeError, ValueError) as e:
+                self.totals['invalid'] += 1
+                self.stderr.write(f"Skipping row {self.totals['read']}: {e!r}")
+                continue
+            game_id, track_id, car_id = names.board(game, track, car)
+            laps.append(Lap(names.person(driver), game_id, track_id, car_id, lap_time, now))
+
+        created, improved, boards, person_ids = write_laps(laps)
+        self.totals['created'] += created
+        self.totals['improved'] += improved
+        self.totals['unchanged'] += len(laps) - created - improved
+        return boards, person_ids
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from TimeBoards import publish
+
+
+class Command(BaseCommand):
+    help = (
+        'Renders every board, driver and game page, the indexes and their JSON API pages to static files '
+        'served ahead of the views. Only pages whose boards changed since the last run are rendered again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--root', help="Directory to publish to, instead of LEADERBOARD_PUBLISH['ROOT'].")
+        parser.add_argument('--force', action='store_true', help='Render every page, e.g. after templates changed.')
+
+    def handle(self, *args, **options):
+        root = options['root'] or publish.get_config()['ROOT']
+        if not root:
+            raise CommandError("Set LEADERBOARD_PUBLISH['ROOT'] (TIMEBOARDS_PUBLISH_ROOT) or pass --root.")
+        started = time.monotonic()
+        counts = publish.publish(root, publish.pages(), force=options['force'], prune=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"Published {counts['rendered']} pages to {root}, {counts['unchanged']} unchanged, "
+            f"{counts['removed']} removed, in {time.monotonic() - started:.1f}s."
+        ))
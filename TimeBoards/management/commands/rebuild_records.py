@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from TimeBoards.models import DriverBoardStat, TrackRecord
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the TrackRecord and DriverBoardStat summary tables from all leaderboard entries.'
+
+    def handle(self, *args, **options):
+        records = TrackRecord.objects.rebuild()
+        stats = DriverBoardStat.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(records)} track records and {len(stats)} driver board stats.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from TimeBoards.leaderboards import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the leaderboard backend mirror from the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--board', nargs=3, type=int, metavar=('GAME_ID', 'TRACK_ID', 'CAR_ID'),
+                            help='Only resync this game/track/car board.')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        board = tuple(options['board']) if options['board'] else None
+        count = backend.resync(board)
+        self.stdout.write(self.style.SUCCESS(f'Resynced {count} entries into {type(backend).__name__}.'))
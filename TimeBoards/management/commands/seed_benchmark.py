@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from TimeBoards import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a reproducible synthetic dataset of games, tracks, cars, drivers and laps with skewed '
+        'popularity. Start from a --size preset and override any count; the same --seed gives the same rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(benchmark.SIZES), default='small')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--games', type=int)
+        parser.add_argument('--tracks', type=int, help='Tracks per game.')
+        parser.add_argument('--cars', type=int, help='Cars per track.')
+        parser.add_argument('--drivers', type=int)
+        parser.add_argument('--laps', type=int)
+
+    def handle(self, *args, **options):
+        counts = dict(benchmark.SIZES[options['size']])
+        for name in counts:
+            if options[name] is not None:
+                counts[name] = options[name]
+        if min(counts.values()) < 1:
+            raise CommandError('Every count must be at least 1.')
+
+        self.verbosity = options['verbosity']
+        started = time.monotonic()
+        created = benchmark.seed(**counts, seed=options['seed'], progress=self.progress)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded in {elapsed:.1f}s: " + ', '.join(f'{count} {name}' for name, count in created.items()) + '.'
+        ))
+
+    def progress(self, done, total):
+        if self.verbosity > 1:
+            self.stdout.write(f'{done}/{total} laps')
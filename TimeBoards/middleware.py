@@ -0,0 +1,68 @@
+# middleware.py
+#
+# WhiteNoise's middleware is sync-only, and a single sync middleware makes
+# Django run every request of an ASGI server through a thread, async views
+# included. StaticFilesMiddleware serves the same files but passes every other
+# request straight on in the event loop. Settings put it in place of the
+# WhiteNoiseMiddleware that django_heroku inserts.
+#
+# It also serves the pages published by publish.py. Those are replaced while
+# the server runs, so unlike static files they are looked up on every request.
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.responders import NotARegularFileError
+
+from . import publish
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return self.serve_published(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            # Opens the file and stats it; the body is streamed by the handler
+            return await sync_to_async(self.serve)(static_file, request)
+        if publish.get_config()['ROOT']:
+            response = await sync_to_async(self.serve_published)(request)
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+    def serve_published(self, request):
+        """Answers a plain GET or HEAD of a published page, or returns None."""
+        root = publish.get_config()['ROOT']
+        if not root or request.method not in ('GET', 'HEAD') or request.META.get('QUERY_STRING'):
+            return None
+        path = publish.find_page(root, request.path_info)
+        if path is None:
+            return None
+        try:
+            response = self.serve(self.get_static_file(path, request.path_info), request)
+        except (FileNotFoundError, NotARegularFileError):
+            # Removed since it was found
+            return None
+        # Revalidated on every view, the page changes with the board
+        response['Cache-Control'] = 'no-cache'
+        return response
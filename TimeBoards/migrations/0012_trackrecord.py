@@ -0,0 +1,59 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Window
+from django.db.models.expressions import RowRange
+from django.db.models.functions import NthValue, RowNumber
+
+
+def backfill_records(apps, schema_editor):
+    # The windowed scan of TrackRecord.objects.rebuild(), which historical models lack
+    LeaderboardEntry = apps.get_model('TimeBoards', 'LeaderboardEntry')
+    TrackRecord = apps.get_model('TimeBoards', 'TrackRecord')
+    board = [F('game'), F('track'), F('car')]
+    leaders = LeaderboardEntry.objects.annotate(
+        position=Window(RowNumber(), partition_by=board, order_by=[F('time').asc(), F('id').asc()]),
+        runner_up_time=Window(NthValue('time', 2), partition_by=board, order_by=[F('time').asc(), F('id').asc()],
+                              frame=RowRange(start=None, end=None)),
+        size=Window(Count('id'), partition_by=board),
+    ).filter(position=1).values_list('game_id', 'track_id', 'car_id', 'user_id', 'time', 'runner_up_time', 'size')
+    TrackRecord.objects.bulk_create(
+        (
+            TrackRecord(game_id=game_id, track_id=track_id, car_id=car_id, holder_id=user_id, record_time=time,
+                        runner_up_time=runner_up_time, gap=runner_up_time - time if runner_up_time is not None else None,
+                        entry_count=size)
+            for game_id, track_id, car_id, user_id, time, runner_up_time, size in leaders.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TimeBoards', '0011_car_track'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_time', models.DurationField()),
+                ('runner_up_time', models.DurationField(null=True)),
+                ('gap', models.DurationField(null=True)),
+                ('entry_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.car')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.game')),
+                ('holder', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='TimeBoards.person')),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.track')),
+            ],
+            options={
+                'ordering': ['track', 'car'],
+                'unique_together': {('game', 'track', 'car')},
+            },
+        ),
+        migrations.RunPython(backfill_records, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_laps(apps, schema_editor):
+    # Current personal bests are the only laps history has kept so far
+    LeaderboardEntry = apps.get_model('TimeBoards', 'LeaderboardEntry')
+    LapRecord = apps.get_model('TimeBoards', 'LapRecord')
+    entries = LeaderboardEntry.objects.values_list('game_id', 'track_id', 'car_id', 'user_id', 'time', 'logged_at')
+    LapRecord.objects.bulk_create(
+        (
+            LapRecord(game_id=game_id, track_id=track_id, car_id=car_id, user_id=user_id, time=time, logged_at=logged_at)
+            for game_id, track_id, car_id, user_id, time, logged_at in entries.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TimeBoards', '0012_trackrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LapRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DurationField()),
+                ('logged_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.car')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.game')),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.track')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.person')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['game', 'track', 'car', 'time'], name='TimeBoards__game_id_3938cb_idx'), models.Index(fields=['user', 'game', 'track', 'car', 'logged_at'], name='TimeBoards__user_id_d61ab9_idx'), models.Index(fields=['logged_at'], name='TimeBoards__logged__2806cf_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_laps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Min, Window
+from django.db.models.functions import Rank
+
+
+def backfill_stats(apps, schema_editor):
+    LeaderboardEntry = apps.get_model('TimeBoards', 'LeaderboardEntry')
+    DriverBoardStat = apps.get_model('TimeBoards', 'DriverBoardStat')
+    board = [F('game'), F('track'), F('car')]
+    entries = LeaderboardEntry.objects.annotate(
+        board_rank=Window(Rank(), partition_by=board, order_by=F('time').asc()),
+        record_time=Window(Min('time'), partition_by=board),
+    ).values_list('game_id', 'track_id', 'car_id', 'user_id', 'time', 'logged_at', 'board_rank', 'record_time')
+    DriverBoardStat.objects.bulk_create(
+        (
+            DriverBoardStat(game_id=game_id, track_id=track_id, car_id=car_id, user_id=user_id,
+                            time=time, rank=rank, gap=time - record_time, improved_at=logged_at)
+            for game_id, track_id, car_id, user_id, time, logged_at, rank, record_time in entries.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TimeBoards', '0013_laprecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverBoardStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DurationField()),
+                ('rank', models.PositiveIntegerField()),
+                ('gap', models.DurationField()),
+                ('previous_time', models.DurationField(null=True)),
+                ('improved_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.car')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.game')),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.track')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.person')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'rank'], name='TimeBoards__user_id_8e42ca_idx')],
+                'unique_together': {('game', 'track', 'car', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TimeBoards', '0014_driverboardstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Standing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField()),
+                ('points', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+                ('boards', models.PositiveIntegerField()),
+                ('records', models.PositiveIntegerField()),
+                ('computed_at', models.DateTimeField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.person')),
+            ],
+            options={
+                'ordering': ['rank', 'user_id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BoardScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('points', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.car')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.game')),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.track')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='TimeBoards.person')),
+            ],
+            options={
+                'unique_together': {('game', 'track', 'car', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:15
+
+import json
+
+from django.db import migrations
+
+
+def normalize_settings(apps, schema_editor):
+    # Same shape GameForm now enforces; anything unreadable is kept under 'original'
+    Game = apps.get_model('TimeBoards', 'Game')
+    for game in Game.objects.all():
+        settings = game.settings
+        if isinstance(settings, str):
+            try:
+                settings = json.loads(settings)
+            except ValueError:
+                pass
+        if settings is None:
+            settings = {}
+        settings = dict(settings) if isinstance(settings, dict) else {'original': settings}
+        if not isinstance(settings.get('gameSettings', {}), dict):
+            settings['original'] = settings.pop('gameSettings')
+        settings.setdefault('gameSettings', {})
+        if settings != game.settings:
+            game.settings = settings
+            game.save(update_fields=['settings'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TimeBoards', '0015_standings'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_settings, migrations.RunPython.noop),
+    ]
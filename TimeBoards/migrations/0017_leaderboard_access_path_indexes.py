@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TimeBoards', '0016_normalize_game_settings'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='leaderboardentry',
+            name='TimeBoards__track_i_835dfb_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='leaderboardentry',
+            name='TimeBoards__track_i_e9efd5_idx',
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['track', 'car', 'time'], name='TimeBoards__track_i_f2fdd3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['car', 'time'], name='TimeBoards__car_id_5994d4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['user', 'time'], name='TimeBoards__user_id_cc2349_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['logged_at'], name='TimeBoards__logged__8ed3d2_idx'),
+        ),
+    ]
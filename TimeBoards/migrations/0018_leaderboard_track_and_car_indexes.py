@@ -0,0 +1,25 @@
+# Generated by Django 5.0.6 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TimeBoards', '0017_leaderboard_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='leaderboardentry',
+            name='TimeBoards__car_id_5994d4_idx',
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['track', 'time', 'user'], name='TimeBoards__track_i_1d2240_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['car', 'time', 'user'], name='TimeBoards__car_id_6809aa_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TimeBoards', '0018_leaderboard_track_and_car_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='leaderboardentry',
+            name='TimeBoards__track_i_f2fdd3_idx',
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['track', 'car', 'time', 'user'], name='TimeBoards__track_i_11aee5_idx'),
+        ),
+    ]
@@ -1,6 +1,10 @@
 # models.py
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Case, Count, Min, OuterRef, Subquery, When, Window
+from django.db.models.functions import FirstValue, NthValue, Rank, RowNumber
+from django.db.models.expressions import RowRange
+from django.utils import timezone
 from datetime import timedelta, datetime
 
 class Person(models.Model):
@@ -31,6 +35,85 @@ class Car(models.Model):
     def __str__(self):
         return self.name
 
+class LeaderboardEntryQuerySet(models.QuerySet):
+    # A board is every entry sharing the same game, track and car
+    BOARD = [F('game'), F('track'), F('car')]
+
+    def with_gaps(self):
+        """
+        Annotates each entry with its board rank, the next closest time and the
+        gap to it, all computed by the database in a single statement.
+
+        The next closest time follows the original property: the runner-up's
+        time for the board leader and the leader's time for everyone else.
+        """
+        def board_window(expression, **kwargs):
+            return Window(expression, partition_by=self.BOARD, order_by=[F('time').asc(), F('user_id').asc()], **kwargs)
+
+        leader_time = board_window(FirstValue('time'))
+        runner_up_time = board_window(NthValue('time', 2), frame=RowRange(start=None, end=None))
+        is_leader = Q(board_position=1)
+        return self.annotate(
+            board_position=board_window(RowNumber()),
+            board_rank=Window(Rank(), partition_by=self.BOARD, order_by=F('time').asc()),
+        ).annotate(
+            board_next_time=Case(
+                When(is_leader, then=runner_up_time),
+                default=leader_time,
+                output_field=models.DurationField(),
+            ),
+            board_gap=Case(
+                When(is_leader, then=runner_up_time - F('time')),
+                default=F('time') - leader_time,
+                output_field=models.DurationField(),
+            ),
+        )
+
+    def with_board_stats(self):
+        """
+        Same annotations as with_gaps(), read from the DriverBoardStat and
+        TrackRecord rows kept for every board instead of computed by window
+        functions over whole boards. Each row costs a few indexed lookups, so
+        a page of entries stays cheap however large the table grows.
+        """
+        stat = DriverBoardStat.objects.filter(
+            game=OuterRef('game'), track=OuterRef('track'), car=OuterRef('car'), user=OuterRef('user'),
+        )
+        record = TrackRecord.objects.filter(game=OuterRef('game'), track=OuterRef('track'), car=OuterRef('car'))
+        is_leader = Q(board_rank=1)
+        return self.annotate(
+            board_rank=Subquery(stat.values('rank')[:1]),
+        ).annotate(
+            board_next_time=Case(
+                When(is_leader, then=Subquery(record.values('runner_up_time')[:1])),
+                default=Subquery(record.values('record_time')[:1]),
+                output_field=models.DurationField(),
+            ),
+            board_gap=Case(
+                When(is_leader, then=Subquery(record.values('gap')[:1])),
+                default=Subquery(stat.values('gap')[:1]),
+                output_field=models.DurationField(),
+            ),
+        )
+
+    def records(self):
+        """
+        Returns only the fastest entry of every board, with its related rows
+        joined, so the result grows with the number of boards, not laps.
+        """
+        return self.with_gaps().annotate(
+            board_size=Window(Count('id'), partition_by=self.BOARD),
+        ).filter(board_position=1).select_related('user', 'track', 'car', 'game')
+
+    def for_driver(self, person):
+        """
+        Restricts a with_gaps() queryset to one driver while keeping the ranks
+        board-wide. Pairing the driver predicate with a window predicate makes
+        Django apply it after the window functions instead of before them.
+        """
+        return self.filter(Q(user=person) | Q(board_position__isnull=True))
+
+
 class LeaderboardEntry(models.Model):
     track = models.ForeignKey(Track, on_delete=models.CASCADE)
     car = models.ForeignKey(Car, on_delete=models.CASCADE)
@@ -39,26 +122,68 @@ class LeaderboardEntry(models.Model):
     time = models.DurationField()
     logged_at = models.DateTimeField(auto_now=True)
 
+    objects = LeaderboardEntryQuerySet.as_manager()
+
     class Meta:
+        # The unique index also serves lookups by (track, car, user). Boards,
+        # tracks, cars and drivers are read fastest first, so each index puts
+        # time after the columns a page filters on, then user where ties
+        # break on it, and top-N reads walk it in order instead of sorting.
         unique_together = ('track', 'car', 'user')
         indexes = [
-            models.Index(fields=['track', 'car', 'user']),
-            models.Index(fields=['track', 'car']),
+            models.Index(fields=['track', 'car', 'time', 'user']),
+            models.Index(fields=['track', 'time', 'user']),
+            models.Index(fields=['car', 'time', 'user']),
+            models.Index(fields=['user', 'time']),
+            models.Index(fields=['logged_at']),
         ]
 
     def set_time_components(self, minutes, seconds, milliseconds):
+        from .services import submit_lap
         new_time = timedelta(minutes=int(minutes), seconds=int(seconds), milliseconds=int(milliseconds))
-        if not self.time or new_time < self.time:
-            self.time = new_time
-            self.save()
+        result = submit_lap(self.user, self.game, self.track, self.car, new_time)
+        if result.personal_best:
+            self.pk, self.time, self.logged_at = result.entry.pk, result.entry.time, result.entry.logged_at
+            self.mark_clean()
+        return result
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so save() can tell what changed without a query
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    # Fields the board's TrackRecord and driver stats are computed from
+    BOARD_FIELDS = ('time', 'user_id', 'game_id', 'track_id', 'car_id')
+
+    def mark_clean(self):
+        self._loaded_values = {name: getattr(self, name) for name in self.BOARD_FIELDS}
+
+    @property
+    def board(self):
+        return (self.game_id, self.track_id, self.car_id)
 
     def save(self, *args, **kwargs):
-        # Update the logged_at field if the time field is changed
-        if self.pk:
-            orig = LeaderboardEntry.objects.get(pk=self.pk)
-            if orig.time != self.time:
-                self.logged_at = datetime.now()
-        super().save(*args, **kwargs)
+        # Keep the board's TrackRecord and driver stats in the same transaction as the entry
+        with transaction.atomic():
+            boards = {self.board}
+            loaded = getattr(self, '_loaded_values', None)
+            if self.pk and loaded is not None:
+                # Update the logged_at field if the time field is changed
+                if loaded.get('time') != self.time:
+                    self.logged_at = datetime.now()
+                # Nothing the board is computed from changed, so it needs no refresh
+                if all(name in loaded and loaded[name] == getattr(self, name) for name in self.BOARD_FIELDS):
+                    boards = set()
+                loaded_board = (loaded.get('game_id'), loaded.get('track_id'), loaded.get('car_id'))
+                if boards and None not in loaded_board:
+                    boards.add(loaded_board)
+            super().save(*args, **kwargs)
+            for board in boards:
+                TrackRecord.objects.refresh_board(*board)
+                DriverBoardStat.objects.refresh_board(*board)
+        self.mark_clean()
 
     @property
     def formatted_time(self):
@@ -67,6 +192,9 @@ class LeaderboardEntry(models.Model):
 
     @property
     def next_closest_time(self):
+        # Use the with_gaps() annotation when the entry was loaded through it
+        if hasattr(self, 'board_next_time'):
+            return self.board_next_time
         next_time = LeaderboardEntry.objects.filter(
             track=self.track,
             car=self.car,
@@ -76,6 +204,8 @@ class LeaderboardEntry(models.Model):
 
     @property
     def difference(self):
+        if hasattr(self, 'board_gap'):
+            return LeaderboardEntry.format_duration(self.board_gap)
         next_time = self.next_closest_time
         if next_time:
             return LeaderboardEntry.format_duration(abs(next_time - self.time))
@@ -91,3 +221,263 @@ class LeaderboardEntry(models.Model):
         seconds = total_seconds % 60
         milliseconds = duration.microseconds // 1000
         return f"{minutes:02}:{seconds:02}:{milliseconds:03}"
+
+    @staticmethod
+    def parse_duration(value):
+        """
+        Converts a lap time back to a timedelta. Accepts the format_duration
+        output ("01:23:456"), "1:23.456" and a plain number of milliseconds.
+        """
+        value = str(value).strip()
+        if value.isdigit():
+            return timedelta(milliseconds=int(value))
+        parts = value.replace('.', ':').split(':')
+        if len(parts) != 3 or not all(part.isdigit() for part in parts):
+            raise ValueError(f"Invalid lap time: {value!r}")
+        minutes, seconds, milliseconds = parts
+        return timedelta(minutes=int(minutes), seconds=int(seconds), milliseconds=int(milliseconds.ljust(3, '0')[:3]))
+
+
+class TrackRecordQuerySet(models.QuerySet):
+    def refresh_board(self, game_id, track_id, car_id):
+        """Recomputes the summary row of one board from its leaderboard entries."""
+        record = LeaderboardEntry.objects.filter(game_id=game_id, track_id=track_id, car_id=car_id).records().select_related(None).first()
+        if record is None:
+            self.filter(game_id=game_id, track_id=track_id, car_id=car_id).delete()
+            return None
+        return self.update_or_create(
+            game_id=game_id, track_id=track_id, car_id=car_id,
+            defaults=TrackRecord.values_from(record),
+        )[0]
+
+    def rebuild(self):
+        """Replaces every summary row using one windowed scan of the entries."""
+        with transaction.atomic():
+            self.all().delete()
+            return self.bulk_create(
+                TrackRecord(game_id=record.game_id, track_id=record.track_id, car_id=record.car_id,
+                            **TrackRecord.values_from(record))
+                for record in LeaderboardEntry.objects.records().select_related(None).iterator()
+            )
+
+
+class TrackRecord(models.Model):
+    """The current record of one game/track/car board, kept in sync on every write."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    track = models.ForeignKey(Track, on_delete=models.CASCADE)
+    car = models.ForeignKey(Car, on_delete=models.CASCADE)
+    holder = models.ForeignKey(Person, on_delete=models.SET_NULL, null=True)
+    record_time = models.DurationField()
+    runner_up_time = models.DurationField(null=True)
+    gap = models.DurationField(null=True)
+    entry_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TrackRecordQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('game', 'track', 'car')
+        ordering = ['track', 'car']
+
+    def __str__(self):
+        return f"{self.track} / {self.car}: {self.formatted_time}"
+
+    @staticmethod
+    def values_from(record):
+        """Maps an entry loaded through records() onto TrackRecord fields."""
+        return {
+            'holder_id': record.user_id,
+            'record_time': record.time,
+            'runner_up_time': record.board_next_time,
+            'gap': record.board_gap,
+            'entry_count': record.board_size,
+        }
+
+    @property
+    def formatted_time(self):
+        return LeaderboardEntry.format_duration(self.record_time)
+
+    @property
+    def formatted_gap(self):
+        return LeaderboardEntry.format_duration(self.gap)
+
+
+class DriverBoardStatQuerySet(models.QuerySet):
+    def on_board(self, game_id, track_id, car_id):
+        return self.filter(game_id=game_id, track_id=track_id, car_id=car_id)
+
+    def refresh_board(self, game_id, track_id, car_id):
+        """
+        Brings the rows of one board up to date with its entries in one read,
+        writing only rows whose time, rank or gap to the record changed.
+        """
+        entries = LeaderboardEntry.objects.filter(game_id=game_id, track_id=track_id, car_id=car_id).annotate(
+            board_rank=Window(Rank(), order_by=F('time').asc()),
+            record_time=Window(Min('time')),
+        ).values_list('user_id', 'time', 'logged_at', 'board_rank', 'record_time')
+        stale = {stat.user_id: stat for stat in self.on_board(game_id, track_id, car_id)}
+        now = timezone.now()
+        to_create, to_update = [], []
+        for user_id, time, logged_at, rank, record_time in entries:
+            stat = stale.pop(user_id, None)
+            if stat is None:
+                to_create.append(DriverBoardStat(
+                    game_id=game_id, track_id=track_id, car_id=car_id, user_id=user_id,
+                    time=time, rank=rank, gap=time - record_time, improved_at=logged_at,
+                ))
+                continue
+            if (stat.time, stat.rank, stat.gap) == (time, rank, time - record_time):
+                continue
+            if time != stat.time:
+                # Only a faster time counts as an improvement; an edit in the admin resets it
+                stat.previous_time = stat.time if time < stat.time else None
+                stat.improved_at = logged_at
+            stat.time, stat.rank, stat.gap, stat.updated_at = time, rank, time - record_time, now
+            to_update.append(stat)
+        if stale:
+            self.filter(pk__in=[stat.pk for stat in stale.values()]).delete()
+        self.bulk_create(to_create)
+        self.bulk_update(to_update, ['time', 'rank', 'gap', 'previous_time', 'improved_at', 'updated_at'])
+
+    def rebuild(self):
+        """
+        Replaces every row using one windowed scan of the entries. Earlier
+        times are not known to the entries, so improvements start over.
+        """
+        with transaction.atomic():
+            self.all().delete()
+            board = LeaderboardEntryQuerySet.BOARD
+            entries = LeaderboardEntry.objects.annotate(
+                board_rank=Window(Rank(), partition_by=board, order_by=F('time').asc()),
+                record_time=Window(Min('time'), partition_by=board),
+            ).values_list('game_id', 'track_id', 'car_id', 'user_id', 'time', 'logged_at', 'board_rank', 'record_time')
+            return self.bulk_create(
+                (
+                    DriverBoardStat(game_id=game_id, track_id=track_id, car_id=car_id, user_id=user_id,
+                                    time=time, rank=rank, gap=time - record_time, improved_at=logged_at)
+                    for game_id, track_id, car_id, user_id, time, logged_at, rank, record_time in entries.iterator()
+                ),
+                batch_size=1000,
+            )
+
+    def profile(self, person):
+        """Every board of one driver with the board's size, best rank first."""
+        return self.filter(user=person).select_related('game', 'track', 'car').annotate(
+            board_size=F('car__trackrecord__entry_count'),
+        ).order_by('rank', 'game__name', 'track__name', 'car__name')
+
+
+class DriverBoardStat(models.Model):
+    """
+    A driver's standing on one board: rank, gap to the record and last
+    improvement. Refreshed per board whenever any entry on it changes, so
+    profiles read ranks without computing them.
+    """
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    track = models.ForeignKey(Track, on_delete=models.CASCADE)
+    car = models.ForeignKey(Car, on_delete=models.CASCADE)
+    user = models.ForeignKey(Person, on_delete=models.CASCADE)
+    time = models.DurationField()
+    rank = models.PositiveIntegerField()
+    gap = models.DurationField()
+    previous_time = models.DurationField(null=True)
+    improved_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = DriverBoardStatQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('game', 'track', 'car', 'user')
+        indexes = [
+            models.Index(fields=['user', 'rank']),
+        ]
+
+    @property
+    def formatted_time(self):
+        return LeaderboardEntry.format_duration(self.time)
+
+    @property
+    def formatted_gap(self):
+        return LeaderboardEntry.format_duration(self.gap)
+
+    @property
+    def formatted_previous_time(self):
+        return LeaderboardEntry.format_duration(self.previous_time)
+
+    @property
+    def improvement(self):
+        return self.previous_time - self.time if self.previous_time else None
+
+    @property
+    def formatted_improvement(self):
+        return LeaderboardEntry.format_duration(self.improvement)
+
+
+class LapRecordQuerySet(models.QuerySet):
+    def on_board(self, game_id, track_id, car_id):
+        return self.filter(game_id=game_id, track_id=track_id, car_id=car_id)
+
+    def progression(self, person, game_id, track_id, car_id):
+        """The laps that improved a driver's personal best on a board, oldest first."""
+        driver_board = [F('user'), F('game'), F('track'), F('car')]
+        chronological = [F('logged_at').asc(), F('id').asc()]
+        # A lap improved the PB when it is the running best and no earlier lap had the same time
+        return self.on_board(game_id, track_id, car_id).filter(user=person).annotate(
+            running_best=Window(Min('time'), partition_by=driver_board, order_by=chronological, frame=RowRange(start=None, end=0)),
+            time_seen=Window(RowNumber(), partition_by=[*driver_board, F('time')], order_by=chronological),
+        ).filter(time=F('running_best'), time_seen=1).order_by('logged_at', 'id')
+
+    def recent(self, days):
+        """Laps logged in the last given number of days, newest first."""
+        return self.filter(logged_at__gte=timezone.now() - timedelta(days=days)).order_by('-logged_at', '-id')
+
+
+class LapRecord(models.Model):
+    """Every submitted lap, append-only. LeaderboardEntry keeps each driver's best of these."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    track = models.ForeignKey(Track, on_delete=models.CASCADE)
+    car = models.ForeignKey(Car, on_delete=models.CASCADE)
+    user = models.ForeignKey(Person, on_delete=models.CASCADE)
+    time = models.DurationField()
+    logged_at = models.DateTimeField(default=timezone.now)
+
+    objects = LapRecordQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['game', 'track', 'car', 'time']),
+            models.Index(fields=['user', 'game', 'track', 'car', 'logged_at']),
+            models.Index(fields=['logged_at']),
+        ]
+
+    @property
+    def formatted_time(self):
+        return LeaderboardEntry.format_duration(self.time)
+
+
+class BoardScore(models.Model):
+    """A driver's position, points and percentage of the record on one board, as of the last standings run."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    track = models.ForeignKey(Track, on_delete=models.CASCADE)
+    car = models.ForeignKey(Car, on_delete=models.CASCADE)
+    user = models.ForeignKey(Person, on_delete=models.CASCADE)
+    position = models.PositiveIntegerField()
+    points = models.PositiveIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('game', 'track', 'car', 'user')
+
+
+class Standing(models.Model):
+    """A driver's place in the overall standings across every board, written by compute_standings."""
+    user = models.OneToOneField(Person, on_delete=models.CASCADE)
+    rank = models.PositiveIntegerField()
+    points = models.PositiveIntegerField()
+    score = models.FloatField()
+    boards = models.PositiveIntegerField()
+    records = models.PositiveIntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['rank', 'user_id']
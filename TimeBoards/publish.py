@@ -0,0 +1,332 @@
+# publish.py
+#
+# Static snapshots of the read-only pages. Every board, driver and game page,
+# the indexes and their first JSON API page are rendered to files under
+# LEADERBOARD_PUBLISH['ROOT'], one index.html or index.json per URL. The
+# static files middleware serves them through WhiteNoise before a request
+# reaches any view, so viewers of a snapshot never touch the database.
+# Requests with a query string (later pages, ?add, API cursors) and anything
+# not published still go to the views.
+#
+# manage.py publish_static renders what changed since the last run. Each page
+# has a fingerprint of its inputs, taken from the TrackRecord rows every
+# write to a board refreshes, and pages whose fingerprint matches the
+# manifest are skipped. Renames don't touch those rows; the write hook
+# covers them, and --force re-renders everything, e.g. after a deploy
+# changed templates.
+#
+# The write hook (see signals.py) removes the pages of a changed board as
+# soon as the write commits, before live viewers are told to reload, so they
+# reach the view until the board is published again. Rendering happens on a
+# background thread every INTERVAL seconds: the board pages first, then the
+# pages of every driver on the board, its game and the indexes, so a burst of
+# laps renders them once. Whatever is queued is flushed at exit.
+#
+# Files are written to a temporary name and renamed over the old one, so a
+# page is always served whole. Processes don't coordinate beyond that; a run
+# of publish_static puts the manifest right again.
+#
+# Configure with the LEADERBOARD_PUBLISH setting:
+#     ROOT: directory to publish to; publishing is off while unset.
+#     INTERVAL: seconds between background publishes, default 1.
+
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from functools import lru_cache
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.db.models import Count, Max
+from django.dispatch import receiver
+from django.http import Http404, HttpRequest
+from django.urls import resolve, reverse
+
+from .models import Car, Game, LeaderboardEntry, Person, TrackRecord
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = '.manifest.json'
+EXTENSIONS = ('html', 'json')
+
+# URL names of the pages published for each kind of object
+BOARD_PAGES = ('track_times', 'api_board')
+PERSON_PAGES = ('person_times', 'api_driver_times')
+GAME_PAGES = ('tracks', 'api_tracks')
+INDEX_PAGES = ('homepage', 'games', 'api_games')
+
+
+def get_config():
+    return {'ROOT': None, 'INTERVAL': 1.0, **getattr(settings, 'LEADERBOARD_PUBLISH', {})}
+
+
+def fingerprint(changed_at, count):
+    return f'{changed_at.isoformat() if changed_at else "-"}|{count}'
+
+
+def pages(boards=None, people=None, games=None, indexes=True):
+    """
+    Maps the URL of every page to publish to the fingerprint of its inputs.
+    boards, people and games limit it to those pages, None means all of
+    them. Pages of objects that no longer exist map to None.
+    """
+    found = {}
+    records = TrackRecord.objects.all()
+    cars = Car.objects.all()
+    if boards is not None:
+        records = records.filter(car_id__in={car_id for _, _, car_id in boards})
+        cars = cars.filter(id__in={car_id for _, _, car_id in boards})
+        for game_id, track_id, car_id in boards:
+            for name in BOARD_PAGES:
+                found[reverse(name, args=(game_id, track_id, car_id))] = None
+    board_records = {(row[0], row[1], row[2]): row[3:] for row in records.values_list('game_id', 'track_id', 'car_id', 'updated_at', 'entry_count')}
+    for board in cars.values_list('game_id', 'track_id', 'id'):
+        for name in BOARD_PAGES:
+            found[reverse(name, args=board)] = fingerprint(*board_records.get(board, (None, 0)))
+
+    # A driver's page shows their rank on every board they're on
+    drivers = Person.objects.all()
+    entries = LeaderboardEntry.objects.all()
+    if people is not None:
+        drivers = drivers.filter(id__in=people)
+        entries = entries.filter(user_id__in=people)
+        for person_id in people:
+            for name in PERSON_PAGES:
+                found[reverse(name, args=(person_id,))] = None
+    driver_boards = {
+        row['user_id']: (row['changed_at'], row['boards'])
+        for row in entries.values('user_id').annotate(changed_at=Max('car__trackrecord__updated_at'), boards=Count('id'))
+    }
+    for person_id in drivers.values_list('id', flat=True):
+        for name in PERSON_PAGES:
+            found[reverse(name, args=(person_id,))] = fingerprint(*driver_boards.get(person_id, (None, 0)))
+
+    game_ids = Game.objects.values_list('id', flat=True)
+    if games is not None:
+        game_ids = game_ids.filter(id__in=games)
+        for game_id in games:
+            for name in GAME_PAGES:
+                found[reverse(name, args=(game_id,))] = None
+    game_boards = {
+        row['game_id']: (row['changed_at'], row['boards'])
+        for row in Car.objects.filter(game_id__in=game_ids).values('game_id').annotate(changed_at=Max('trackrecord__updated_at'), boards=Count('id'))
+    }
+    for game_id in game_ids:
+        for name in GAME_PAGES:
+            found[reverse(name, args=(game_id,))] = fingerprint(*game_boards.get(game_id, (None, 0)))
+
+    if indexes:
+        latest = TrackRecord.objects.aggregate(changed_at=Max('updated_at'), boards=Count('id'))
+        found[reverse('homepage')] = fingerprint(latest['changed_at'], latest['boards'])
+        game_count = Game.objects.count()
+        for name in INDEX_PAGES[1:]:
+            found[reverse(name)] = fingerprint(None, game_count)
+    return found
+
+
+def render_page(url):
+    """
+    Renders a page as an anonymous GET would get it; returns the response,
+    or None when the page doesn't exist. Templates see request.published
+    and leave out forms, which can't carry a CSRF token in a static file.
+    """
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = url
+    request.META = {'SERVER_NAME': 'localhost', 'SERVER_PORT': '80'}
+    request.published = True
+    request.resolver_match = match = resolve(url)
+    view = async_to_sync(match.func) if iscoroutinefunction(match.func) else match.func
+    try:
+        response = view(request, *match.args, **match.kwargs)
+    except Http404:
+        return None
+    return response if response.status_code == 200 else None
+
+
+def page_file(root, url, extension):
+    return os.path.join(root, *url.strip('/').split('/'), f'index.{extension}')
+
+
+def find_page(root, url):
+    """The published file for a URL, or None."""
+    parts = url.strip('/').split('/')
+    if not url.endswith('/') or '\\' in url or (url != '/' and {'', '.', '..'} & set(parts)):
+        return None
+    for extension in EXTENSIONS:
+        path = page_file(root, url, extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def write_file(path, content):
+    """Replaces the file at path in one step; readers see the old or the new file."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def remove_page(root, url):
+    for extension in EXTENSIONS:
+        try:
+            os.remove(page_file(root, url, extension))
+        except FileNotFoundError:
+            pass
+
+
+def read_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+# Taken for each page, so a page rendered later also reads later data and
+# its file is never replaced by an older render from another thread
+publish_lock = threading.Lock()
+
+
+def publish(root, found, force=False, prune=False):
+    """
+    Writes the pages of a pages() mapping whose fingerprint differs from the
+    manifest, or all of them with force, and removes those mapped to None.
+    With prune, published pages missing from the mapping are removed too.
+    Returns counts of pages rendered, unchanged and removed.
+    """
+    counts = {'rendered': 0, 'unchanged': 0, 'removed': 0}
+    published = read_manifest(root)
+    updates = {}
+    stale = set(published) - set(found) if prune else set()
+    for url, page_fingerprint in found.items():
+        if page_fingerprint is not None and not force and published.get(url) == page_fingerprint:
+            counts['unchanged'] += 1
+            continue
+        with publish_lock:
+            response = render_page(url) if page_fingerprint is not None else None
+            if response is not None:
+                extension = 'json' if response['Content-Type'].startswith('application/json') else 'html'
+                write_file(page_file(root, url, extension), response.content)
+        if response is None:
+            stale.add(url)
+            continue
+        updates[url] = page_fingerprint
+        counts['rendered'] += 1
+    for url in stale:
+        remove_page(root, url)
+        updates[url] = None
+        counts['removed'] += url in published
+
+    with publish_lock:
+        # Read again so pages published meanwhile by others are kept
+        manifest = {**read_manifest(root), **updates}
+        manifest = {url: value for url, value in manifest.items() if value is not None}
+        write_file(os.path.join(root, MANIFEST), json.dumps(manifest, indent=0, sort_keys=True).encode())
+    return counts
+
+
+class Publisher:
+    """Collects boards, drivers and games changed by writes and publishes their pages."""
+
+    def __init__(self, root, interval=1.0):
+        self.root = root
+        self.interval = interval
+        self.boards, self.people, self.games = set(), set(), set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def changed(self, boards=(), people=(), games=()):
+        """
+        Takes the board pages down and queues them, the pages of the drivers
+        on those boards, their games and the indexes for the background thread.
+        """
+        boards = set(boards)
+        for board in boards:
+            # Not under publish_lock: a render already running can only put
+            # back a page that the queued one replaces at the next flush
+            for name in BOARD_PAGES:
+                remove_page(self.root, reverse(name, args=board))
+        with self.lock:
+            self.boards |= boards
+            self.people |= set(people)
+            self.games |= set(games)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='timeboards-publish', daemon=True)
+                self.thread.start()
+                atexit.register(self.publish_queued)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            self.publish_queued()
+            close_old_connections()
+
+    def publish_queued(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not publish changed pages')
+
+    def flush(self):
+        """Publishes everything queued so far; returns the counts, or None."""
+        with self.lock:
+            boards, people, games = self.boards, self.people, self.games
+            self.boards, self.people, self.games = set(), set(), set()
+        if not (boards or people or games):
+            return None
+        car_ids = {car_id for _, _, car_id in boards}
+        people |= set(LeaderboardEntry.objects.filter(car_id__in=car_ids).values_list('user_id', flat=True))
+        games |= {game_id for game_id, _, _ in boards}
+        return publish(self.root, pages(boards=boards, people=people, games=games), force=True)
+
+
+@lru_cache(maxsize=None)
+def get_publisher():
+    """Returns this process's publisher, or None when publishing is off."""
+    config = get_config()
+    return Publisher(config['ROOT'], config['INTERVAL']) if config['ROOT'] else None
+
+
+@receiver(setting_changed)
+def reset_publisher(setting, **kwargs):
+    if setting == 'LEADERBOARD_PUBLISH':
+        get_publisher.cache_clear()
+
+
+def changed(boards=(), people=(), games=()):
+    """Republishes the pages of what a committed write changed, when publishing is on."""
+    publisher = get_publisher()
+    if publisher is not None:
+        try:
+            publisher.changed(boards, people, games)
+        except Exception:
+            # The views still serve the latest data; publish_static catches up
+            logger.exception('Could not publish changed pages')
+
+
+def person_changed(person_id):
+    """A driver was added, renamed or removed: their page and every board showing their name."""
+    if get_publisher() is not None:
+        changed(LeaderboardEntry.objects.filter(user_id=person_id).values_list('game_id', 'track_id', 'car_id'), [person_id])
+
+
+def catalog_changed(games=(), **filters):
+    """A game or track was edited: the given game pages and the boards of the cars matching filters."""
+    if get_publisher() is not None:
+        changed(Car.objects.filter(**filters).values_list('game_id', 'track_id', 'id'), games=games)
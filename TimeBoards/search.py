@@ -0,0 +1,232 @@
+# search.py
+#
+# Name search over drivers, games, tracks and cars for the typeahead at
+# api/search/. Each kind has an in-process index, built on its first search
+# with one query and kept current by signals.py as names are saved and
+# deleted in this process. Writes made by other processes bump the PEOPLE or
+# CATALOG cache version, and an index built under an older version is
+# rebuilt on its next search.
+#
+# Names are folded to lowercase without accents and split into words. Every
+# word is indexed by its trigrams, padded in front so that its first one and
+# two letters are grams too: a one or two letter query matches the start of a
+# word, a longer one anywhere in a word. The rarest gram of a query picks the
+# candidates, which are then checked against the whole name.
+#
+# Postings are arrays of 4-byte keys rather than sets of objects. A kind with
+# more than MAX_NAMES rows is not indexed at all; its searches go to the
+# database instead until the next change to its names.
+#
+# Configure with the LEADERBOARD_SEARCH setting:
+#     MAX_NAMES: the most names indexed per kind, default 100000.
+
+import re
+import threading
+import unicodedata
+from array import array
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import reverse
+
+from . import cache
+from .models import Car, Game, Person, Track
+
+# model, cache scope bumped when its names change, fields kept with the name,
+# and the page a result links to
+Kind = namedtuple('Kind', ['model', 'scope', 'fields', 'url'])
+
+KINDS = {
+    'driver': Kind(Person, cache.PEOPLE, (), lambda row: reverse('person_times', args=(row['id'],))),
+    'game': Kind(Game, cache.CATALOG, (), lambda row: reverse('tracks', args=(row['id'],))),
+    'track': Kind(Track, cache.CATALOG, ('game_id',), lambda row: reverse('tracks', args=(row['game_id'],))),
+    'car': Kind(Car, cache.CATALOG, ('game_id', 'track_id'),
+                lambda row: reverse('track_times', args=(row['game_id'], row['track_id'], row['id']))),
+}
+KIND_OF_MODEL = {kind.model: name for name, kind in KINDS.items()}
+
+Entry = namedtuple('Entry', ['id', 'name', 'words', 'fields'])
+
+
+def get_config():
+    return {'MAX_NAMES': 100_000, **getattr(settings, 'LEADERBOARD_SEARCH', {})}
+
+
+def fold(text):
+    """Lowercases text and strips accents, so 'Räikkönen' is found as 'raikkonen'."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def words(text):
+    return re.findall(r'\w+', fold(text))
+
+
+def word_grams(word):
+    padded = f'  {word}'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def query_grams(word):
+    # Short words only match the start of a word, longer ones anywhere in it
+    return word_grams(word) if len(word) < 3 else {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def matches(entry_words, query):
+    return all(
+        any(word.startswith(term) for word in entry_words) if len(term) < 3 else any(term in word for word in entry_words)
+        for term in query
+    )
+
+
+def rank(name, name_words, query):
+    """Sorts names starting with the query first, then those with a word starting with it, then shorter ones."""
+    folded = ' '.join(name_words)
+    if folded.startswith(' '.join(query)):
+        position = 0
+    elif any(word.startswith(query[0]) for word in name_words):
+        position = 1
+    else:
+        position = 2
+    return (position, len(name), folded)
+
+
+class NameIndex:
+    """The names of one kind, looked up by word prefix and trigram."""
+
+    def __init__(self):
+        self.entries = []
+        self.keys = {}
+        self.postings = defaultdict(lambda: array('I'))
+        self.removed = 0
+        # Cache version of the names loaded, and whether there were too many
+        self.version = None
+        self.overflow = False
+        self.lock = threading.Lock()
+
+    def build(self, rows, version, overflow=False):
+        self.entries, self.keys, self.removed = [], {}, 0
+        self.postings = defaultdict(lambda: array('I'))
+        for row in rows:
+            self.add(*row)
+        self.version = version
+        self.overflow = overflow
+
+    def add(self, id, name, *fields):
+        self.discard(id)
+        key = len(self.entries)
+        name_words = tuple(words(name))
+        self.entries.append(Entry(id, name, name_words, fields))
+        self.keys[id] = key
+        # Keys only grow, so every posting array stays sorted
+        for gram in set().union(*map(word_grams, name_words)):
+            self.postings[gram].append(key)
+
+    def discard(self, id):
+        key = self.keys.pop(id, None)
+        if key is not None:
+            # Left in the postings and skipped when found; rebuilt once most are dead
+            self.entries[key] = None
+            self.removed += 1
+            if self.removed > 1000 and self.removed > len(self.keys):
+                self.build([(entry.id, entry.name, *entry.fields) for entry in self.entries if entry], self.version)
+
+    def search(self, query, limit):
+        """The best entries matching every word of a words() query."""
+        grams = set().union(*map(query_grams, query))
+        candidates = min((self.postings.get(gram, ()) for gram in grams), key=len)
+        found = [entry for entry in map(self.entries.__getitem__, candidates) if entry is not None and matches(entry.words, query)]
+        return sorted(found, key=lambda entry: rank(entry.name, entry.words, query))[:limit]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class SearchIndex:
+    """One lazily built NameIndex per kind."""
+
+    def __init__(self, max_names):
+        self.max_names = max_names
+        self.indexes = {name: NameIndex() for name in KINDS}
+
+    def load(self, name):
+        """Returns the current index of a kind, or None when it has too many names to hold."""
+        kind, index = KINDS[name], self.indexes[name]
+        version = cache.version_tag(kind.scope)
+        if index.version != version:
+            rows = list(kind.model.objects.order_by('id').values_list('id', 'name', *kind.fields)[:self.max_names + 1])
+            if len(rows) > self.max_names:
+                index.build((), version, overflow=True)
+            else:
+                index.build(rows, version)
+        return None if index.overflow else index
+
+    def search(self, text, kinds=KINDS, limit=10):
+        """The best matches of every kind asked for, best first, as dicts."""
+        query = words(text)
+        if not query:
+            return []
+        results = []
+        for name in kinds:
+            fields = KINDS[name].fields
+            index = self.indexes[name]
+            with index.lock:
+                if self.load(name) is not None:
+                    found = [{'id': entry.id, 'name': entry.name, **dict(zip(fields, entry.fields))}
+                             for entry in index.search(query, limit)]
+                else:
+                    found = search_database(name, text, limit)
+            results += [dict(row, kind=name, url=KINDS[name].url(row)) for row in found]
+        results.sort(key=lambda row: rank(row['name'], words(row['name']), query))
+        return results[:limit]
+
+    def saved(self, instance):
+        """Applies a committed save of a name to its kind's index, if built."""
+        fields = KINDS[KIND_OF_MODEL[type(instance)]].fields
+        self.apply(type(instance), lambda index: index.add(instance.pk, instance.name, *(getattr(instance, field) for field in fields)))
+
+    def deleted(self, model, id):
+        """Applies a committed delete; takes the id since Django clears the instance's."""
+        self.apply(model, lambda index: index.discard(id))
+
+    def apply(self, model, change):
+        kind = KINDS[KIND_OF_MODEL[model]]
+        index = self.indexes[KIND_OF_MODEL[model]]
+        with index.lock:
+            # Not built yet it loads every name when searched; over MAX_NAMES the database is searched
+            if index.version is None or index.overflow:
+                return
+            change(index)
+            # The write bumped the scope's version, which the index now reflects
+            index.version = cache.version_tag(kind.scope)
+
+
+def search_database(name, text, limit):
+    """
+    Searches a kind too large to index: names starting with the query, then
+    containing it. Unlike the index it doesn't fold accents or match words
+    in any order.
+    """
+    kind = KINDS[name]
+    text = text.strip()
+    rows = kind.model.objects.order_by('name', 'id').values('id', 'name', *kind.fields)
+    found = list(rows.filter(name__istartswith=text)[:limit])
+    # Like the index, shorter queries only match the start
+    if len(found) < limit and len(text) >= 3:
+        found += rows.filter(name__icontains=text).exclude(name__istartswith=text)[:limit - len(found)]
+    return found
+
+
+@lru_cache(maxsize=None)
+def get_index():
+    """Returns this process's search index."""
+    return SearchIndex(get_config()['MAX_NAMES'])
+
+
+@receiver(setting_changed)
+def reset_index(setting, **kwargs):
+    if setting == 'LEADERBOARD_SEARCH':
+        get_index.cache_clear()
@@ -0,0 +1,162 @@
+# services.py
+
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import cache, live, publish
+from .leaderboards import get_backend
+from .models import Car, DriverBoardStat, LapRecord, LeaderboardEntry, Person, TrackRecord
+from .signals import entry_upserted
+
+LapResult = namedtuple('LapResult', ['entry', 'personal_best', 'record'])
+
+# One lap of a batch, by ids; see submit_laps()
+Lap = namedtuple('Lap', ['user_id', 'game_id', 'track_id', 'car_id', 'time', 'logged_at'])
+BatchResult = namedtuple('BatchResult', ['laps', 'created', 'improved', 'skipped'])
+
+
+# Laps per multi-row upsert, well under SQLite's bound parameter limit
+UPSERT_BATCH = 500
+
+
+def _upsert_sql(connection, rows=1, update=True):
+    meta = LeaderboardEntry._meta
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    columns = ', '.join(qn(meta.get_field(name).column) for name in ('user', 'game', 'track', 'car', 'time', 'logged_at'))
+    conflict = ', '.join(qn(meta.get_field(name).column) for name in ('track', 'car', 'user'))
+    time, logged_at, pk = qn('time'), qn('logged_at'), qn(meta.pk.column)
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * rows)
+    # bulk_create(update_conflicts=True) can't express "only if faster", so
+    # the conditional ON CONFLICT clause (SQLite 3.35+, PostgreSQL) is spelled out.
+    action = (
+        f'DO UPDATE SET {time} = excluded.{time}, {logged_at} = excluded.{logged_at} '
+        f'WHERE excluded.{time} < {table}.{time}'
+    ) if update else 'DO NOTHING'
+    return (
+        f'INSERT INTO {table} ({columns}) VALUES {values} '
+        f'ON CONFLICT ({conflict}) {action} '
+        f'RETURNING {pk}, {conflict}'
+    )
+
+
+def submit_lap(person, game, track, car, time):
+    """
+    Appends a lap to the driver's history and stores it as their entry on the
+    board if it beats their current time, in one conditional upsert. Returns
+    a LapResult saying whether it was a personal best and whether it is now
+    the board record. Raises ValueError for a time that isn't positive.
+    """
+    if time <= timedelta(0):
+        raise ValueError('Lap times must be positive')
+    using = router.db_for_write(LeaderboardEntry)
+    connection = connections[using]
+    logged_at = timezone.now()
+    params = [
+        person.pk, game.pk, track.pk, car.pk,
+        LeaderboardEntry._meta.get_field('time').get_db_prep_value(time, connection),
+        LeaderboardEntry._meta.get_field('logged_at').get_db_prep_value(logged_at, connection),
+    ]
+    with transaction.atomic(using=using):
+        LapRecord.objects.using(using).create(user=person, game=game, track=track, car=car, time=time, logged_at=logged_at)
+        with connection.cursor() as cursor:
+            cursor.execute(_upsert_sql(connection), params)
+            row = cursor.fetchone()
+        if row is None:
+            return LapResult(None, False, False)
+
+        entry = LeaderboardEntry(pk=row[0], user=person, game=game, track=track, car=car, time=time, logged_at=logged_at)
+        entry.mark_clean()
+        record = TrackRecord.objects.refresh_board(*entry.board).holder_id == person.pk
+        DriverBoardStat.objects.refresh_board(*entry.board)
+        entry_upserted.send(sender=LeaderboardEntry, instance=entry, record=record)
+    return LapResult(entry, True, record)
+
+
+def refresh_after_bulk_write(boards, person_ids):
+    """
+    Brings derived data up to date after entries were written with
+    bulk_create()/bulk_update(), which skip save() and model signals.
+    """
+    for board in boards:
+        TrackRecord.objects.refresh_board(*board)
+        DriverBoardStat.objects.refresh_board(*board)
+
+    def after_commit():
+        backend = get_backend()
+        for board in boards:
+            backend.resync(board)
+        cache.bump(cache.RECORDS, *(cache.board_scope(*board) for board in boards),
+                   *{cache.game_scope(game_id) for game_id, _, _ in boards},
+                   *(cache.person_scope(person_id) for person_id in person_ids))
+        # Live viewers reload last, once caches are fresh and stale published pages are gone
+        publish.changed(boards, person_ids)
+        for board in boards:
+            live.publish_resync(board)
+
+    transaction.on_commit(after_commit, robust=True)
+
+
+def write_laps(laps):
+    """
+    Appends a batch of Lap tuples to the history and writes the fastest one
+    per driver and board with the conditional upsert of submit_lap(), so a
+    faster time committed meanwhile is never replaced and two first laps
+    can't collide. Returns the number of entries created and improved and
+    the boards and drivers written, for refresh_after_bulk_write().
+    """
+    best = {}
+    for lap in laps:
+        key = (lap.track_id, lap.car_id, lap.user_id)
+        if key not in best or lap.time < best[key].time:
+            best[key] = lap
+    using = router.db_for_write(LeaderboardEntry)
+    connection = connections[using]
+    time_field, logged_at_field = LeaderboardEntry._meta.get_field('time'), LeaderboardEntry._meta.get_field('logged_at')
+
+    def execute(cursor, chunk, update):
+        params = []
+        for lap in chunk:
+            params += [lap.user_id, lap.game_id, lap.track_id, lap.car_id,
+                       time_field.get_db_prep_value(lap.time, connection),
+                       logged_at_field.get_db_prep_value(lap.logged_at, connection)]
+        cursor.execute(_upsert_sql(connection, len(chunk), update), params)
+        return {tuple(row[1:]) for row in cursor.fetchall()}
+
+    created, improved, boards, person_ids = 0, 0, set(), set()
+    pending = list(best.values())
+    with transaction.atomic(using=using):
+        LapRecord.objects.using(using).bulk_create((LapRecord(**lap._asdict()) for lap in laps), batch_size=UPSERT_BATCH)
+        with connection.cursor() as cursor:
+            for start in range(0, len(pending), UPSERT_BATCH):
+                chunk = pending[start:start + UPSERT_BATCH]
+                # New entries first, then only laps faster than the stored entry
+                inserted = execute(cursor, chunk, update=False)
+                rest = [lap for lap in chunk if (lap.track_id, lap.car_id, lap.user_id) not in inserted]
+                updated = execute(cursor, rest, update=True) if rest else set()
+                created, improved = created + len(inserted), improved + len(updated)
+                written = inserted | updated
+                for lap in chunk:
+                    if (lap.track_id, lap.car_id, lap.user_id) in written:
+                        boards.add((lap.game_id, lap.track_id, lap.car_id))
+                        person_ids.add(lap.user_id)
+    return created, improved, boards, person_ids
+
+
+def submit_laps(laps):
+    """
+    Applies a batch of Lap tuples in one transaction with write_laps().
+    Derived rows are refreshed once per board touched. Laps whose driver or
+    car no longer exists are skipped. Returns a BatchResult of counts.
+    """
+    people = set(Person.objects.filter(pk__in={lap.user_id for lap in laps}).values_list('id', flat=True))
+    cars = set(Car.objects.filter(pk__in={lap.car_id for lap in laps}).values_list('id', flat=True))
+    kept = [lap for lap in laps if lap.user_id in people and lap.car_id in cars]
+    with transaction.atomic():
+        created, improved, boards, person_ids = write_laps(kept)
+        if boards:
+            refresh_after_bulk_write(boards, person_ids)
+    return BatchResult(len(kept), created, improved, len(laps) - len(kept))
@@ -0,0 +1,125 @@
+# signals.py
+
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from . import cache, live, publish, search
+from .leaderboards import get_backend
+from .models import Car, DriverBoardStat, Game, LeaderboardEntry, Person, Track, TrackRecord
+
+# Sent by services.submit_lap() when a lap improved the driver's entry. The
+# upsert bypasses Model.save(), so it stands in for post_save. Receivers get
+# the entry as instance and whether it set the board record as record.
+entry_upserted = Signal()
+
+
+@receiver(post_delete, sender=LeaderboardEntry)
+def refresh_board_on_delete(sender, instance, **kwargs):
+    # Runs inside the delete's transaction, including cascades from Person
+    TrackRecord.objects.refresh_board(*instance.board)
+    DriverBoardStat.objects.refresh_board(*instance.board)
+
+
+# The leaderboard backend only mirrors committed rows; if it is unreachable
+# the error is logged and `manage.py resync_leaderboards` repairs it later.
+
+@receiver([post_save, entry_upserted], sender=LeaderboardEntry)
+def mirror_entry_on_save(sender, instance, **kwargs):
+    transaction.on_commit(partial(get_backend().update, instance), robust=True)
+
+
+@receiver(post_delete, sender=LeaderboardEntry)
+def mirror_entry_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(get_backend().remove, instance), robust=True)
+
+
+@receiver(post_save, sender=Person)
+def mirror_person_on_save(sender, instance, **kwargs):
+    transaction.on_commit(partial(get_backend().rename, instance), robust=True)
+
+
+# Cache invalidation, see cache.py. Versions are bumped after commit so a
+# concurrent reader can't cache pre-commit data under the new version.
+
+def bump_after_commit(*scopes):
+    transaction.on_commit(partial(cache.bump, *scopes), robust=True)
+
+
+@receiver([post_save, post_delete, entry_upserted], sender=LeaderboardEntry)
+def invalidate_entry(sender, instance, **kwargs):
+    bump_after_commit(
+        cache.board_scope(*instance.board), cache.game_scope(instance.game_id),
+        cache.person_scope(instance.user_id), cache.RECORDS,
+    )
+
+
+@receiver([post_save, post_delete], sender=Person)
+def invalidate_person(sender, instance, **kwargs):
+    bump_after_commit(cache.person_scope(instance.pk), cache.PEOPLE)
+
+
+@receiver([post_save, post_delete], sender=Game)
+@receiver([post_save, post_delete], sender=Track)
+@receiver([post_save, post_delete], sender=Car)
+def invalidate_catalog(sender, instance, **kwargs):
+    bump_after_commit(cache.CATALOG)
+
+
+# Search index, see search.py. Registered after cache invalidation, so an
+# index records the version its own change produced.
+
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Game)
+@receiver(post_save, sender=Track)
+@receiver(post_save, sender=Car)
+def index_name_on_save(sender, instance, **kwargs):
+    transaction.on_commit(partial(search.get_index().saved, instance), robust=True)
+
+
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Game)
+@receiver(post_delete, sender=Track)
+@receiver(post_delete, sender=Car)
+def index_name_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(search.get_index().deleted, sender, instance.pk), robust=True)
+
+
+# Static snapshots, see publish.py. Registered before the live streams, so a
+# changed board's stale pages are gone before viewers are told to reload.
+
+@receiver([post_save, post_delete, entry_upserted], sender=LeaderboardEntry)
+def publish_entry(sender, instance, **kwargs):
+    transaction.on_commit(partial(publish.changed, [instance.board], [instance.user_id]), robust=True)
+
+
+@receiver([post_save, post_delete], sender=Person)
+def publish_person(sender, instance, **kwargs):
+    transaction.on_commit(partial(publish.person_changed, instance.pk), robust=True)
+
+
+@receiver([post_save, post_delete], sender=Game)
+def publish_game(sender, instance, **kwargs):
+    transaction.on_commit(partial(publish.catalog_changed, [instance.pk], game_id=instance.pk), robust=True)
+
+
+@receiver([post_save, post_delete], sender=Track)
+def publish_track(sender, instance, **kwargs):
+    transaction.on_commit(partial(publish.catalog_changed, [instance.game_id], track_id=instance.pk), robust=True)
+
+
+@receiver([post_save, post_delete], sender=Car)
+def publish_car(sender, instance, **kwargs):
+    transaction.on_commit(partial(publish.changed, [(instance.game_id, instance.track_id, instance.pk)], games=[instance.game_id]), robust=True)
+
+
+# Live streams, see live.py. Like the mirror, they only ever see committed rows.
+
+@receiver([post_save, entry_upserted], sender=LeaderboardEntry)
+def push_entry_on_save(sender, instance, **kwargs):
+    transaction.on_commit(partial(live.publish_entry, instance), robust=True)
+
+
+@receiver(post_delete, sender=LeaderboardEntry)
+def push_entry_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(live.publish_removal, instance), robust=True)
@@ -0,0 +1,80 @@
+# base.py
+#
+# SQLite backend for event deployments where several stations submit laps at
+# once. The database should use WAL journaling, so readers keep reading a
+# snapshot while one writer commits. The journal mode is stored in the
+# database file, so it is switched on once with `manage.py enable_wal`
+# rather than by every connection, which would rewrite the bundled
+# db.sqlite3; test databases are created in WAL mode. Every new connection
+# applies the PRAGMAS tuning below, which lasts as long as the connection.
+# Transactions opened by atomic() start with BEGIN IMMEDIATE: the write lock
+# is taken up front, so concurrent writers queue on busy_timeout instead of
+# failing with "database is locked" when a deferred transaction that already
+# read tries to upgrade to a write.
+#
+# OPTIONS, besides those of sqlite3.connect():
+#     pragmas: dict overriding or extending PRAGMAS.
+#     transaction_mode: DEFERRED, IMMEDIATE (default) or EXCLUSIVE.
+
+import sqlite3
+from contextlib import closing
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base, creation
+
+PRAGMAS = {
+    # Durable at every checkpoint; a power cut can lose the last commits
+    # but never corrupts the database in WAL mode
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    # Negative sizes are KiB: 64 MiB page cache per connection
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+def enable_wal(path):
+    """Switches the database file at path to WAL journaling; returns the journal mode now in use."""
+    with closing(sqlite3.connect(path)) as conn:
+        return conn.execute('PRAGMA journal_mode = wal').fetchone()[0]
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _create_test_db(self, verbosity, autoclobber, keepdb=False):
+        name = super()._create_test_db(verbosity, autoclobber, keepdb)
+        if not self.is_in_memory_db(name):
+            enable_wal(name)
+        return name
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, settings_dict, *args, **kwargs):
+        super().__init__(settings_dict, *args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = {**PRAGMAS, **options.get('pragmas', {})}
+        self.transaction_mode = options.get('transaction_mode', 'IMMEDIATE').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}.")
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        # Python's own busy handler; keep it in step with the pragma
+        kwargs.setdefault('timeout', self.pragmas['busy_timeout'] / 1000)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
@@ -0,0 +1,146 @@
+# standings.py
+#
+# Overall standings across every board, computed in batch by the
+# compute_standings command. Entry times are pulled as flat arrays and ranked
+# per board with NumPy group-wise operations: one sort by (board, time), then
+# run boundaries give every row its position and its board's record. Without
+# NumPy the same ranking runs in plain Python, only slower.
+#
+# Per-board results are stored in BoardScore so an incremental run only
+# recomputes boards whose TrackRecord changed since the previous run, then
+# re-totals Standing from the stored scores in one aggregate.
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Q, Sum
+from django.utils import timezone
+
+from . import cache
+from .leaderboards import to_ms
+from .models import BoardScore, LeaderboardEntry, Standing, TrackRecord
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Points for positions 1 to 10 on every board
+POINTS = (25, 18, 15, 12, 10, 8, 6, 4, 2, 1)
+
+# A write stamps its TrackRecord before it commits, so one that was still
+# open when the last run read the entries can be older than that run
+OVERLAP = timedelta(minutes=5)
+
+
+def rank_boards_numpy(boards, times):
+    """
+    Returns each row's competition rank within its board and the board's
+    record time, for flat sequences of board codes and times.
+    """
+    boards = np.asarray(boards, dtype=np.int64)
+    times = np.asarray(times, dtype=np.int64)
+    order = np.lexsort((times, boards))
+    sorted_boards, sorted_times = boards[order], times[order]
+    index = np.arange(len(order))
+    new_board = np.r_[True, sorted_boards[1:] != sorted_boards[:-1]]
+    new_time = new_board | np.r_[True, sorted_times[1:] != sorted_times[:-1]]
+    # Index of the first row of each row's board, and of its run of tied times
+    board_start = np.maximum.accumulate(np.where(new_board, index, 0))
+    tie_start = np.maximum.accumulate(np.where(new_time, index, 0))
+    positions = np.empty_like(order)
+    positions[order] = tie_start - board_start + 1
+    records = np.empty_like(times)
+    records[order] = sorted_times[board_start]
+    return positions, records
+
+
+def rank_boards_python(boards, times):
+    """Same as rank_boards_numpy(), for installs without NumPy."""
+    positions, records = [0] * len(times), [0] * len(times)
+    previous = None
+    for k, i in enumerate(sorted(range(len(times)), key=lambda i: (boards[i], times[i]))):
+        if previous is None or boards[i] != boards[previous]:
+            board_start, tie_start, record = k, k, times[i]
+        elif times[i] != times[previous]:
+            tie_start = k
+        positions[i], records[i] = tie_start - board_start + 1, record
+        previous = i
+    return positions, records
+
+
+def score_boards(boards, times):
+    """Returns positions, points and percentage-of-record scores per row."""
+    if np is not None:
+        positions, records = rank_boards_numpy(boards, times)
+        table = np.array((0,) + POINTS)
+        points = np.where(positions <= len(POINTS), table[np.minimum(positions, len(POINTS))], 0)
+        scores = 100.0 * records / np.asarray(times, dtype=np.float64)
+        return positions.tolist(), points.tolist(), scores.tolist()
+    positions, records = rank_boards_python(boards, times)
+    points = [POINTS[position - 1] if position <= len(POINTS) else 0 for position in positions]
+    scores = [100.0 * record / time for record, time in zip(records, times)]
+    return positions, points, scores
+
+
+def changed_boards(since):
+    """Boards written to since the given time, as car ids."""
+    return list(TrackRecord.objects.filter(updated_at__gte=since).values_list('car_id', flat=True))
+
+
+def compute(incremental=False):
+    """
+    Recomputes board scores, all of them or only those of boards changed
+    since the last run, and rewrites the standings. Returns the number of
+    boards scored and of drivers ranked.
+    """
+    started = timezone.now()
+    last_run = Standing.objects.aggregate(last=Max('computed_at'))['last'] if incremental else None
+    # A zero time would be every board's record and score as a division by zero
+    entries = LeaderboardEntry.objects.filter(time__gt=timedelta(0))
+    if last_run is not None:
+        # A car belongs to one track of one game, so it names the board
+        cars = changed_boards(last_run - OVERLAP)
+        entries = entries.filter(car_id__in=cars)
+
+    # Flat columns rather than row tuples keep a million entries cheap to hold
+    codes, boards, user_ids, times = {}, [], [], []
+    for game_id, track_id, car_id, user_id, time in entries.values_list('game_id', 'track_id', 'car_id', 'user_id', 'time').iterator(chunk_size=5000):
+        boards.append(codes.setdefault((game_id, track_id, car_id), len(codes)))
+        user_ids.append(user_id)
+        times.append(to_ms(time))
+    positions, points, scores = score_boards(boards, times) if times else ([], [], [])
+    board_ids = list(codes)
+
+    with transaction.atomic():
+        if last_run is None:
+            BoardScore.objects.all().delete()
+        else:
+            # Boards that lost their last entry have no TrackRecord left
+            BoardScore.objects.filter(Q(car_id__in=cars) | ~Q(car_id__in=TrackRecord.objects.values('car_id'))).delete()
+        BoardScore.objects.bulk_create(
+            (
+                BoardScore(game_id=board_ids[board][0], track_id=board_ids[board][1], car_id=board_ids[board][2],
+                           user_id=user_id, position=position, points=point, score=score)
+                for board, user_id, position, point, score in zip(boards, user_ids, positions, points, scores)
+            ),
+            batch_size=1000,
+        )
+        totals = BoardScore.objects.values('user_id').annotate(
+            total_points=Sum('points'), mean_score=Avg('score'), board_count=Count('id'),
+            record_count=Count('id', filter=Q(position=1)),
+        ).order_by('-total_points', '-mean_score', 'user_id')
+
+        standings, previous = [], None
+        for place, total in enumerate(totals.iterator(), start=1):
+            key = (total['total_points'], round(total['mean_score'], 6))
+            rank = standings[-1].rank if key == previous else place
+            standings.append(Standing(
+                user_id=total['user_id'], rank=rank, points=total['total_points'], score=total['mean_score'],
+                boards=total['board_count'], records=total['record_count'], computed_at=started,
+            ))
+            previous = key
+        Standing.objects.all().delete()
+        Standing.objects.bulk_create(standings, batch_size=1000)
+        transaction.on_commit(lambda: cache.bump(cache.STANDINGS), robust=True)
+    return len(codes), len(standings)
@@ -0,0 +1,52 @@
+// typeahead.js
+//
+// Fills the <datalist> of a TypeaheadSelect (see forms.py) from api/search/
+// as the name is typed, and puts the id of the chosen name in the hidden
+// input the form submits.
+
+document.querySelectorAll('[data-typeahead]').forEach((input) => {
+    const value = document.getElementById(input.dataset.typeaheadValue);
+    const options = input.list;
+    let pending = null;
+    let timer = null;
+
+    // Two drivers can share a name, so those options carry the id too
+    const label = (result, names) => (names[result.name] > 1 ? `${result.name} (#${result.id})` : result.name);
+
+    const choose = () => {
+        const option = Array.from(options.options).find((o) => o.value === input.value);
+        value.value = option ? option.dataset.id : '';
+    };
+
+    const suggest = () => {
+        if (pending) {
+            pending.abort();
+        }
+        pending = new AbortController();
+        const url = `${input.dataset.typeahead}&q=${encodeURIComponent(input.value)}`;
+        fetch(url, { signal: pending.signal, headers: { Accept: 'application/json' } })
+            .then((response) => response.json())
+            .then((data) => {
+                const names = {};
+                data.results.forEach((result) => { names[result.name] = (names[result.name] || 0) + 1; });
+                options.replaceChildren(...data.results.map((result) => {
+                    const option = document.createElement('option');
+                    option.value = label(result, names);
+                    option.dataset.id = result.id;
+                    return option;
+                }));
+                choose();
+            })
+            .catch((error) => {
+                if (error.name !== 'AbortError') {
+                    console.error(error);
+                }
+            });
+    };
+
+    input.addEventListener('input', () => {
+        choose();
+        clearTimeout(timer);
+        timer = setTimeout(suggest, 150);
+    });
+});
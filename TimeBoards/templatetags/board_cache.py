@@ -0,0 +1,31 @@
+from django import template
+from TimeBoards.cache import fetch
+
+register = template.Library()
+
+
+@register.tag
+def cachedfragment(parser, token):
+    """
+    Caches the enclosed template fragment under a name and version tag:
+
+        {% cachedfragment 'homepage' cache_version %} ... {% endcachedfragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a name and a version tag")
+    nodelist = parser.parse(('endcachedfragment',))
+    parser.delete_first_token()
+    return CachedFragmentNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
+
+
+class CachedFragmentNode(template.Node):
+    def __init__(self, nodelist, name, tag):
+        self.nodelist = nodelist
+        self.name = name
+        self.tag = tag
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        tag = self.tag.resolve(context)
+        return fetch(f'fragment:{name}', tag, lambda: self.nodelist.render(context))
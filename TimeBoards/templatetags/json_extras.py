@@ -1,26 +1,46 @@
+import hashlib
+import json
+
 from django import template
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from TimeBoards import cache
 
 register = template.Library()
 
 @register.filter
 def render_json(value):
-    if isinstance(value, dict):
-        return render_dict(value)
-    elif isinstance(value, list):
-        return render_list(value)
-    else:
-        return value
-
-def render_dict(d):
-    html = '<ul>'
-    for key, value in d.items():
-        html += f'<li><strong>{key}:</strong> {render_json(value)}</li>'
-    html += '</ul>'
-    return html
+    """
+    Renders nested dicts and lists as nested <ul> lists, escaping every key
+    and value. Built with an explicit stack, so deep or large settings cost
+    one join instead of a recursive string copy per level.
+    """
+    parts = []
+    # Each item is either markup to emit as is, or a value still to render
+    stack = [(False, value)]
+    while stack:
+        is_markup, item = stack.pop()
+        if is_markup:
+            parts.append(item)
+        elif isinstance(item, dict):
+            parts.append('<ul>')
+            stack.append((True, '</ul>'))
+            for key, child in reversed(item.items()):
+                stack += [(True, '</li>'), (False, child), (True, f'<li><strong>{escape(key)}:</strong> ')]
+        elif isinstance(item, list):
+            parts.append('<ul>')
+            stack.append((True, '</ul>'))
+            for child in reversed(item):
+                stack += [(True, '</li>'), (False, child), (True, '<li>')]
+        else:
+            parts.append(escape(item))
+    return mark_safe(''.join(parts))
 
-def render_list(lst):
-    html = '<ul>'
-    for item in lst:
-        html += f'<li>{render_json(item)}</li>'
-    html += '</ul>'
-    return html
+def settings_html(value):
+    """
+    render_json() memoized in the shared cache by a hash of the content, so
+    each distinct settings blob is rendered once whatever else changes.
+    """
+    digest = hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+    return cache.fetch('settings_html', digest, lambda: render_json(value), timeout=None)
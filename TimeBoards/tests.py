@@ -1,3 +1,1057 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.template.base import Template
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+
+from TimeBoards import api, benchmark, cache, exports, ingest, instrumentation, live, publish, search, standings
+from TimeBoards.forms import AddLeaderboardEntryForm, LeaderboardEntryForm
+from TimeBoards.leaderboards import DatabaseBackend, RedisBackend, get_backend
+from TimeBoards.models import BoardScore, Car, DriverBoardStat, Game, LapRecord, LeaderboardEntry, Person, Track, TrackRecord
+from TimeBoards.services import Lap, submit_lap, submit_laps
+from TimeBoards.sqlite.base import enable_wal
+from TimeBoards.templatetags.json_extras import render_json, settings_html
+from TimeBoards.views import driver_profile, list_board_catalog, live_events
+
+
+# Pages render without a collectstatic manifest in tests
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+def make_board(track='Ring', car='GT3'):
+    """Creates the game, track and car of the one board most tests race on."""
+    game = Game.objects.create(name='Apex Racing', settings={'gameSettings': {}})
+    track = Track.objects.create(name=track, game=game)
+    return game, track, Car.objects.create(name=car, game=game, track=track)
+
+
+def make_people(*names):
+    return [Person.objects.create(name=name) for name in names]
+
+
+class BoardGapTests(TestCase):
+    """with_gaps() ranks every entry and finds its next closest time in one query."""
+
+    @classmethod
+    def setUpTestData(cls):
+        game, track, cls.car = make_board()
+        cls.solo_car = Car.objects.create(name='GT4', game=game, track=track)
+        for name, seconds in [('A', 80), ('B', 81), ('C', 81), ('D', 83)]:
+            person = Person.objects.create(name=name)
+            LeaderboardEntry.objects.create(game=game, track=track, car=cls.car, user=person, time=timedelta(seconds=seconds))
+        LeaderboardEntry.objects.create(game=game, track=track, car=cls.solo_car, user=person, time=timedelta(seconds=90))
+
+    def test_leader_compares_to_runner_up_and_others_to_leader(self):
+        with self.assertNumQueries(1):
+            rows = list(LeaderboardEntry.objects.filter(car=self.car).with_gaps().order_by('time', 'id').values_list(
+                'user__name', 'board_rank', 'board_next_time', 'board_gap'))
+        second = timedelta(seconds=1)
+        self.assertEqual(rows, [
+            ('A', 1, 81 * second, second),
+            ('B', 2, 80 * second, second),
+            ('C', 2, 80 * second, second),
+            ('D', 4, 80 * second, 3 * second),
+        ])
+
+    def test_lone_entry_has_no_gap(self):
+        entry = LeaderboardEntry.objects.filter(car=self.solo_car).with_gaps().get()
+        self.assertIsNone(entry.next_closest_time)
+        self.assertEqual(entry.difference, '00:00:000')
+
+
+@override_settings(STORAGES=STORAGES)
+class BoardRecordTests(TestCase):
+    """records() picks the holder of every board in the database."""
+
+    @classmethod
+    def setUpTestData(cls):
+        game, track, cls.gt3 = make_board()
+        cls.gt4 = Car.objects.create(name='GT4', game=game, track=track)
+        for car, name, seconds in [(cls.gt3, 'Alice', 81), (cls.gt3, 'Bob', 80), (cls.gt4, 'Carol', 79), (cls.gt4, 'Dave', 79)]:
+            person, _ = Person.objects.get_or_create(name=name)
+            LeaderboardEntry.objects.create(game=game, track=track, car=car, user=person, time=timedelta(seconds=seconds))
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_one_record_per_board(self):
+        with self.assertNumQueries(1):
+            records = {record.car: record for record in LeaderboardEntry.objects.records()}
+        # A tie goes to the entry logged first
+        self.assertEqual({car.name: record.user.name for car, record in records.items()}, {'GT3': 'Bob', 'GT4': 'Carol'})
+        self.assertEqual((records[self.gt3].board_size, records[self.gt3].board_gap), (2, timedelta(seconds=1)))
+        self.assertEqual(records[self.gt4].board_gap, timedelta(0))
+
+    def test_homepage_lists_holders(self):
+        response = self.client.get('/')
+        self.assertEqual(re.findall(r'<td>(\w+)</td>\s*<td>Apex Racing', response.content.decode()), ['Bob', 'Carol'])
+
+
+class TrackRecordTests(TestCase):
+    """TrackRecord follows every write to a board and matches a full rebuild."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.board = make_board()
+        cls.alice, cls.bob = make_people('Alice', 'Bob')
+
+    def summary(self):
+        return list(TrackRecord.objects.values_list('car_id', 'holder_id', 'record_time', 'runner_up_time', 'gap', 'entry_count'))
+
+    def test_follows_writes_and_deletes(self):
+        submit_lap(self.alice, *self.board, timedelta(seconds=80))
+        submit_lap(self.bob, *self.board, timedelta(seconds=82))
+        car_id = self.board[2].id
+        self.assertEqual(self.summary(), [(car_id, self.alice.id, timedelta(seconds=80), timedelta(seconds=82), timedelta(seconds=2), 2)])
+        incremental = self.summary()
+        TrackRecord.objects.rebuild()
+        self.assertEqual(self.summary(), incremental)
+
+        # Deleting the holder hands the record to the runner-up, the last entry removes the row
+        self.alice.delete()
+        self.assertEqual(self.summary(), [(car_id, self.bob.id, timedelta(seconds=82), None, None, 1)])
+        LeaderboardEntry.objects.get().delete()
+        self.assertEqual(self.summary(), [])
+
+    def test_refreshes_only_when_the_board_changes(self):
+        submit_lap(self.alice, *self.board, timedelta(seconds=80))
+        entry = LeaderboardEntry.objects.get()
+        with CaptureQueriesContext(connection) as unchanged:
+            entry.save()
+        self.assertFalse([q for q in unchanged.captured_queries if 'trackrecord' in q['sql'].lower()])
+        entry.user = self.bob
+        with CaptureQueriesContext(connection) as changed:
+            entry.save()
+        self.assertTrue([q for q in changed.captured_queries if 'trackrecord' in q['sql'].lower()])
+        self.assertEqual(TrackRecord.objects.get().holder, self.bob)
+
+
+@override_settings(STORAGES=STORAGES)
+class LeaderboardBackendTests(TestCase):
+    """The Redis mirror answers board reads exactly like the database, ties included."""
+
+    @classmethod
+    def setUpTestData(cls):
+        game, track, car = make_board()
+        cls.board = (game.id, track.id, car.id)
+        # Ids 9 and 10 sort differently as strings and as numbers
+        times = {9: 81, 10: 81, 11: 80, 12: 83, 13: 81}
+        for person_id, seconds in times.items():
+            person = Person.objects.create(id=person_id, name=f'Driver {person_id}')
+            LeaderboardEntry.objects.create(game=game, track=track, car=car, user=person, time=timedelta(seconds=seconds))
+        cls.user_ids = list(times)
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def redis(self):
+        backend = RedisBackend(FAKE=True)
+        backend.resync()
+        return backend
+
+    def test_backends_agree(self):
+        database, redis = DatabaseBackend(), self.redis()
+        self.assertEqual([(row.rank, row.user_id) for row in database.top(self.board, None)],
+                         [(1, 11), (2, 9), (2, 10), (2, 13), (5, 12)])
+        self.assertEqual(redis.top(self.board, None), database.top(self.board, None))
+        self.assertEqual(redis.top(self.board, 3), database.top(self.board, 3))
+        for user_id in self.user_ids + [404]:
+            with self.subTest(user_id=user_id):
+                self.assertEqual(redis.rank(self.board, user_id), database.rank(self.board, user_id))
+                self.assertEqual(redis.around(self.board, user_id, radius=1), database.around(self.board, user_id, radius=1))
+                self.assertEqual(redis.gap_to_next(self.board, user_id), database.gap_to_next(self.board, user_id))
+        self.assertEqual(database.gap_to_next(self.board, 10), timedelta(0))
+
+    def test_resync_replaces_stale_boards(self):
+        redis = self.redis()
+        LeaderboardEntry.objects.filter(user_id=11).delete()
+        redis.update(LeaderboardEntry(game_id=404, track_id=404, car_id=404, user=Person(id=9, name='Driver 9'),
+                                      time=timedelta(seconds=1), logged_at=timezone.now()))
+        self.assertEqual(redis.resync(), 4)
+        self.assertEqual([row.user_id for row in redis.top(self.board, None)], [9, 10, 13, 12])
+        self.assertEqual(redis.top((404, 404, 404)), [])
+
+    @override_settings(LEADERBOARD_BACKEND={'BACKEND': 'TimeBoards.leaderboards.RedisBackend', 'OPTIONS': {'FAKE': True}})
+    def test_board_page_reads_the_mirror(self):
+        get_backend().resync()
+        with self.captureOnCommitCallbacks(execute=True):
+            submit_lap(Person.objects.get(id=12), *map(lambda model, pk: model.objects.get(pk=pk), (Game, Track, Car), self.board),
+                       timedelta(seconds=79))
+        self.assertEqual(get_backend().rank(self.board, 12), 1)
+        url = '/games/{}/tracks/{}/car/{}/times/'.format(*self.board)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse([query for query in queries if 'leaderboardentry' in query['sql'].lower() and 'MAX' not in query['sql']])
+        names = re.findall(r'<td>(Driver \d+)</td>', response.content.decode())
+        self.assertEqual(names, ['Driver 12', 'Driver 11', 'Driver 9', 'Driver 10', 'Driver 13'])
+
+
+class CacheTests(TestCase):
+    """Writes bump the versions of the scopes they feed, after commit."""
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_bump_invalidates_cached_values(self):
+        producer = iter(range(3)).__next__
+        self.assertEqual(cache.fetch('people', cache.version_tag(cache.PEOPLE), producer), 0)
+        self.assertEqual(cache.fetch('people', cache.version_tag(cache.PEOPLE), producer), 0)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Person.objects.create(name='Alice')
+        # Nothing changes before the write commits
+        self.assertEqual(cache.fetch('people', cache.version_tag(cache.PEOPLE), producer), 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(cache.fetch('people', cache.version_tag(cache.PEOPLE), producer), 1)
+
+    def test_several_workers_need_a_shared_cache(self):
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '3'}):
+            self.assertEqual([error.id for error in cache.check_shared_cache(None)], ['TimeBoards.E001'])
+            with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                                   'LOCATION': tempfile.gettempdir()}}):
+                self.assertEqual(cache.check_shared_cache(None), [])
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+            self.assertEqual(cache.check_shared_cache(None), [])
+
+
+class SubmitLapTests(TestCase):
+    """A lap replaces a driver's entry only when it beats it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.board = make_board()
+        cls.alice, cls.bob = make_people('Alice', 'Bob')
+
+    def test_only_faster_laps_replace_the_entry(self):
+        first = submit_lap(self.alice, *self.board, timedelta(seconds=80))
+        self.assertEqual((first.personal_best, first.record), (True, True))
+        slower = submit_lap(self.alice, *self.board, timedelta(seconds=85))
+        self.assertEqual(slower, (None, False, False))
+        self.assertEqual(LeaderboardEntry.objects.get(user=self.alice).time, timedelta(seconds=80))
+        self.assertFalse(submit_lap(self.bob, *self.board, timedelta(seconds=81)).record)
+        self.assertTrue(submit_lap(self.bob, *self.board, timedelta(seconds=79)).record)
+        record = TrackRecord.objects.get(car=self.board[2])
+        self.assertEqual((record.holder, record.record_time, record.gap, record.entry_count),
+                         (self.bob, timedelta(seconds=79), timedelta(seconds=1), 2))
+        # Every lap is kept in the history
+        self.assertEqual(LapRecord.objects.count(), 4)
+
+    def test_zero_times_are_rejected(self):
+        with self.assertRaises(ValueError):
+            submit_lap(self.alice, *self.board, timedelta(0))
+        game, track, car = self.board
+        form = AddLeaderboardEntryForm({'game': game.id, 'track': track.id, 'car': car.id, 'user': self.alice.id,
+                                        'minutes': 0, 'seconds': 0, 'milliseconds': 0})
+        self.assertEqual(form.errors['__all__'], ['Enter a lap time above zero.'])
+
+    def test_entry_form_rejects_cars_of_other_boards(self):
+        game, track, car = self.board
+        other = Car.objects.create(name='GT4', game=game, track=Track.objects.create(name='Loop', game=game))
+        data = {'game': game.id, 'track': track.id, 'car': other.id, 'user': self.alice.id,
+                'minutes': 1, 'seconds': 20, 'milliseconds': 0}
+        self.assertIn('car', AddLeaderboardEntryForm(data).errors)
+        self.assertTrue(AddLeaderboardEntryForm({**data, 'car': car.id}).is_valid())
+
+
+class ImportLapsTests(TestCase):
+    """import_laps keeps personal bests and skips bad rows without aborting."""
+
+    def import_file(self, suffix, content):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_laps', f.name, '--batch-size', '2', stdout=out, stderr=err)
+        return out.getvalue()
+
+    def test_jsonl(self):
+        lap = {'game': 'Apex Racing', 'track': 'Ring', 'car': 'GT3', 'driver': 'Alice', 'time': '01:20:000'}
+        lines = [lap, '{"game": ', {**lap, 'driver': None}, {**lap, 'time': '01:19:500'}, {**lap, 'time': '01:22:000'}, [1, 2]]
+        out = self.import_file('.jsonl', '\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines))
+        self.assertIn('6 rows', out)
+        self.assertIn('1 new entries, 1 personal bests improved, 1 laps slower than the driver\'s best, 3 invalid rows skipped', out)
+        self.assertEqual(list(Person.objects.values_list('name', flat=True)), ['Alice'])
+        self.assertEqual(LeaderboardEntry.objects.get().time, timedelta(seconds=79, milliseconds=500))
+        self.assertEqual(LapRecord.objects.count(), 3)
+
+    def test_csv_short_rows_are_invalid(self):
+        out = self.import_file('.csv', 'game,track,car,driver,time\nApex Racing,Ring,GT3,Bob,01:21:000\nApex Racing,Ring\n')
+        self.assertIn('1 new entries', out)
+        self.assertIn('1 invalid rows skipped', out)
+        self.assertFalse(Track.objects.filter(name='None').exists())
+
+
+class ExportTests(TestCase):
+    """Exports stream every entry in the columns import_laps reads back."""
+
+    @classmethod
+    def setUpTestData(cls):
+        game, track, cls.car = make_board()
+        cls.url = f'/games/{game.id}/tracks/{track.id}/car/{cls.car.id}/times/export/'
+        for name, ms in [('Bob', 81250), ('Alice', 80000)]:
+            LeaderboardEntry.objects.create(game=game, track=track, car=cls.car, user=Person.objects.create(name=name),
+                                            time=timedelta(milliseconds=ms))
+
+    def test_csv(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="times-{self.car.game_id}-{self.car.track_id}-{self.car.id}.csv"')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([(row['driver'], row['time'], row['time_ms']) for row in rows],
+                         [('Alice', '01:20:000', '80000'), ('Bob', '01:21:250', '81250')])
+
+    def test_ndjson_round_trips_through_import(self):
+        response = self.client.get(f'/car/{self.car.id}/export/', {'format': 'ndjson'})
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual([json.loads(line)['driver'] for line in content.splitlines()], ['Alice', 'Bob'])
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 404)
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command('import_laps', f.name, stdout=out, stderr=io.StringIO())
+        self.assertIn('0 new entries, 0 personal bests improved, 2 laps slower', out.getvalue())
+
+    async def test_asgi_streams_one_chunk_at_a_time(self):
+        with mock.patch.object(exports, 'CHUNK_SIZE', 1):
+            response = await self.async_client.get(self.url, {'format': 'ndjson'})
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual([json.loads(chunk)['driver'] for chunk in chunks], ['Alice', 'Bob'])
+
+
+class ApiTests(TestCase):
+    """Keyset pages cover a board exactly once, ties included."""
+
+    @classmethod
+    def setUpTestData(cls):
+        game, track, car = make_board()
+        cls.url = f'/api/boards/{game.id}/{track.id}/{car.id}/'
+        cls.board = (game.id, track.id, car.id)
+        cls.people = make_people(*'ABCDE')
+        # Entry ids run against driver ids, so a tiebreak on the entry would show
+        for person, seconds in reversed(list(zip(cls.people, [80, 81, 81, 81, 82]))):
+            LeaderboardEntry.objects.create(game=game, track=track, car=car, user=person, time=timedelta(seconds=seconds))
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_pages_across_ties(self):
+        rows, params = [], {'limit': 2}
+        while True:
+            page = self.client.get(self.url, params).json()
+            rows += [(row['rank'], row['driver']['name']) for row in page['results']]
+            if not page['next']:
+                break
+            params['cursor'] = page['next']
+        self.assertEqual(rows, [(1, 'A'), (2, 'B'), (2, 'C'), (2, 'D'), (5, 'E')])
+        self.assertEqual([row.name for row in DatabaseBackend().top(self.board)], list('ABCDE'))
+        self.assertEqual([entry.user.name for entry in DatabaseBackend().entries(self.board)], list('ABCDE'))
+
+    def test_later_pages_do_not_count_the_rows_ahead(self):
+        cursor = self.client.get(self.url, {'limit': 2}).json()['next']
+        with CaptureQueriesContext(connection) as queries:
+            page = self.client.get(self.url, {'limit': 2, 'cursor': cursor}).json()
+        self.assertEqual([(row['rank'], row['driver']['name']) for row in page['results']], [(2, 'C'), (2, 'D')])
+        self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql']])
+
+    def test_gap_to_a_tied_driver(self):
+        response = self.client.get(f'{self.url}drivers/{self.people[2].id}/')
+        self.assertEqual(response.json()['rank'], 2)
+        self.assertEqual(response.json()['gap_to_next'], {'time': '00:00:000', 'time_ms': 0})
+
+    def test_invalid_cursors(self):
+        encode = lambda values: signing.dumps(values, salt=api.CURSOR_SALT)
+        forged = base64.urlsafe_b64encode(json.dumps([{'ms': 80000}, 1, 0, 1]).encode()).decode()
+        for cursor in ['nope', forged, encode([5, 1, 0, 1]), encode([{'at': 5}, 1, 0, 1]), encode([{'ms': 'fast'}, 1, 0, 1]),
+                       encode([{'ms': 80000}, '1', 0, 1]), encode([{'ms': 80000}, 1, True, 1]), encode([{'ms': 1}])]:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 400)
+
+
+@override_settings(STORAGES=STORAGES)
+class LapHistoryTests(TestCase):
+    """Every lap is kept, and only submit_lap() writes the history."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.board = make_board()
+        cls.alice, = make_people('Alice')
+        for seconds in [85, 83, 84, 83, 80]:
+            submit_lap(cls.alice, *cls.board, timedelta(seconds=seconds))
+
+    def test_progression_lists_improvements(self):
+        laps = LapRecord.objects.progression(self.alice, *(obj.id for obj in self.board))
+        self.assertEqual([lap.time.seconds for lap in laps], [85, 83, 80])
+
+    def test_admin_is_read_only(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        lap = LapRecord.objects.first()
+        self.assertEqual(self.client.get('/admin/TimeBoards/laprecord/').status_code, 200)
+        self.assertEqual(self.client.get('/admin/TimeBoards/laprecord/add/').status_code, 403)
+        self.assertEqual(self.client.get(f'/admin/TimeBoards/laprecord/{lap.id}/delete/').status_code, 403)
+        entry = LeaderboardEntry.objects.get()
+        self.assertEqual(self.client.get('/admin/TimeBoards/leaderboardentry/').status_code, 200)
+        self.assertEqual(self.client.get('/admin/TimeBoards/leaderboardentry/add/').status_code, 403)
+        self.assertEqual(self.client.post(f'/admin/TimeBoards/leaderboardentry/{entry.id}/change/', {'time': '00:01:00'}).status_code, 403)
+        self.assertEqual(self.client.get(f'/admin/TimeBoards/leaderboardentry/{entry.id}/delete/').status_code, 403)
+
+    def test_form_save_goes_through_the_history(self):
+        game, track, car = self.board
+        form = LeaderboardEntryForm({'user': self.alice.id, 'minutes': 1, 'seconds': 21, 'milliseconds': 0},
+                                    instance=LeaderboardEntry(game=game, track=track, car=car))
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save().time, timedelta(seconds=80))
+        laps = LapRecord.objects.filter(user=self.alice)
+        self.assertEqual(laps.count(), 6)
+        self.assertEqual(LeaderboardEntry.objects.get().time, laps.order_by('time').first().time)
+
+
+@override_settings(STORAGES=STORAGES)
+class BoardCatalogTests(TestCase):
+    """A game's track/car combos come with their records from one joined query."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.game, ring, gt3 = make_board()
+        loop = Track.objects.create(name='Loop', game=cls.game)
+        Car.objects.create(name='GT4', game=cls.game, track=ring)
+        Car.objects.create(name='GT3', game=cls.game, track=loop)
+        submit_lap(Person.objects.create(name='Alice'), cls.game, ring, gt3, timedelta(seconds=80))
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_combos_with_records(self):
+        # The page of combos plus the paginator's count
+        with self.assertNumQueries(2):
+            page = list_board_catalog(self.game.id, 1)
+        self.assertEqual([(combo['track__name'], combo['name'], combo['record_time'], combo['trackrecord__holder__name'])
+                          for combo in page['combos']],
+                         [('Loop', 'GT3', None, None), ('Ring', 'GT3', '01:20:000', 'Alice'), ('Ring', 'GT4', None, None)])
+        self.assertContains(self.client.get(f'/games/{self.game.id}/tracks/'), '01:20:000 (Alice)')
+
+
+@override_settings(STORAGES=STORAGES)
+class ConditionalPageTests(TestCase):
+    """Unchanged pages are answered with 304 until a lap, rename or catalog edit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.board = make_board()
+        cls.alice, = make_people('Alice')
+        submit_lap(cls.alice, *cls.board, timedelta(seconds=80))
+        cls.urls = ['/', '/games/{}/tracks/{}/car/{}/times/'.format(*(obj.id for obj in cls.board)), f'/people/{cls.alice.id}/']
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def assertUnchanged(self, etags, unchanged=True):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, headers={'If-None-Match': etags[url]})
+                self.assertEqual(response.status_code, 304 if unchanged else 200)
+
+    def test_not_modified_until_a_write(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        self.assertUnchanged(etags)
+        with self.captureOnCommitCallbacks(execute=True):
+            submit_lap(self.alice, *self.board, timedelta(seconds=79))
+        self.assertUnchanged(etags, unchanged=False)
+
+    def test_rename_changes_every_page(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.name = 'Alicia'
+            self.alice.save()
+        self.assertUnchanged(etags, unchanged=False)
+
+
+@override_settings(STORAGES=STORAGES)
+class LiveTests(TestCase):
+    """Committed writes reach the open streams of their board."""
+
+    async def test_stream_delivers_board_messages(self):
+        events = live_events(live.board_channel(1, 2, 3))
+        self.assertEqual(await anext(events), 'retry: 3000\n\n')
+        # Published from a worker thread, like an on_commit hook
+        await asyncio.to_thread(live.publish, (1, 2, 3), {'type': 'entry', 'rank': 1})
+        self.assertEqual(await anext(events), 'event: entry\ndata: {"type": "entry", "rank": 1}\n\n')
+        await events.aclose()
+        self.assertEqual(live.get_bus().subscriber_count(), 0)
+
+    async def test_slow_viewer_gets_one_resync(self):
+        subscription = live.get_bus().subscribe('board:slow')
+        for rank in range(live.Subscription.MAX_PENDING + 5):
+            live.get_bus().deliver('board:slow', {'type': 'entry', 'rank': rank})
+        await asyncio.sleep(0)
+        self.assertEqual(await subscription.get(), {'type': 'resync'})
+        self.assertEqual(await subscription.get(), {'type': 'entry', 'rank': live.Subscription.MAX_PENDING + 1})
+        subscription.close()
+
+    def test_entry_published_after_commit(self):
+        game, track, car = make_board()
+        with mock.patch.object(live, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                submit_lap(Person.objects.create(name='Alice'), game, track, car, timedelta(seconds=80))
+            publish.assert_not_called()
+            for callback in callbacks:
+                callback()
+        (board, message), = [call.args for call in publish.call_args_list]
+        self.assertEqual(board, (game.id, track.id, car.id))
+        self.assertEqual((message['type'], message['rank'], message['record'], message['time_ms']), ('entry', 1, True, 80000))
+
+    def test_streams_need_asgi(self):
+        self.assertEqual(self.client.get('/live/').status_code, 501)
+
+    async def test_redis_listener_resubscribes_and_resyncs(self):
+        class PubSub:
+            attempts = 0
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                pass
+
+            def psubscribe(self, pattern):
+                PubSub.attempts += 1
+
+            def listen(self):
+                if PubSub.attempts == 1:
+                    raise ConnectionError('Redis went away')
+                bus.stop()
+                yield {'channel': b'timeboards:live:board:1:2:3', 'data': b'{"type": "entry", "rank": 1}'}
+
+        bus = live.RedisBus(URL='redis://localhost:6379/0', RETRY_DELAY=0)
+        bus.client = mock.Mock(pubsub=lambda **kwargs: PubSub())
+        # Runs the listener in this test rather than on its own thread
+        bus.listener = mock.Mock(is_alive=lambda: True)
+        subscription = bus.subscribe('board:1:2:3')
+        with self.assertLogs('TimeBoards.live', 'ERROR'):
+            await asyncio.to_thread(bus.listen)
+        self.assertEqual(PubSub.attempts, 2)
+        self.assertEqual(await subscription.get(timeout=1), {'type': 'resync'})
+        self.assertEqual(await subscription.get(timeout=1), {'type': 'entry', 'rank': 1})
+        subscription.close()
+
+
+@override_settings(TIMEBOARDS_QUERY_BUDGETS_STRICT=True, STORAGES=STORAGES)
+class QueryBudgetTests(TestCase):
+    """Pages declaring a @query_budget stay within it with empty caches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmark.seed(games=2, tracks=3, cars=2, drivers=40, laps=2000)
+        cls.urls = benchmark.benchmark_urls(benchmark.sample_kwargs())
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_views_stay_within_budget(self):
+        budgeted = {key: url for key, url in self.urls.items() if hasattr(resolve(url).func, 'query_budget')}
+        self.assertGreater(len(budgeted), 10)
+        for key, url in budgeted.items():
+            with self.subTest(route=key):
+                cache.get_cache().clear()
+                # Raises QueryBudgetExceeded from the middleware when over budget
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_every_benchmarked_page_answers_200(self):
+        self.client.force_login(User.objects.create_superuser('admin', password=None))
+        for key, url in self.urls.items():
+            with self.subTest(route=key):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        benchmark.warm_up(benchmark.async_urls(self.urls))
+        self.assertIn('/track/<int:track_id>/', benchmark.async_urls(self.urls))
+
+    async def test_async_pages_answer_200_under_asgi(self):
+        for key, url in benchmark.async_urls(self.urls).items():
+            with self.subTest(route=key):
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/')
+        self.assertRegex(response['Server-Timing'], r'^sql;dur=[\d.]+;desc="\d+ queries, \d+ duplicated", render;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_render_time_comes_from_the_template_backend(self):
+        instrumentation.stats.reset()
+        self.client.get('/')
+        self.assertGreater(instrumentation.stats.summary()['homepage']['render_ms_mean'], 0)
+        self.assertFalse(hasattr(Template.render, 'timed'))
+
+
+@override_settings(STORAGES=STORAGES)
+class DriverBoardStatTests(TestCase):
+    """The per-board rollup follows every rival's laps and serves driver profiles."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.board = make_board()
+        cls.alice, cls.bob, cls.carol = make_people('Alice', 'Bob', 'Carol')
+        for person, seconds in [(cls.alice, 80), (cls.bob, 82), (cls.carol, 81)]:
+            submit_lap(person, *cls.board, timedelta(seconds=seconds))
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def stats(self):
+        return {stat.user.name: (stat.rank, stat.gap.seconds, stat.previous_time)
+                for stat in DriverBoardStat.objects.select_related('user')}
+
+    def test_rivals_follow_an_improvement(self):
+        submit_lap(self.bob, *self.board, timedelta(seconds=79))
+        self.assertEqual(self.stats(), {
+            'Bob': (1, 0, timedelta(seconds=82)),
+            'Alice': (2, 1, None),
+            'Carol': (3, 2, None),
+        })
+        ranks = dict(LeaderboardEntry.objects.with_gaps().values_list('user__name', 'board_rank'))
+        self.assertEqual({name: stat[0] for name, stat in self.stats().items()}, ranks)
+
+    def test_profile(self):
+        submit_lap(self.bob, *self.board, timedelta(seconds=79))
+        with self.assertNumQueries(1):
+            profile = driver_profile(self.bob)
+        self.assertEqual((profile['records'], profile['podiums'], profile['average_gap']), (1, 1, '00:00:000'))
+        self.assertEqual([stat.previous_time for stat in profile['improvements']], [timedelta(seconds=82)])
+        self.assertContains(self.client.get(f'/people/{self.carol.id}/'), '3 / 3')
+
+
+class StandingsTests(TestCase):
+    """Both ranking paths agree, and zero lap times are left out of the scores."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.board = make_board()
+        cls.alice, cls.bob = make_people('Alice', 'Bob')
+
+    @skipIf(standings.np is None, 'NumPy is not installed')
+    def test_numpy_matches_python(self):
+        rng = random.Random(17)
+        boards = [rng.randrange(5) for _ in range(500)]
+        times = [rng.randrange(60000, 60050) for _ in range(500)]
+        expected = standings.score_boards(boards, times)
+        with mock.patch.object(standings, 'np', None):
+            self.assertEqual(standings.score_boards(boards, times), expected)
+        self.assertEqual([list(column) for column in standings.rank_boards_numpy(boards, times)],
+                         list(standings.rank_boards_python(boards, times)))
+
+    def test_zero_time_is_not_scored(self):
+        game, track, car = self.board
+        LeaderboardEntry.objects.create(user=self.alice, game=game, track=track, car=car, time=timedelta(0))
+        submit_lap(self.bob, *self.board, timedelta(seconds=80))
+        self.assertEqual(standings.compute(), (1, 1))
+        self.assertEqual(list(BoardScore.objects.values_list('user__name', 'position', 'score')), [('Bob', 1, 100.0)])
+
+
+@override_settings(STORAGES=STORAGES)
+class RenderJsonTests(TestCase):
+    """Game settings render as nested lists with every key and value escaped."""
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_keys_and_values_are_escaped(self):
+        html = render_json({'<script>': ['a & b', {'x': '<script>alert(1)</script>'}], 'n': 3})
+        self.assertEqual(html, (
+            '<ul><li><strong>&lt;script&gt;:</strong> <ul><li>a &amp; b</li>'
+            '<li><ul><li><strong>x:</strong> &lt;script&gt;alert(1)&lt;/script&gt;</li></ul></li></ul></li>'
+            '<li><strong>n:</strong> 3</li></ul>'
+        ))
+
+    def test_deep_settings(self):
+        value = 'leaf'
+        for _ in range(5000):
+            value = {'k': value}
+        self.assertEqual(render_json(value).count('<ul>'), 5000)
+
+    def test_game_page_escapes_settings_once_per_content(self):
+        game = Game.objects.create(name='Apex Racing', settings={'gameSettings': {'<b>': '<script>'}})
+        response = self.client.get(f'/games/{game.id}/tracks/')
+        self.assertContains(response, '<strong>&lt;b&gt;:</strong> &lt;script&gt;')
+        self.assertNotContains(response, '<b>:')
+        cache.stats.clear()
+        settings_html({'<b>': '<script>'})
+        self.assertEqual(cache.stats['settings_html.hits'], 1)
+
+
+@override_settings(STORAGES=STORAGES)
+class QueryPlanTests(TestCase):
+    """
+    The ordered reads behind the pages walk an index: EXPLAIN shows no full
+    scan, and top-N reads no sort step either.
+    """
+
+    ENTRIES = 'TimeBoards_leaderboardentry'
+    STATS = 'TimeBoards_driverboardstat'
+    # URL name: (table read in order, whether sorting its rows is expected).
+    # The board page ranks the whole board with window functions and a
+    # profile orders a driver's boards by name within a rank, so those sort
+    # the rows of one board or driver; every other read is a top-N.
+    ROUTES = {
+        'track_leaderboard': (ENTRIES, False),
+        'car_leaderboard': (ENTRIES, False),
+        'api_board': (ENTRIES, False),
+        'api_driver_times': (ENTRIES, False),
+        'track_times': (ENTRIES, True),
+        'person_times': (STATS, True),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmark.seed(games=2, tracks=3, cars=2, drivers=40, laps=2000)
+        cls.urls = benchmark.benchmark_urls(benchmark.sample_kwargs())
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+            elif connection.vendor == 'postgresql':
+                cursor.execute(f'ANALYZE "{cls.ENTRIES}"')
+                cursor.execute(f'ANALYZE "{cls.STATS}"')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tiny test tables would otherwise be read sequentially
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[3] for row in cursor.fetchall()]
+
+    def assertIndexedRead(self, plan, table, sorted_rows):
+        text = '\n'.join(plan)
+        if connection.vendor == 'postgresql':
+            self.assertNotRegex(text, rf'Seq Scan on "?{table}"?')
+            if not sorted_rows:
+                self.assertNotIn('Sort', text)
+        else:
+            self.assertRegex(text, rf'SEARCH {table} USING (COVERING )?INDEX')
+            if not sorted_rows:
+                self.assertNotIn('USE TEMP B-TREE', text)
+
+    def test_ordered_reads_use_an_index(self):
+        checked = set()
+        for key, url in self.urls.items():
+            name = resolve(url).url_name
+            if key.startswith('admin:') or name not in self.ROUTES:
+                continue
+            table, sorted_rows = self.ROUTES[name]
+            ordered = re.compile(rf'FROM "{table}".* ORDER BY "{table}"\."(time|rank)" ASC', re.S)
+            cache.get_cache().clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            for query in queries.captured_queries:
+                if ordered.search(query['sql']):
+                    checked.add(name)
+                    with self.subTest(route=key, sql=query['sql']):
+                        self.assertIndexedRead(self.explain(query['sql']), table, sorted_rows)
+        self.assertEqual(checked, set(self.ROUTES))
+
+
+@override_settings(LEADERBOARD_INGEST={'TOKEN': 'secret'})
+class IngestTests(TestCase):
+    """Batch lap submissions through api/laps/."""
+
+    @classmethod
+    def setUpTestData(cls):
+        game, track, cls.car = make_board()
+        cls.alice, cls.bob = make_people('Alice', 'Bob')
+        LeaderboardEntry.objects.create(game=game, track=track, car=cls.car, user=cls.alice, time=timedelta(seconds=80))
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def post(self, payload, compress=False, token='secret'):
+        body = json.dumps(payload).encode()
+        headers = {'Authorization': f'Bearer {token}'}
+        if compress:
+            body, headers['Content-Encoding'] = gzip.compress(body), 'gzip'
+        return self.client.post('/api/laps/', body, content_type='application/json', headers=headers)
+
+    def test_token_is_required(self):
+        payload = {'car': self.car.id, 'driver': self.bob.id, 'laps': [{'time': '01:19:000'}]}
+        self.assertEqual(self.post(payload, token='wrong').status_code, 401)
+        with override_settings(LEADERBOARD_INGEST={}):
+            self.assertEqual(self.post(payload).status_code, 403)
+        self.assertFalse(LapRecord.objects.exists())
+
+    def test_batches_never_replace_a_faster_entry(self):
+        laps = [
+            Lap(self.alice.id, self.car.game_id, self.car.track_id, self.car.id, timedelta(seconds=seconds), timezone.now())
+            for seconds in (82, 79, 81)
+        ] + [Lap(self.bob.id, self.car.game_id, self.car.track_id, self.car.id, timedelta(seconds=90), timezone.now())]
+        with mock.patch('TimeBoards.services.UPSERT_BATCH', 1):
+            self.assertEqual(submit_laps(laps), (4, 1, 1, 0))
+            self.assertEqual(submit_laps(laps[:1]), (1, 0, 0, 0))
+        times = dict(LeaderboardEntry.objects.values_list('user__name', 'time'))
+        self.assertEqual(times, {'Alice': timedelta(seconds=79), 'Bob': timedelta(seconds=90)})
+
+    def test_batch_keeps_personal_bests(self):
+        response = self.post({'car': self.car.id, 'laps': [
+            {'driver': self.alice.id, 'time': '01:25:000'},
+            {'driver': self.bob.id, 'time_ms': 83000},
+            {'driver': self.bob.id, 'time': '1:21.5'},
+        ]}, compress=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'laps': 3, 'created': 1, 'improved': 0, 'skipped': 0})
+        self.assertEqual(LapRecord.objects.count(), 3)
+        times = dict(LeaderboardEntry.objects.values_list('user__name', 'time'))
+        self.assertEqual(times, {'Alice': timedelta(seconds=80), 'Bob': timedelta(seconds=81, milliseconds=500)})
+        self.assertEqual(TrackRecord.objects.get(car=self.car).entry_count, 2)
+
+    def test_invalid_laps_reject_the_batch(self):
+        response = self.post({'laps': [
+            {'driver': self.alice.id, 'car': self.car.id, 'time': '01:19:000'},
+            {'driver': self.alice.id, 'car': self.car.id + 100, 'time': '01:19:000'},
+            {'driver': self.bob.id, 'car': self.car.id, 'time': 'soon'},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['laps']], [1, 2])
+        self.assertFalse(LapRecord.objects.exists())
+
+    @override_settings(LEADERBOARD_INGEST={'WRITE_BEHIND': True, 'FLUSH_INTERVAL': 3600, 'TOKEN': 'secret'})
+    def test_write_behind_queues_until_flush(self):
+        response = self.post({'car': self.car.id, 'driver': self.alice.id, 'laps': [{'time': '01:19:000'}, {'time': '01:18:000'}]})
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(LapRecord.objects.exists())
+        self.assertEqual(ingest.get_buffer().flush().improved, 1)
+        self.assertEqual(LeaderboardEntry.objects.get(user=self.alice).time, timedelta(seconds=78))
+
+
+@override_settings(STORAGES=STORAGES)
+class PublishTests(TestCase):
+    """Static snapshots are rendered incrementally and served ahead of the views."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.board = make_board()
+        cls.alice, cls.bob = make_people('Alice', 'Bob')
+        submit_lap(cls.alice, *cls.board, timedelta(seconds=80))
+        submit_lap(cls.bob, *cls.board, timedelta(seconds=82))
+        cls.board_url = '/games/{}/tracks/{}/car/{}/times/'.format(*(obj.id for obj in cls.board))
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings = self.settings(LEADERBOARD_PUBLISH={'ROOT': self.root, 'INTERVAL': 3600})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # Nothing may be left for the flush at exit, after the test database is gone
+        self.addCleanup(lambda: publish.get_publisher().flush())
+
+    def read(self, url, extension='html'):
+        with open(publish.page_file(self.root, url, extension)) as f:
+            return f.read()
+
+    def test_publish_is_incremental(self):
+        pages = publish.pages()
+        # Board, two drivers and game, as HTML and JSON, plus three indexes
+        self.assertEqual(len(pages), 11)
+        self.assertEqual(publish.publish(self.root, pages)['rendered'], 11)
+        self.assertNotIn('csrfmiddlewaretoken', self.read(self.board_url))
+        self.assertEqual(publish.publish(self.root, publish.pages())['unchanged'], 11)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            submit_lap(self.bob, *self.board, timedelta(seconds=79))
+        # The board is taken down on commit and served by the view until the next flush
+        self.assertIsNone(publish.find_page(self.root, self.board_url))
+        self.assertContains(self.client.get(self.board_url), '01:19:000')
+        self.assertIn('1 / 2', self.read(f'/people/{self.alice.id}/'))
+        publish.get_publisher().flush()
+        self.assertIn('01:19:000', self.read(self.board_url))
+        self.assertIn('2 / 2', self.read(f'/people/{self.alice.id}/'))
+        self.assertIn('1 / 2', self.read(f'/people/{self.bob.id}/'))
+        self.assertEqual(publish.publish(self.root, publish.pages())['rendered'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.board[2].delete()
+        self.assertFalse(publish.find_page(self.root, self.board_url))
+
+    def test_published_pages_are_served(self):
+        publish.publish(self.root, publish.pages())
+        with self.assertNumQueries(0):
+            response = self.client.get(self.board_url)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertIn(b'01:20:000', b''.join(response.streaming_content))
+        self.assertEqual(json.loads(b''.join(self.client.get(f'/api/drivers/{self.bob.id}/times/').streaming_content))['driver']['name'], 'Bob')
+        # Anything with a query string is rendered by the view, with a working form
+        self.assertContains(self.client.get(self.board_url + '?add'), 'csrfmiddlewaretoken')
+
+
+@override_settings(STORAGES=STORAGES)
+class SearchTests(TestCase):
+    """Names are found by prefix and trigram from memory, and kept current by signals."""
+
+    @classmethod
+    def setUpTestData(cls):
+        make_people('Kimi Räikkönen', 'Kimberly Ross', 'Mika Häkkinen', 'Max Verstappen')
+        cls.game, cls.track, cls.car = make_board(track='Kyalami')
+
+    def setUp(self):
+        cache.get_cache().clear()
+        search.get_index.cache_clear()
+
+    def names(self, text, kinds=('driver',)):
+        return [row['name'] for row in search.get_index().search(text, kinds)]
+
+    def test_matches_prefixes_trigrams_and_accents(self):
+        # Short queries match the start of a word, shorter names first
+        self.assertEqual(self.names('ki'), ['Kimberly Ross', 'Kimi Räikkönen'])
+        self.assertEqual(self.names('RAIKK'), ['Kimi Räikkönen'])
+        self.assertEqual(self.names('kkin'), ['Mika Häkkinen'])
+        self.assertEqual(self.names('verst ma'), ['Max Verstappen'])
+        self.assertEqual(self.names('zz'), [])
+        result, = search.get_index().search('kyal')
+        self.assertEqual((result['kind'], result['url']), ('track', f'/games/{self.game.id}/tracks/'))
+        # Built once, then answered from memory
+        with self.assertNumQueries(0):
+            self.names('max')
+
+    def test_signals_update_built_index(self):
+        self.names('ki')
+        with self.captureOnCommitCallbacks(execute=True):
+            lewis = Person.objects.create(name='Lewis Hamilton')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('hamil'), ['Lewis Hamilton'])
+        with self.captureOnCommitCallbacks(execute=True):
+            lewis.delete()
+        self.assertEqual(self.names('hamil'), [])
+
+    @override_settings(LEADERBOARD_SEARCH={'MAX_NAMES': 2})
+    def test_too_many_names_search_the_database(self):
+        self.assertEqual(self.names('ki'), ['Kimberly Ross', 'Kimi Räikkönen'])
+        self.assertEqual(self.names('kkin'), ['Mika Häkkinen'])
+        self.assertIsNone(search.get_index().load('driver'))
+
+    def test_endpoint(self):
+        response = self.client.get('/api/search/', {'q': 'max', 'kind': 'driver'})
+        result, = response.json()['results']
+        self.assertEqual(result['name'], 'Max Verstappen')
+        self.assertEqual(result['url'], f'/people/{result["id"]}/')
+        self.assertEqual(self.client.get('/api/search/', {'q': 'max', 'kind': 'pilot'}).status_code, 400)
+
+    def test_entry_form_does_not_list_every_driver(self):
+        response = self.client.get(f'/games/{self.game.id}/tracks/{self.track.id}/car/{self.car.id}/times/')
+        self.assertContains(response, 'data-typeahead="/api/search/?kind=driver"')
+        self.assertNotContains(response, 'Verstappen')
+
+    def test_add_entry_form_does_not_list_the_catalog(self):
+        html = str(AddLeaderboardEntryForm())
+        for kind in ('track', 'car', 'driver', 'game'):
+            self.assertIn(f'data-typeahead="/api/search/?kind={kind}"', html)
+        self.assertNotIn('<option', html)
+        self.assertNotIn('Kyalami', html)
+        # A chosen row shows its name again
+        self.assertIn('value="Kyalami"', str(AddLeaderboardEntryForm({'track': self.track.id})['track']))
+
+
+class ConcurrentWriteTests(TransactionTestCase):
+    """Parallel lap submissions on the SQLite profile neither fail nor block reads."""
+
+    WRITERS = 8
+    LAPS = 25
+
+    def setUp(self):
+        self.board = make_board()
+        self.people = make_people(*(f'Driver {i}' for i in range(self.WRITERS)))
+
+    def run_threads(self, targets):
+        errors = []
+
+        def run(target):
+            try:
+                target()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_profile(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_wal_is_switched_on_explicitly(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'db.sqlite3')
+        other = type(connections['default'])({**connection.settings_dict, 'NAME': path}, alias='wal_check')
+        with other.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'delete')
+        other.close()
+        self.assertEqual(enable_wal(path), 'wal')
+        out = io.StringIO()
+        call_command('enable_wal', stdout=out)
+        self.assertIn('uses WAL journaling', out.getvalue())
+
+    def test_parallel_writers(self):
+        done = threading.Event()
+        reads = []
+
+        def writer(person):
+            def write():
+                for lap in range(self.LAPS):
+                    # Every other lap is faster, so entries are updated too
+                    submit_lap(person, *self.board, timedelta(seconds=90 - lap // 2, milliseconds=person.pk))
+                    # Read then write in one transaction, like an admin edit: a
+                    # deferred BEGIN fails here when another writer got in between
+                    with transaction.atomic():
+                        driver = Person.objects.get(pk=person.pk)
+                        driver.name = f'Driver {person.pk} ({lap})'
+                        driver.save()
+            return write
+
+        def reader():
+            while not done.is_set():
+                reads.append(LeaderboardEntry.objects.filter(car=self.board[2]).count())
+
+        reader_errors = []
+        reader_thread = threading.Thread(target=lambda: reader_errors.extend(self.run_threads([reader])))
+        reader_thread.start()
+        errors = self.run_threads([writer(person) for person in self.people])
+        done.set()
+        reader_thread.join()
+        errors += reader_errors
+
+        self.assertEqual(errors, [])
+        self.assertEqual(LapRecord.objects.count(), self.WRITERS * self.LAPS)
+        self.assertEqual(LeaderboardEntry.objects.count(), self.WRITERS)
+        self.assertEqual(set(LeaderboardEntry.objects.values_list('time', flat=True)),
+                         {timedelta(seconds=90 - (self.LAPS - 1) // 2, milliseconds=person.pk) for person in self.people})
+        self.assertTrue(reads)
@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import include, path
 from . import views
 
 
@@ -12,5 +12,15 @@ urlpatterns = [
     path('games/<int:game_id>/tracks/<int:track_id>/car/<int:car_id>/times/', views.track_times, name='track_times'),
     path('people/<int:person_id>/', views.person_times, name='person_times'),
     path('people/', views.people, name='people'),
+    path('standings/', views.standings, name='standings'),
+    path('stats/cache/', views.cache_stats, name='cache_stats'),
+    path('stats/queries/', views.query_stats, name='query_stats'),
+    path('games/<int:game_id>/tracks/<int:track_id>/car/<int:car_id>/times/export/', views.export_track_times, name='export_track_times'),
+    path('car/<int:car_id>/export/', views.export_car_times, name='export_car_times'),
+    path('people/<int:person_id>/export/', views.export_person_times, name='export_person_times'),
+    path('games/<int:game_id>/tracks/<int:track_id>/car/<int:car_id>/times/live/', views.board_stream, name='board_stream'),
+    path('live/', views.live_feed, name='live_feed'),
+    path('export/', views.export_all_times, name='export_all_times'),
+    path('api/', include('TimeBoards.api_urls')),
     
 ]
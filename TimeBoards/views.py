@@ -1,120 +1,237 @@
 # views.py
 
-from django.shortcuts import render, redirect, get_object_or_404
-from .models import LeaderboardEntry, Track, Car, Game, Person
-from .forms import LeaderboardEntryForm, GameForm, AddTrackForm, PersonForm
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.paginator import Paginator
+from django.db.models import Count, Max, Sum
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import condition
+from . import cache, exports, instrumentation, live
+from .models import DriverBoardStat, LeaderboardEntry, Track, Car, Game, Person, Standing, TrackRecord
+from .forms import LeaderboardEntryForm, AddLeaderboardEntryForm, GameForm, AddTrackForm, PersonForm
+from .instrumentation import query_budget
+from .leaderboards import get_backend
+from .services import submit_lap
+from .templatetags.json_extras import settings_html
 from datetime import timedelta
+from functools import wraps
+import hashlib
 import json
 
-def homepage(request):
-    # Fetching the fastest time for each track and car combination
-    entries = LeaderboardEntry.objects.all().select_related('track', 'car', 'game').order_by('track', 'car', 'time')
-    top_times = {}
+#conditional GET
+def conditional_page(validators):
+    """
+    Answers GET/HEAD with 304 Not Modified when the page is unchanged.
+    validators(*args) is a coroutine returning (last_modified, row_count,
+    version_tag) for the data behind the page; it runs once per request,
+    before the async view.
+    """
+    def etag(request, *args, **kwargs):
+        last_modified, count, version = request._page_validators
+        return hashlib.md5(f'{last_modified}|{count}|{version}'.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        return request._page_validators[0]
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        # Django's condition() calls the validators synchronously, so they
+        # are awaited first and read back from the request
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            request._page_validators = await validators(*args, **kwargs)
+            return await conditional_view(request, *args, **kwargs)
+        return inner
+    return decorator
+
+# Renames and catalog edits don't touch logged_at, so the cache versions
+# of those scopes are folded into the ETag as well.
+async def homepage_validators():
+    # TrackRecord has one small row per board, refreshed on every write to it
+    found = await TrackRecord.objects.aaggregate(last_modified=Max('updated_at'), count=Sum('entry_count'))
+    return found['last_modified'], found['count'], await cache.aversion_tag(cache.PEOPLE, cache.CATALOG)
+
+async def board_validators(game_id, track_id, car_id):
+    found = await LeaderboardEntry.objects.filter(game_id=game_id, track_id=track_id, car_id=car_id).aaggregate(
+        last_modified=Max('logged_at'), count=Count('id'),
+    )
+    return found['last_modified'], found['count'], await cache.aversion_tag(cache.PEOPLE, cache.CATALOG)
+
+async def person_validators(person_id):
+    # Ranks depend on rivals too, so every board the driver is on counts
+    driver_cars = LeaderboardEntry.objects.filter(user_id=person_id).values('car_id')
+    found = await LeaderboardEntry.objects.filter(car_id__in=driver_cars).aaggregate(
+        last_modified=Max('logged_at'), count=Count('id'),
+    )
+    return found['last_modified'], found['count'], await cache.aversion_tag(cache.person_scope(person_id), cache.CATALOG)
 
-    for entry in entries:
-        key = (entry.track, entry.car, entry.game)
-        if key not in top_times:
-            top_times[key] = entry
+# Read views are async: lookups, validators and cache versions use the async
+# ORM and cache. Templates still read lazily inside cached fragments, which is
+# sync ORM work, so rendering runs in a worker thread off the event loop.
+arender = sync_to_async(render)
 
-    return render(request, 'TimeBoards/homepage.html', {'entries': top_times.values()})
+@query_budget(2)
+@conditional_page(homepage_validators)
+async def homepage(request):
+    # Fetching the fastest time for each track and car combination
+    records = TrackRecord.objects.select_related('holder', 'game', 'track', 'car')
+    return await arender(request, 'TimeBoards/homepage.html', {
+        'records': records,
+        'cache_name': 'homepage',
+        'cache_version': await cache.aversion_tag(cache.RECORDS, cache.PEOPLE, cache.CATALOG),
+    })
 
-def track_leaderboard(request, track_id, car_id):
-    # Fetching the fastest times for a specific track and car combination
-    entries = LeaderboardEntry.objects.filter(track_id=track_id, car_id=car_id).select_related('car', 'game').order_by('time')[:10]
-    track = Track.objects.get(id=track_id)
-    car = Car.objects.get(id=car_id)
-    return render(request, 'TimeBoards/track_leaderboard.html', {'track': track, 'car': car, 'entries': entries})
+LEADERBOARD_SIZE = 10
 
-def car_leaderboard(request, car_id):
-    # Fetching the fastest times for a specific car across all tracks
-    entries = LeaderboardEntry.objects.filter(car_id=car_id).select_related('track', 'game').order_by('time')[:10]
-    car = Car.objects.get(id=car_id)
-    return render(request, 'TimeBoards/car_leaderboard.html', {'car': car, 'entries': entries})
+@query_budget(2)
+async def track_leaderboard(request, track_id, game_id=None):
+    # Fetching the fastest times on a track, whatever the car
+    tracks = Track.objects.select_related('game')
+    if game_id is not None:
+        tracks = tracks.filter(game_id=game_id)
+    track = await aget_object_or_404(tracks, id=track_id)
+    entries = LeaderboardEntry.objects.filter(track_id=track.id).select_related('user', 'car').order_by('time', 'user_id')[:LEADERBOARD_SIZE]
+    return await arender(request, 'TimeBoards/track_leaderboard.html', {'track': track, 'entries': entries})
+
+@query_budget(2)
+async def car_leaderboard(request, car_id):
+    # Fetching the fastest times with a specific car, on the one track it runs
+    car = await aget_object_or_404(Car.objects.select_related('game', 'track'), id=car_id)
+    entries = LeaderboardEntry.objects.filter(car_id=car.id).select_related('user').order_by('time', 'user_id')[:LEADERBOARD_SIZE]
+    return await arender(request, 'TimeBoards/car_leaderboard.html', {'car': car, 'entries': entries})
 
 def add_leaderboard_entry(request):
     if request.method == 'POST':
-        form = LeaderboardEntryForm(request.POST)
+        form = AddLeaderboardEntryForm(request.POST)
         if form.is_valid():
-            form.save()
+            data = form.cleaned_data
+            submit_lap(data['user'], data['game'], data['track'], data['car'], data['time'])
             return redirect('homepage')  # Adjust the redirect as necessary
     else:
-        form = LeaderboardEntryForm()
+        form = AddLeaderboardEntryForm()
     return render(request, 'TimeBoards/add_leaderboard_entry.html', {'form': form})
 
-def track_times(request, game_id, track_id, car_id):
+def get_board_or_404(game_id, track_id, car_id):
     game = get_object_or_404(Game, id=game_id)
     track = get_object_or_404(Track, id=track_id, game=game)
     car = get_object_or_404(Car, id=car_id, game=game, track=track)
-    times = LeaderboardEntry.objects.filter(track=track, car=car, game=game).order_by('time')
+    return game, track, car
+
+def get_cached_board_or_404(game_id, track_id, car_id):
+    return cache.fetch(
+        f'board:{game_id}:{track_id}:{car_id}',
+        cache.version_tag(cache.CATALOG),
+        lambda: get_board_or_404(game_id, track_id, car_id),
+    )
+
+async def aget_board_or_404(game_id, track_id, car_id):
+    game = await aget_object_or_404(Game, id=game_id)
+    track = await aget_object_or_404(Track, id=track_id, game=game)
+    car = await aget_object_or_404(Car, id=car_id, game=game, track=track)
+    return game, track, car
+
+async def aget_cached_board_or_404(game_id, track_id, car_id):
+    return await cache.afetch(
+        f'board:{game_id}:{track_id}:{car_id}',
+        await cache.aversion_tag(cache.CATALOG),
+        lambda: aget_board_or_404(game_id, track_id, car_id),
+    )
+
+def submit_board_form(request, game, track, car):
+    """Handles a lap posted on a board page; returns a redirect or the bound form."""
+    form = LeaderboardEntryForm(request.POST)
+    if form.is_valid():
+        submit_lap(form.cleaned_data['user'], game, track, car, form.cleaned_data['time'])
+        return redirect('track_times', game_id=game.id, track_id=track.id, car_id=car.id)
+    return form
+
+@query_budget(5)
+@conditional_page(board_validators)
+async def track_times(request, game_id, track_id, car_id):
+    game, track, car = await aget_cached_board_or_404(game_id, track_id, car_id)
+    times = get_backend().entries((game.id, track.id, car.id))
 
     if request.method == 'POST':
-        form = LeaderboardEntryForm(request.POST)
-        if form.is_valid():
-            user = form.cleaned_data['user']
-            minutes = form.cleaned_data['minutes']
-            seconds = form.cleaned_data['seconds']
-            milliseconds = form.cleaned_data['milliseconds']
-
-            new_time = timedelta(minutes=int(minutes), seconds=int(seconds), milliseconds=int(milliseconds))
-
-            try:
-                existing_entry = LeaderboardEntry.objects.get(track=track, car=car, user=user, game=game)
-                if new_time < existing_entry.time:
-                    existing_entry.time = new_time
-                    existing_entry.save()
-            except LeaderboardEntry.DoesNotExist:
-                entry = form.save(commit=False)
-                entry.track = track
-                entry.car = car
-                entry.game = game
-                entry.time = new_time
-                entry.save()
-
-            return redirect('track_times', game_id=game_id, track_id=track_id, car_id=car_id)
+        form = await sync_to_async(submit_board_form)(request, game, track, car)
+        if not isinstance(form, LeaderboardEntryForm):
+            return form
     else:
         form = LeaderboardEntryForm()
 
-    return render(request, 'TimeBoards/track_times.html', {'game': game, 'track': track, 'car': car, 'times': times, 'form': form})
+    return await arender(request, 'TimeBoards/track_times.html', {
+        'game': game, 'track': track, 'car': car, 'times': times, 'form': form,
+        'cache_name': f'track_times:{game.id}:{track.id}:{car.id}',
+        'cache_version': await cache.aversion_tag(cache.board_scope(game.id, track.id, car.id), cache.PEOPLE),
+    })
 
-def games(request):
-    all_games = Game.objects.all()
-    return render(request, 'TimeBoards/games.html', {'games': all_games})
+TRACKS_PER_PAGE = 50
 
-def tracks(request, game_id):
-    game = get_object_or_404(Game, id=game_id)
-    tracks = Track.objects.filter(game=game)
-    tracks_with_cars = []
+def list_board_catalog(game_id, page_number):
+    # One joined query over the small TrackRecord table, plus the paginator's count
+    combos = Car.objects.filter(game_id=game_id).order_by('track__name', 'name', 'id').values(
+        'id', 'name', 'track_id', 'track__name',
+        'trackrecord__entry_count', 'trackrecord__record_time', 'trackrecord__holder__name',
+    )
+    page = Paginator(combos, TRACKS_PER_PAGE).get_page(page_number)
+    return {
+        'combos': [
+            dict(row, record_time=LeaderboardEntry.format_duration(row['trackrecord__record_time']) if row['trackrecord__record_time'] else None)
+            for row in page.object_list
+        ],
+        'number': page.number,
+        'num_pages': page.paginator.num_pages,
+    }
 
-    for track in tracks:
-        cars = Car.objects.filter(game=game, track=track)
-        for car in cars:
-            tracks_with_cars.append((track, car))
+async def load_game(game_id):
+    game = await aget_object_or_404(Game, id=game_id)
+    # GameForm keeps settings an object with a 'gameSettings' object inside
+    return game, await sync_to_async(settings_html)(game.settings.get('gameSettings', {}))
 
-    if request.method == 'POST':
-        form = AddTrackForm(request.POST)
-        if form.is_valid():
-            track_name = form.cleaned_data['track_name']
-            car_name = form.cleaned_data['car_name']
+def add_board(request, game):
+    """Handles the new track and car form; returns a redirect or the bound form."""
+    form = AddTrackForm(request.POST)
+    if form.is_valid():
+        track = Track.objects.create(name=form.cleaned_data['track_name'], game=game)
+        Car.objects.create(name=form.cleaned_data['car_name'], game=game, track=track)
+        return redirect('tracks', game_id=game.id)
+    return form
+
+@query_budget(3)
+async def tracks(request, game_id):
+    catalog_version = await cache.aversion_tag(cache.CATALOG)
+    game, game_settings_html = await cache.afetch(f'game:{game_id}', catalog_version, lambda: load_game(game_id))
 
-            track = Track.objects.create(name=track_name, game=game)
-            car = Car.objects.create(name=car_name, game=game, track=track)
-            return redirect('tracks', game_id=game.id)
+    if request.method == 'POST':
+        form = await sync_to_async(add_board)(request, game)
+        if not isinstance(form, AddTrackForm):
+            return form
     else:
         form = AddTrackForm()
 
-    # Ensure game.settings is a dictionary
-    game_settings = json.loads(game.settings) if isinstance(game.settings, str) else game.settings
+    try:
+        page_number = int(request.GET.get('page', 1))
+    except ValueError:
+        page_number = 1
+    catalog_version = await cache.aversion_tag(cache.CATALOG, cache.game_scope(game.id))
+    # Paginator has no async API; the listing only runs on a cache miss
+    page = await cache.afetch(f'tracks:{game.id}:{page_number}', catalog_version,
+                              lambda: sync_to_async(list_board_catalog)(game.id, page_number))
 
-    # Access the nested 'gameSettings' key
-    game_settings = game_settings.get('gameSettings', {})
-
-    return render(request, 'TimeBoards/tracks.html', {
+    return await arender(request, 'TimeBoards/tracks.html', {
         'game': game,
-        'tracks_with_cars': tracks_with_cars,
+        'page': page,
         'form': form,
-        'game_settings': game_settings
+        'game_settings_html': game_settings_html,
+        'cache_name': f'tracks:{game.id}:{page["number"]}',
+        'cache_version': catalog_version,
     })
 
+@query_budget(1)
 def people(request):
     all_people = Person.objects.all()
     if request.method == 'POST':
@@ -124,20 +241,147 @@ def people(request):
             return redirect('people') 
     else:
         form = PersonForm()
-    return render(request, 'TimeBoards/people.html', {'people': all_people, 'form': form})
+    return render(request, 'TimeBoards/people.html', {
+        'people': all_people,
+        'form': form,
+        'cache_name': 'people',
+        'cache_version': cache.version_tag(cache.PEOPLE),
+    })
 
-def person_times(request, person_id):
-    person = get_object_or_404(Person, id=person_id)
-    times = LeaderboardEntry.objects.filter(user=person).order_by('time')
-    return render(request, 'TimeBoards/person_times.html', {'person': person, 'times': times})
+RECENT_DAYS = 30
+
+def driver_profile(person):
+    # One read of the rollup table; ranks were computed when the boards changed
+    stats = list(DriverBoardStat.objects.profile(person))
+    since = timezone.now() - timedelta(days=RECENT_DAYS)
+    improvements = [stat for stat in stats if stat.previous_time and stat.improved_at >= since]
+    return {
+        'boards': stats,
+        'records': sum(stat.rank == 1 for stat in stats),
+        'podiums': sum(stat.rank <= 3 for stat in stats),
+        'average_gap': LeaderboardEntry.format_duration(sum((stat.gap for stat in stats), timedelta()) / len(stats)) if stats else None,
+        'improvements': sorted(improvements, key=lambda stat: stat.improved_at, reverse=True)[:10],
+    }
+
+@query_budget(4)
+@conditional_page(person_validators)
+async def person_times(request, person_id):
+    person_version = await cache.aversion_tag(cache.person_scope(person_id))
+    person = await cache.afetch(f'person:{person_id}', person_version, lambda: aget_object_or_404(Person, id=person_id))
+
+    async def driver_boards():
+        return [board async for board in LeaderboardEntry.objects.filter(user=person).values_list('game_id', 'track_id', 'car_id')]
+
+    # Ranks depend on rivals too, so the page follows every board the driver is on
+    boards = await cache.afetch(f'person_boards:{person_id}', person_version, driver_boards)
+    return await arender(request, 'TimeBoards/person_times.html', {
+        'person': person,
+        # Only read when the cached fragment misses
+        'profile': SimpleLazyObject(lambda: driver_profile(person)),
+        'recent_days': RECENT_DAYS,
+        'cache_name': f'person_times:{person.id}',
+        'cache_version': await cache.aversion_tag(cache.person_scope(person.id), cache.CATALOG, *(cache.board_scope(*board) for board in boards)),
+    })
 #games
-def games(request):
+def create_game(request):
+    """Handles the new game form; returns a redirect or the bound form."""
+    form = GameForm(request.POST)
+    if form.is_valid():
+        form.save()
+        return redirect('games')
+    return form
+
+@query_budget(1)
+async def games(request):
     if request.method == 'POST':
-        form = GameForm(request.POST)
-        if form.is_valid():
-            form.save()
-            return redirect('games') 
+        form = await sync_to_async(create_game)(request)
+        if not isinstance(form, GameForm):
+            return form
     else:
         form = GameForm()
     games = Game.objects.all()
-    return render(request, 'TimeBoards/games.html', {'games': games, 'form': form})
+    return await arender(request, 'TimeBoards/games.html', {
+        'games': games,
+        'form': form,
+        'cache_name': 'games',
+        'cache_version': await cache.aversion_tag(cache.CATALOG),
+    })
+
+#standings
+STANDINGS_PER_PAGE = 50
+
+@query_budget(2)
+def standings(request):
+    rows = Standing.objects.select_related('user')
+    page = Paginator(rows, STANDINGS_PER_PAGE).get_page(request.GET.get('page'))
+    return render(request, 'TimeBoards/standings.html', {
+        'page': page,
+        'cache_name': f'standings:{page.number}',
+        'cache_version': cache.version_tag(cache.STANDINGS, cache.PEOPLE),
+    })
+
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse(cache.cache_stats())
+
+@staff_member_required
+def query_stats(request):
+    return JsonResponse(instrumentation.stats.summary())
+
+#exports
+def stream_export(request, entries, filename):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        raise Http404("Unknown export format")
+    lines = exports.aexport_lines if isinstance(request, ASGIRequest) else exports.export_lines
+    response = StreamingHttpResponse(lines(entries, fmt), content_type=exports.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+def export_track_times(request, game_id, track_id, car_id):
+    game, track, car = get_board_or_404(game_id, track_id, car_id)
+    return stream_export(request, exports.board_entries(game.id, track.id, car.id), f'times-{game.id}-{track.id}-{car.id}')
+
+def export_car_times(request, car_id):
+    car = get_object_or_404(Car, id=car_id)
+    return stream_export(request, exports.car_entries(car.id), f'car-{car.id}')
+
+def export_person_times(request, person_id):
+    person = get_object_or_404(Person, id=person_id)
+    return stream_export(request, exports.person_entries(person.id), f'person-{person.id}')
+
+def export_all_times(request):
+    return stream_export(request, exports.all_entries(), 'times')
+
+#live streams
+KEEPALIVE_SECONDS = 15
+
+async def live_events(channel):
+    # Subscribes on first iteration, so inside the server's event loop
+    subscription = live.get_bus().subscribe(channel)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            message = await subscription.get(timeout=KEEPALIVE_SECONDS)
+            if message is None:
+                yield ': keepalive\n\n'
+            else:
+                yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+    finally:
+        subscription.close()
+
+def live_response(request, channel):
+    if not isinstance(request, ASGIRequest):
+        # A WSGI worker would buffer the endless stream instead of sending it
+        return HttpResponse("Live streams need the ASGI server.", status=501, content_type='text/plain')
+    response = StreamingHttpResponse(live_events(channel), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+async def board_stream(request, game_id, track_id, car_id):
+    game, track, car = await aget_cached_board_or_404(game_id, track_id, car_id)
+    return live_response(request, live.board_channel(game.id, track.id, car.id))
+
+async def live_feed(request):
+    return live_response(request, live.FEED)
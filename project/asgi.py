@@ -3,6 +3,16 @@ ASGI config for project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is how the site is deployed (see the Procfile): gunicorn manages the
+processes and each runs uvicorn's event loop, so the async read views can
+wait on the database and cache without holding a worker:
+
+    gunicorn project.asgi:application -k uvicorn.workers.UvicornWorker
+
+Set WEB_CONCURRENCY for the number of processes. ``python manage.py
+benchmark_concurrency`` compares concurrent viewers served this way and
+through project.wsgi, which still works for any WSGI server.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 
 #test
 MIDDLEWARE = [
+    'TimeBoards.instrumentation.QueryTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,9 +59,10 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'project.urls'
 
+# DjangoTemplates that reports render time to QueryTimingMiddleware
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'TimeBoards.instrumentation.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -79,13 +82,104 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# TimeBoards.sqlite runs SQLite with BEGIN IMMEDIATE writes, so stations
+# submitting laps at once queue instead of failing with "database is locked".
+# Readers only stop blocking writers in WAL mode, which is kept in the
+# database file: run `manage.py enable_wal` once on the deployed database.
+# The bundled db.sqlite3 stays in rollback mode, so commands and test runs
+# leave it untouched. Tests use a file too, created in WAL mode, since
+# concurrent writers need one.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'TimeBoards.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Board, driver and catalog pages are cached per scope, see TimeBoards/cache.py.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'timeboards',
     }
 }
 
+TIMEBOARDS_CACHE_TIMEOUT = 300
+
+# Scope versions are bumped by the worker that wrote, so with several workers
+# they must share the cache or the others serve stale pages until the timeout.
+# Files on local disk are shared by every worker of a dyno; REDIS_URL below
+# shares them across dynos too.
+
+if int(os.environ.get('WEB_CONCURRENCY') or 1) > 1:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'timeboards-cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
+# Leaderboard storage used for board reads, see TimeBoards/leaderboards.py.
+# The database stays the source of truth; with REDIS_URL set every board is
+# mirrored into a Redis sorted set instead. Use {'FAKE': True} as OPTIONS for
+# an in-process Redis stand-in.
+
+LEADERBOARD_BACKEND = {
+    'BACKEND': 'TimeBoards.leaderboards.DatabaseBackend',
+}
+
+# Live streams reach the viewers of one process; with REDIS_URL set updates
+# are relayed through Redis pub/sub so every worker sees every write.
+
+LEADERBOARD_LIVE = {
+    'BACKEND': 'TimeBoards.live.LocalBus',
+}
+
+# Batch lap ingest at api/laps/, see TimeBoards/ingest.py. Write-behind trades
+# durability of the last FLUSH_INTERVAL seconds for responses that skip commits.
+# The endpoint refuses every request until TIMEBOARDS_INGEST_TOKEN is set.
+
+LEADERBOARD_INGEST = {
+    'WRITE_BEHIND': os.environ.get('TIMEBOARDS_INGEST_WRITE_BEHIND') == '1',
+    'FLUSH_INTERVAL': 1.0,
+    'TOKEN': os.environ.get('TIMEBOARDS_INGEST_TOKEN'),
+}
+
+# Static snapshots of the pages, see TimeBoards/publish.py. Off unless a
+# directory is given; fill it with `manage.py publish_static` after a deploy.
+
+LEADERBOARD_PUBLISH = {
+    'ROOT': os.environ.get('TIMEBOARDS_PUBLISH_ROOT'),
+    'INTERVAL': 1.0,
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+    }
+    LEADERBOARD_BACKEND = {
+        'BACKEND': 'TimeBoards.leaderboards.RedisBackend',
+        'OPTIONS': {'CACHE_ALIAS': 'default'},
+    }
+    LEADERBOARD_LIVE = {
+        'BACKEND': 'TimeBoards.live.RedisBus',
+        'OPTIONS': {'URL': os.environ['REDIS_URL']},
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -129,4 +223,18 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 import django_heroku
 
-django_heroku.settings(locals())
\ No newline at end of file
+django_heroku.settings(locals())
+
+# django_heroku puts the sync-only WhiteNoise middleware in front; swap in the
+# async-capable subclass so ASGI requests stay async, see TimeBoards/middleware.py.
+MIDDLEWARE = ['TimeBoards.middleware.StaticFilesMiddleware'] + [
+    middleware for middleware in MIDDLEWARE if middleware != 'whitenoise.middleware.WhiteNoiseMiddleware'
+]
+
+# Name search for the typeaheads, see TimeBoards/search.py. Each process holds
+# up to MAX_NAMES drivers (and as many of each catalog kind) in memory; larger
+# tables are searched in the database.
+
+LEADERBOARD_SEARCH = {
+    'MAX_NAMES': 100_000,
+}